@@ -0,0 +1,77 @@
+import base64
+import math
+
+GEOMETRY_TYPES = {"Point": 1, "MultiPoint": 2, "LineString": 3,
+                  "MultiLineString": 4, "Polygon": 5, "MultiPolygon": 6}
+
+
+class GeometryEncoder(object):
+    """
+    Encodes geometries as a stream of varints: each geometry is a type code
+    followed by its part counts and coordinates. Coordinates are quantized
+    to an integer grid and stored as zigzag-encoded deltas from the
+    previous coordinate, so neighbouring vertices take a byte or two each
+    """
+
+    def __init__(self, step, origin=(0, 0)):
+        self.step = step
+        self.origin = (math.floor(origin[0] / step) * step,
+                       math.floor(origin[1] / step) * step)
+        self.buffer = bytearray()
+        self.x = 0
+        self.y = 0
+
+    def addGeometry(self, geomType, parts):
+        """
+        Adds a geometry given as nested lists of (x, y) tuples, following
+        the GeoJSON nesting for its type, or a null geometry if geomType is
+        None
+        """
+        if geomType not in GEOMETRY_TYPES:
+            self._varint(0)
+            return
+        self._varint(GEOMETRY_TYPES[geomType])
+        if geomType == "Point":
+            self._point(parts)
+        elif geomType in ("MultiPoint", "LineString"):
+            self._points(parts)
+        elif geomType in ("MultiLineString", "Polygon"):
+            self._varint(len(parts))
+            for part in parts:
+                self._points(part)
+        else:
+            self._varint(len(parts))
+            for polygon in parts:
+                self._varint(len(polygon))
+                for ring in polygon:
+                    self._points(ring)
+
+    def encode(self):
+        """Returns everything encoded so far as base64 text"""
+        return base64.b64encode(bytes(self.buffer)).decode("ascii")
+
+    def transform(self):
+        return {"scale": [self.step, self.step],
+                "translate": list(self.origin)}
+
+    def _points(self, points):
+        self._varint(len(points))
+        for point in points:
+            self._point(point)
+
+    def _point(self, point):
+        x = int(round((point[0] - self.origin[0]) / self.step))
+        y = int(round((point[1] - self.origin[1]) / self.step))
+        self._zigzag(x - self.x)
+        self._zigzag(y - self.y)
+        self.x = x
+        self.y = y
+
+    def _zigzag(self, value):
+        self._varint(value * 2 if value >= 0 else -value * 2 - 1)
+
+    def _varint(self, value):
+        while value > 0x7f:
+            self.buffer.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.buffer.append(value)
@@ -68,7 +68,23 @@ def getParams(configure_exporter_action=None):
         "Data export": {
             "Precision": ("maintain", "1", "2", "3", "4", "5", "6", "7", "8",
                           "9", "10", "11", "12", "13", "14", "15"),
-            "Minify GeoJSON files": True
+            "Minify GeoJSON files": True,
+            "Export only used attributes": False,
+            "Evaluate rules on export": False,
+            "Pre-compress files": False,
+            "Raster encoding": ("PNG", "Automatic", "Palette PNG", "JPEG",
+                                "WebP"),
+            "Raster format": ("Single image", "PNG tiles", "JPEG tiles",
+                              "WebP tiles"),
+            "Raster quality": ("85", "95", "90", "80", "75", "70", "60",
+                               "50"),
+            "Raster resampling": ("Cubic", "Bilinear", "Nearest neighbour",
+                                  "Lanczos", "Average"),
+            "Reuse unchanged layers": False,
+            "Simplify geometries": ("None", "Douglas-Peucker", "Visvalingam",
+                                    "Snap to grid (keep topology)"),
+            "Vector format": ("GeoJSON", "Vector tiles", "TopoJSON",
+                              "Compact binary", "Chunked GeoJSON")
         },
         "Scale/Zoom": {
             "Extent": ("Canvas extent", "Fit to layers extent"),
@@ -1,8 +1,12 @@
-from qgis.core import QgsExpression, QgsExpressionNode, QgsMessageLog, Qgis
+from qgis.core import QgsExpression, QgsExpressionNode
+import os
 import re
 import json
+import threading
 
-whenfunctions = []
+# One compiler per expressions file being written
+compilers = {}
+compilersLock = threading.Lock()
 
 binary_ops = [
     "||", "&&",
@@ -14,6 +18,16 @@ binary_ops = [
 
 unary_ops = ["!", "-"]
 
+# The helper stubbing a QGIS function which has no JS version
+stub_template = """function %s(values, context) {
+    return false;
+};
+"""
+# A call to one of the fnc_* helpers, and a helper defined in a library
+helper_call = re.compile(r"\b(fnc_\w+)\(")
+helper_definition = re.compile(r"^function (fnc_\w+)\(.*?^\};?[ \t]*$",
+                               re.M | re.S)
+
 
 def gen_func_stubs():
     """
@@ -21,15 +35,11 @@ def gen_func_stubs():
     """
     funcs = QgsExpression.Functions()
     functions = []
-    temp = """function %s(values, context) {
-    return false;
-};
-"""
     for func in funcs:
         name = func.name()
         if name.startswith("$"):
             continue
-        newfunc = temp % ("fnc_" + name)
+        newfunc = stub_template % ("fnc_" + name)
         functions.append(newfunc)
     return "\n".join(functions)
 
@@ -45,8 +55,6 @@ def exp2func(expstr, name=None, mapLib=None):
     """
     Convert a QgsExpression into a JS function.
     """
-    global whenfunctions
-    whenfunctions = []
     exp = QgsExpression(expstr)
     js = walkExpression(exp.rootNode(), mapLib=mapLib)
     if name is None:
@@ -59,7 +67,6 @@ function %s(context) {
     // %s
 
     var feature = context.feature;
-    %s
     if (feature.properties) {
         return %s;
     } else {
@@ -67,7 +74,6 @@ function %s(context) {
     }
 }""" % (name,
         exp.dump(),
-        "\n".join(whenfunctions),
         js,
         js.replace("feature.properties['", "feature['"))
     return temp, name, exp.dump()
@@ -94,43 +100,16 @@ def walkExpression(node, mapLib):
 
 
 def handle_condition(node, mapLib):
-    global condtioncounts
-    subexps = re.findall(r"WHEN(\s+.*?\s+)THEN(\s+.*?\s+)", node.dump())
-    QgsMessageLog.logMessage(subexps, "qgis2web", level=Qgis.Info)
-    count = 1
-    js = ""
-    for sub in subexps:
-        when = sub[0].strip()
-        then = sub[1].strip()
-        QgsMessageLog.logMessage(then, "qgis2web", level=Qgis.Info)
-        whenpart = QgsExpression(when)
-        thenpart = QgsExpression(then)
-        whenjs = walkExpression(whenpart.rootNode(), mapLib)
-        thenjs = walkExpression(thenpart.rootNode(), mapLib)
-        style = "if" if count == 1 else "else if"
-        js += """
-        %s %s {
-          return %s;
-        }
-        """ % (style, whenjs, thenjs)
-        js = js.strip()
-        count += 1
-
-    elsejs = "null"
-    if "ELSE" in node.dump():
-        elseexps = re.findall(r"ELSE(\s+.*?\s+)END", node.dump())
-        elsestr = elseexps[0].strip()
-        exp = QgsExpression(elsestr)
-        elsejs = walkExpression(exp.rootNode(), mapLib)
-    funcname = "_CASE()"
-    temp = """function %s {
-    %s
-    else {
-     return %s;
-    }
-    };""" % (funcname, js, elsejs)
-    whenfunctions.append(temp)
-    return funcname
+    # Each WHEN ... THEN becomes a conditional expression, nested in order,
+    # so a CASE compiles inline without any helper function
+    js = "null"
+    if node.elseExp() is not None:
+        js = walkExpression(node.elseExp(), mapLib)
+    for condition in reversed(node.conditions()):
+        js = "(%s ? %s : %s)" % (walkExpression(condition.whenExp(), mapLib),
+                                 walkExpression(condition.thenExp(), mapLib),
+                                 js)
+    return js
 
 
 def handle_binary(node, mapLib):
@@ -270,18 +249,99 @@ def render_examples():
         f.writelines("\n\n".join(lines))
 
 
+class ExpressionCompiler(object):
+    """
+    Compiles the expressions written to one file. Each expression is
+    compiled once per mapping library, however many rules, labels or
+    layers use it, and the functions are kept until write() adds them all
+    to the file at once, along with just the fnc_* helpers they call. Safe
+    to use from several threads
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.names = {}
+        self.functions = []
+        self.helpers = set()
+        self.lock = threading.Lock()
+
+    def compile(self, exp, name=None, mapLib=None):
+        """Returns the name of the JS function evaluating exp"""
+        key = (exp, mapLib)
+        with self.lock:
+            if key in self.names:
+                return self.names[key]
+        functionjs, name, _ = compile(exp, name=name, mapLib=mapLib)
+        with self.lock:
+            if key not in self.names:
+                self.names[key] = name
+                self.functions.append(functionjs)
+                self.helpers.update(helper_call.findall(functionjs))
+            return self.names[key]
+
+    def write(self):
+        """
+        Replaces the helper library copied to the file with the helpers the
+        compiled functions need, followed by the functions
+        """
+        with self.lock:
+            functions = self.functions
+            helpers = self.helpers
+            self.functions = []
+            self.helpers = set()
+        library = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                for match in helper_definition.finditer(f.read()):
+                    library[match.group(1)] = match.group(0)
+        # helpers can call other helpers
+        needed = set()
+        while helpers:
+            helper = helpers.pop()
+            if helper in needed:
+                continue
+            needed.add(helper)
+            if helper in library:
+                helpers.update(helper_call.findall(library[helper]))
+        # keep the library's order, and stub anything it lacks
+        js = [library[helper] for helper in library if helper in needed]
+        js += [stub_template.strip() % helper
+               for helper in sorted(needed - set(library))]
+        with open(self.filename, "w") as f:
+            f.write("\n\n".join(js + [function.strip()
+                                       for function in functions]) + "\n")
+
+
 def compile_to_file(exp, name=None, mapLib=None, filename="expressions.js"):
     """
-    Generate JS function to file from exp and append it to the end of the given file name.
+    Compile exp to a JS function to be added to the end of the given file
+    name by write_expressions().
     :param exp: The expression to export to JS
     :return: The name of the function you can call.
     """
-    functionjs, name, _ = compile(exp, name=name, mapLib=mapLib)
-    with open(filename, "a") as f:
-        f.write("\n\n")
-        f.write(functionjs)
+    key = os.path.abspath(filename)
+    with compilersLock:
+        if key not in compilers:
+            compilers[key] = ExpressionCompiler(filename)
+        compiler = compilers[key]
+    return compiler.compile(exp, name=name, mapLib=mapLib)
+
 
-    return name
+def write_expressions(filename):
+    """
+    Write every function compiled for the given file name to it, with the
+    helpers they call, and forget them. If nothing was compiled for it the
+    file is removed instead.
+    :return: Whether the file was written, so pages need to load it.
+    """
+    with compilersLock:
+        compiler = compilers.pop(os.path.abspath(filename), None)
+    if compiler is None or not compiler.functions:
+        if os.path.exists(filename):
+            os.remove(filename)
+        return False
+    compiler.write()
+    return True
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+import glob
+import hashlib
+import os
+import shutil
+from qgis.core import (QgsApplication,
+                       QgsMapLayer,
+                       QgsMapLayerStyle,
+                       QgsProviderRegistry)
+
+
+def cacheFolder():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "qgis2web",
+                        "cache")
+
+
+def layerFingerprint(layer, settings):
+    """
+    Returns a fingerprint covering the layer's source files, style and
+    the export settings, or None if the layer can't be fingerprinted
+    (unsaved edits, or a source which is not a local file)
+    """
+    if layer.type() == QgsMapLayer.VectorLayer and layer.isModified():
+        return None
+    try:
+        path = QgsProviderRegistry.instance().decodeUri(
+            layer.providerType(), layer.source()).get("path")
+    except Exception:
+        path = None
+    if not path or not os.path.isfile(path):
+        return None
+
+    fingerprint = hashlib.sha1()
+    fingerprint.update(layer.providerType().encode("utf8"))
+    fingerprint.update(layer.source().encode("utf8"))
+    # Sidecar files (.dbf, .prj, -wal...) change independently of the
+    # main file, so they all count towards the modification state
+    sidecars = glob.glob(glob.escape(os.path.splitext(path)[0]) + ".*")
+    for filename in sorted(set(sidecars + [path])):
+        stat = os.stat(filename)
+        fingerprint.update(("%s:%d:%d\n" % (filename, stat.st_mtime_ns,
+                                            stat.st_size)).encode("utf8"))
+    if layer.type() == QgsMapLayer.VectorLayer:
+        fingerprint.update(layer.subsetString().encode("utf8"))
+    style = QgsMapLayerStyle()
+    style.readFromLayer(layer)
+    fingerprint.update(style.xmlData().encode("utf8"))
+    fingerprint.update(repr(settings).encode("utf8"))
+    return fingerprint.hexdigest()
+
+
+def restoreFromCache(layer, fingerprint, outputs):
+    """
+    Copies the cached outputs back in place. An output whose name ends in
+    ".*" was written with whichever extension its export chose, and is
+    restored under the cached file's name
+    """
+    entry = os.path.join(cacheFolder(), layer.id(), fingerprint)
+    cached = []
+    for output in outputs:
+        name = os.path.basename(output)
+        if name.endswith(".*"):
+            matches = glob.glob(os.path.join(glob.escape(entry),
+                                             glob.escape(name[:-2]) + ".*"))
+            if len(matches) != 1:
+                return False
+            name = os.path.basename(matches[0])
+        cached.append(os.path.join(entry, name))
+    outputs = [os.path.join(os.path.dirname(output), os.path.basename(f))
+               for output, f in zip(outputs, cached)]
+    if not outputs or not all(os.path.isfile(f) for f in cached):
+        return False
+    for source, output in zip(cached, outputs):
+        if os.path.exists(output):
+            os.remove(output)
+        try:
+            os.link(source, output)
+        except OSError:
+            shutil.copyfile(source, output)
+    return True
+
+
+def storeInCache(layer, fingerprint, outputs):
+    layerFolder = os.path.join(cacheFolder(), layer.id())
+    entry = os.path.join(layerFolder, fingerprint)
+    tmpEntry = entry + ".tmp"
+    try:
+        shutil.rmtree(tmpEntry, ignore_errors=True)
+        os.makedirs(tmpEntry)
+        for output in outputs:
+            shutil.copyfile(output, os.path.join(tmpEntry,
+                                                 os.path.basename(output)))
+        # Only the latest export of each layer is kept
+        for old in os.listdir(layerFolder):
+            if old != os.path.basename(tmpEntry):
+                shutil.rmtree(os.path.join(layerFolder, old),
+                              ignore_errors=True)
+        os.rename(tmpEntry, entry)
+    except (IOError, OSError):
+        shutil.rmtree(tmpEntry, ignore_errors=True)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import traceback
+from qgis.core import Qgis, QgsMapSettings, QgsMessageLog, QgsTask
+from qgis.PyQt.QtCore import QObject, pyqtSignal
+from qgis2web.feedbackDialog import Feedback, ExportCancelled, cancellable
+from qgis2web.headless import HeadlessInterface
+from qgis2web.layerAnalysis import featureSources, layerFeatureSources
+
+
+class TaskFeedback(QObject, Feedback):
+
+    """
+    Feedback from an export running in an ExportTask. Messages and progress
+    are signalled to the dialog, which stays on the main thread, and the
+    export is cancelled with the task
+    """
+
+    messageShown = pyqtSignal(str)
+    stepCompleted = pyqtSignal()
+    progressChanged = pyqtSignal(int)
+    completed = pyqtSignal(str)
+    fatalError = pyqtSignal(str)
+    cancelAccepted = pyqtSignal()
+
+    def __init__(self, task, dialog=None):
+        QObject.__init__(self)
+        self.task = task
+        self.outputFolder = None
+        if dialog is not None:
+            self.messageShown.connect(dialog.showFeedback)
+            self.stepCompleted.connect(dialog.completeStep)
+            self.progressChanged.connect(dialog.setProgress)
+            self.completed.connect(dialog.setCompleted)
+            self.fatalError.connect(dialog.setFatalError)
+            self.cancelAccepted.connect(dialog.acceptCancel)
+
+    def cancelled(self):
+        return self.task.isCanceled()
+
+    def acceptCancel(self):
+        self.cancelAccepted.emit()
+
+    def completeStep(self):
+        self.stepCompleted.emit()
+
+    def setCompleted(self, text):
+        self.completed.emit(text)
+
+    def showFeedback(self, feedback):
+        self.messageShown.emit(feedback)
+
+    def setFatalError(self, error):
+        self.fatalError.emit(error)
+
+    def setProgress(self, progress):
+        self.task.setProgress(progress)
+        self.progressChanged.emit(progress)
+
+    def setOutputFolder(self, folder):
+        self.outputFolder = folder
+
+
+class ExportTask(QgsTask):
+
+    """
+    Runs a writer in the background. The canvas's map settings are copied
+    and feature sources for the vector layers are taken when the task is
+    created, so the canvas is never used and features are never read from
+    the layers off the main thread. The writers still read each layer's
+    renderer, labeling, fields, custom properties and raster data provider
+    from the task, so layers should not be restyled or edited while it
+    runs. The folder a cancelled or failed export wrote is removed again
+    """
+
+    def __init__(self, writer, iface, folder, dialog=None,
+                 description="Exporting web map"):
+        QgsTask.__init__(self, description, QgsTask.CanCancel)
+        self.writer = writer
+        self.folder = folder
+        self.interface = HeadlessInterface(
+            QgsMapSettings(iface.mapCanvas().mapSettings()))
+        self.sources = layerFeatureSources(writer.layers)
+        self.feedback = TaskFeedback(self, dialog)
+        self.results = None
+        self.error = None
+
+    def run(self):
+        try:
+            with cancellable(self.isCanceled), featureSources(self.sources):
+                self.results = self.writer.write(self.interface, self.folder,
+                                                 self.feedback)
+        except ExportCancelled:
+            pass
+        except Exception:
+            self.error = traceback.format_exc()
+        if self.isCanceled() or self.results is None:
+            self.removeOutput()
+            return False
+        return True
+
+    def removeOutput(self):
+        # Only this export's own folder: other exports, such as a newer
+        # preview, may be writing alongside it in the same destination
+        folder = self.feedback.outputFolder
+        if folder is not None and os.path.isdir(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def finished(self, result):
+        if result:
+            return
+        if self.error is not None:
+            QgsMessageLog.logMessage(self.error, "qgis2web",
+                                     level=Qgis.Critical)
+            self.feedback.setFatalError(self.error.strip().splitlines()[-1])
+        else:
+            self.feedback.acceptCancel()
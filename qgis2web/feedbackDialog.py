@@ -16,12 +16,50 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from qgis.PyQt.QtCore import QObject, QCoreApplication
+import threading
+from contextlib import contextmanager
+from qgis.PyQt.QtCore import QObject, QCoreApplication, QThread
 from qgis.PyQt.QtWidgets import QDialog, QDialogButtonBox
 from .ui_feedback_dialog import Ui_Feedback
 
 translator = QObject()
 
+# features read between checks for cancellation
+CANCEL_CHECK_INTERVAL = 1000
+
+# The cancellation check of the export running on this thread
+running = threading.local()
+
+
+class ExportCancelled(Exception):
+
+    """
+    Raised inside an export once its feedback has been cancelled
+    """
+
+
+@contextmanager
+def cancellable(cancelled):
+    """
+    Lets checkCancelled() stop the export on this thread once cancelled,
+    a function which must be safe to call from this thread, returns True
+    """
+    previous = getattr(running, "cancelled", None)
+    running.cancelled = cancelled
+    try:
+        yield
+    finally:
+        running.cancelled = previous
+
+
+def checkCancelled():
+    """
+    Raises ExportCancelled if the export on this thread has been cancelled
+    """
+    cancelled = getattr(running, "cancelled", None)
+    if cancelled is not None and cancelled():
+        raise ExportCancelled()
+
 
 class Feedback(object):
 
@@ -80,6 +118,12 @@ class Feedback(object):
         """
         pass
 
+    def setOutputFolder(self, folder):
+        """
+        Records the folder the export is being written into
+        """
+        pass
+
 
 class FeedbackDialog(QDialog, Ui_Feedback, Feedback):
 
@@ -100,6 +144,8 @@ class FeedbackDialog(QDialog, Ui_Feedback, Feedback):
     def processEvents(self):
         # hack copied from QgsVectorLayerInterruption.... .mustStop
         # to allow responsive cancelation on linux
+        if QThread.currentThread() != self.thread():
+            return
         i = 0
         while i < 100 and QCoreApplication.hasPendingEvents():
             QCoreApplication.processEvents()
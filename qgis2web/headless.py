@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Exports projects without a QGIS interface or map canvas, e.g.
+
+    python -m qgis2web.headless spec.json first.qgz second.qgz --jobs 4
+
+The export spec is a JSON object whose keys are all optional:
+
+    format    writer type: "openlayers", "leaflet" or "mapbox". Defaults
+              to the format saved in each project
+    output    folder to export into. Each project is exported into a
+              subfolder named after it. Defaults to the folder saved in
+              each project
+    params    writer parameters to override, by group, e.g.
+              {"Data export": {"Precision": "4"}}
+    extent    [xmin, ymin, xmax, ymax] of the map view in the project CRS.
+              Defaults to the project's default view, else its layers
+    size      [width, height] of the map view in pixels
+    rotation  map rotation in degrees
+"""
+
+import os
+import sys
+import json
+import argparse
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from qgis.core import (QgsApplication,
+                       QgsProject,
+                       QgsMapLayer,
+                       QgsMapSettings,
+                       QgsRectangle,
+                       QgsCoordinateTransform,
+                       QgsCsException,
+                       QgsWkbTypes)
+from qgis.PyQt.QtCore import QSize
+from qgis2web.writerRegistry import WRITER_REGISTRY
+from qgis2web.exporter import EXPORTER_REGISTRY
+
+DEFAULT_SIZE = (1024, 768)
+
+# The QgsApplication of a headless worker process
+application = None
+
+
+class HeadlessCanvas(object):
+    """
+    Stands in for the map canvas when exporting without one, answering what
+    the writers ask of a canvas from a QgsMapSettings
+    """
+
+    def __init__(self, mapSettings):
+        self.settings = mapSettings
+
+    def mapSettings(self):
+        return self.settings
+
+    def extent(self):
+        return self.settings.visibleExtent()
+
+    def center(self):
+        return self.extent().center()
+
+    def rotation(self):
+        return self.settings.rotation()
+
+    def scale(self):
+        return self.settings.scale()
+
+    def size(self):
+        return self.settings.outputSize()
+
+
+class HeadlessInterface(object):
+    """Stands in for the QGIS interface passed to the writers"""
+
+    def __init__(self, mapSettings):
+        self.canvas = HeadlessCanvas(mapSettings)
+
+    def mapCanvas(self):
+        return self.canvas
+
+
+def exportedLayers(project):
+    """
+    The layers a project exports and their per-layer writer settings, read
+    from the layer properties the qgis2web dialog stores, in the order of
+    MainDialog.getLayersAndGroups. Layers inside a layer tree group are
+    exported as that group, with the dialog's default group settings
+    """
+    def exported(treeLayer):
+        layer = treeLayer.layer()
+        if (layer is None or layer.type() == QgsMapLayer.PluginLayer or
+                not treeLayer.isVisible()):
+            return False
+        return (layer.type() != QgsMapLayer.VectorLayer or
+                layer.wkbType() != QgsWkbTypes.NoGeometry)
+
+    root = project.layerTreeRoot()
+    layers = []
+    groups = {}
+    popup = []
+    visible = []
+    interactive = []
+    json = []
+    cluster = []
+    getFeatureInfo = []
+    treeGroups = []
+    for treeLayer in root.findLayers():
+        if not exported(treeLayer):
+            continue
+        parent = treeLayer.parent()
+        if parent.parent() is not None:
+            if parent not in treeGroups:
+                treeGroups.append(parent)
+            continue
+        layer = treeLayer.layer()
+        isVector = layer.type() == QgsMapLayer.VectorLayer
+        layers.append(layer)
+        layerPopup = []
+        if isVector:
+            fields = layer.fields()
+            for index, field in enumerate(fields):
+                if layer.editorWidgetSetup(index).type() == 'Hidden':
+                    continue
+                label = layer.customProperty(
+                    "qgis2web/popup/" + field.name(), "")
+                layerPopup.append((field.name(), label or "no label"))
+        popup.append(OrderedDict(layerPopup))
+        vis = layer.customProperty("qgis2web/Visible", True)
+        visible.append(not (vis == 0 or str(vis).lower() == "false"))
+        interactive.append(True)
+        json.append(isVector and layer.providerType() == 'WFS' and
+                    layer.customProperty("qgis2web/Encode to JSON") == 2)
+        cluster.append(isVector and
+                       layer.geometryType() == QgsWkbTypes.PointGeometry and
+                       layer.customProperty("qgis2web/Cluster") == 2)
+        getFeatureInfo.append(
+            not isVector and layer.providerType() == 'wms' and
+            layer.customProperty("qgis2web/GetFeatureInfo") == 2)
+    for treeGroup in treeGroups:
+        groupLayers = [treeLayer.layer() for treeLayer in
+                       treeGroup.findLayers() if exported(treeLayer)]
+        layers.extend(groupLayers)
+        popup.extend({} for layer in groupLayers)
+        visible.extend(True for layer in groupLayers)
+        interactive.extend(True for layer in groupLayers)
+        json.extend(False for layer in groupLayers)
+        cluster.extend(False for layer in groupLayers)
+        getFeatureInfo.extend(False for layer in groupLayers)
+        groups[treeGroup.name()] = groupLayers[::-1]
+
+    return (layers[::-1],
+            groups,
+            popup[::-1],
+            visible[::-1],
+            interactive[::-1],
+            json[::-1],
+            cluster[::-1],
+            getFeatureInfo[::-1])
+
+
+def projectExtent(project, layers):
+    """
+    The project's default view extent, else the combined extent of layers,
+    in the project CRS
+    """
+    crs = project.crs()
+    try:
+        view = project.viewSettings().defaultViewExtent()
+        if not view.isEmpty():
+            transform = QgsCoordinateTransform(view.crs(), crs, project)
+            return transform.transformBoundingBox(view)
+    except (AttributeError, QgsCsException):
+        pass
+    extent = QgsRectangle()
+    extent.setMinimal()
+    for layer in layers:
+        try:
+            transform = QgsCoordinateTransform(layer.crs(), crs, project)
+            extent.combineExtentWith(
+                transform.transformBoundingBox(layer.extent()))
+        except QgsCsException:
+            pass
+    if extent.isEmpty():
+        return QgsRectangle(-180, -90, 180, 90)
+    return extent
+
+
+def mapSettingsFromProject(project, layers, spec):
+    """
+    A QgsMapSettings for the map view a project would be exported from,
+    built from the project and the export spec
+    """
+    settings = QgsMapSettings()
+    settings.setDestinationCrs(project.crs())
+    settings.setTransformContext(project.transformContext())
+    settings.setBackgroundColor(project.backgroundColor())
+    settings.setSelectionColor(project.selectionColor())
+    settings.setLayers(layers)
+    width, height = spec.get("size", DEFAULT_SIZE)
+    settings.setOutputSize(QSize(int(width), int(height)))
+    settings.setRotation(float(spec.get("rotation", 0)))
+    if "extent" in spec:
+        settings.setExtent(QgsRectangle(*[float(v) for v in spec["extent"]]))
+    else:
+        settings.setExtent(projectExtent(project, layers))
+    return settings
+
+
+def projectInterface(project, layers, spec=None):
+    """A HeadlessInterface viewing layers of project as spec describes"""
+    return HeadlessInterface(
+        mapSettingsFromProject(project, layers, spec or {}))
+
+
+def writerFromProject(spec):
+    """
+    Creates the writer for the current project, with the project's settings
+    overridden by the export spec
+    """
+    if "format" in spec:
+        factories = {w.type(): w for w in WRITER_REGISTRY.getWriters()}
+        if spec["format"].lower() not in factories:
+            raise ValueError("Unknown export format: %s" % spec["format"])
+        writer = factories[spec["format"].lower()]()
+        writer.params = WRITER_REGISTRY.readParamsFromProject()
+    else:
+        writer = WRITER_REGISTRY.createWriterFromProject()
+    for group, settings in spec.get("params", {}).items():
+        for param, value in settings.items():
+            if (group not in writer.params or
+                    param not in writer.params[group] or
+                    param == "Attribute filter"):
+                raise ValueError("Unknown export parameter: %s/%s" %
+                                 (group, param))
+            writer.params[group][param] = value
+    return writer
+
+
+def exportProject(project, spec, feedback=None):
+    """
+    Exports a loaded project as spec describes, without a QGIS interface.
+    Since the writers read QgsProject.instance(), project must be it
+    :return: WriterResult object
+    """
+    writer = writerFromProject(spec)
+    (writer.layers, writer.groups, writer.popup, writer.visible,
+     writer.interactive, writer.json, writer.cluster,
+     writer.getFeatureInfo) = exportedLayers(project)
+    if "output" in spec:
+        folder = spec["output"]
+        if project.fileName():
+            name = os.path.splitext(os.path.basename(project.fileName()))[0]
+            folder = os.path.join(folder, name)
+    else:
+        folder = EXPORTER_REGISTRY.createFromProject().exportDirectory()
+    os.makedirs(folder, exist_ok=True)
+    return writer.write(projectInterface(project, writer.layers, spec),
+                        folder, feedback)
+
+
+def startHeadless():
+    """Starts QGIS in a worker process with no display"""
+    global application
+    if QgsApplication.instance() is not None:
+        return
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    application = QgsApplication([], True)
+    application.initQgis()
+
+
+def exportProjectFile(path, spec):
+    """
+    Loads the project file at path and exports it as spec describes
+    :return: path of the exported index.html
+    """
+    startHeadless()
+    project = QgsProject.instance()
+    project.clear()
+    if not project.read(path):
+        raise IOError("Could not read project %s: %s" %
+                      (path, project.error()))
+    try:
+        return exportProject(project, spec).index_file
+    finally:
+        project.clear()
+
+
+def exportFromWorker(path, spec):
+    try:
+        return True, exportProjectFile(path, spec)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def exportProjects(paths, spec, jobs=None):
+    """
+    Exports each project file in paths as spec describes, in up to jobs
+    separate processes at once, each with its own QGIS
+    :return: OrderedDict of path to (succeeded, index.html path or error)
+    """
+    jobs = jobs or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    results = OrderedDict()
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths) or 1),
+                             mp_context=context,
+                             initializer=startHeadless) as pool:
+        futures = [(path, pool.submit(exportFromWorker,
+                                      os.path.abspath(path), spec))
+                   for path in paths]
+        for path, future in futures:
+            results[path] = future.result()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m qgis2web.headless",
+        description="Export QGIS projects as web maps without QGIS's "
+                    "interface")
+    parser.add_argument("spec", help="JSON export spec file")
+    parser.add_argument("projects", nargs="+", help=".qgz/.qgs projects")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="projects to export at once (default: CPUs)")
+    args = parser.parse_args(argv)
+    with open(args.spec) as f:
+        spec = json.load(f)
+    failed = 0
+    for path, (succeeded, result) in exportProjects(
+            args.projects, spec, args.jobs).items():
+        if succeeded:
+            print("%s: %s" % (path, result))
+        else:
+            failed += 1
+            print("%s failed:\n%s" % (path, result), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+// Turns the compact layers written by qgis2web back into a GeoJSON
+// FeatureCollection. Anything that is not a compact layer is returned as is.
+function compactToGeoJSON(layer) {
+    if (!layer || layer.type !== "CompactFeatureCollection") {
+        return layer;
+    }
+    var binary = atob(layer.geometries);
+    var bytes = new Uint8Array(binary.length);
+    for (var b = 0; b < binary.length; b++) {
+        bytes[b] = binary.charCodeAt(b);
+    }
+    var scale = layer.transform.scale;
+    var translate = layer.transform.translate;
+    var offset = 0;
+    var x = 0, y = 0;
+
+    // coordinates can go past 32 bits, so no bitwise operators here
+    function varint() {
+        var value = 0, factor = 1, byte;
+        do {
+            byte = bytes[offset++];
+            value += (byte & 0x7f) * factor;
+            factor *= 128;
+        } while (byte & 0x80);
+        return value;
+    }
+
+    function zigzag() {
+        var value = varint();
+        return value % 2 ? -(value + 1) / 2 : value / 2;
+    }
+
+    function point() {
+        x += zigzag();
+        y += zigzag();
+        return [x * scale[0] + translate[0], y * scale[1] + translate[1]];
+    }
+
+    function points() {
+        var result = [];
+        for (var count = varint(); count > 0; count--) {
+            result.push(point());
+        }
+        return result;
+    }
+
+    function lines() {
+        var result = [];
+        for (var count = varint(); count > 0; count--) {
+            result.push(points());
+        }
+        return result;
+    }
+
+    var types = [null, "Point", "MultiPoint", "LineString",
+                 "MultiLineString", "Polygon", "MultiPolygon"];
+    var features = [];
+    for (var f = 0; f < layer.properties.length; f++) {
+        var type = types[varint()];
+        var coordinates;
+        switch (type) {
+            case "Point":
+                coordinates = point();
+                break;
+            case "MultiPoint":
+            case "LineString":
+                coordinates = points();
+                break;
+            case "MultiLineString":
+            case "Polygon":
+                coordinates = lines();
+                break;
+            case "MultiPolygon":
+                coordinates = [];
+                for (var count = varint(); count > 0; count--) {
+                    coordinates.push(lines());
+                }
+                break;
+        }
+        features.push({
+            type: "Feature",
+            properties: layer.properties[f],
+            geometry: type ? {type: type, coordinates: coordinates} : null
+        });
+    }
+    return {type: "FeatureCollection", features: features};
+}
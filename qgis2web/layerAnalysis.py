@@ -0,0 +1,243 @@
+import threading
+from contextlib import contextmanager
+from qgis.core import (QgsFeatureRequest,
+                       QgsVectorLayerFeatureSource,
+                       QgsRectangle,
+                       QgsRenderContext,
+                       QgsWkbTypes,
+                       QgsCategorizedSymbolRenderer,
+                       QgsGraduatedSymbolRenderer,
+                       QgsRuleBasedRenderer,
+                       QgsNullSymbolRenderer,
+                       Qgs25DRenderer,
+                       QgsGeometryGeneratorSymbolLayer)
+from qgis2web.feedbackDialog import CANCEL_CHECK_INTERVAL, checkCancelled
+
+# The analyses shared by the stages of the export running on this thread
+current = threading.local()
+
+
+@contextmanager
+def layerAnalyses():
+    """Shares one analysis of each layer between every stage of an export"""
+    current.analyses = {}
+    try:
+        yield
+    finally:
+        current.analyses = None
+
+
+def analyseLayer(layer, canvas=None):
+    """
+    Returns the analysis of layer for the export in progress, or a new one
+    outside an export
+    """
+    analyses = getattr(current, "analyses", None)
+    if analyses is None:
+        return LayerAnalysis(layer, canvas)
+    if layer.id() not in analyses:
+        analyses[layer.id()] = LayerAnalysis(layer, canvas)
+    analysis = analyses[layer.id()]
+    if analysis.canvas is None:
+        analysis.canvas = canvas
+    return analysis
+
+
+@contextmanager
+def featureSources(sources):
+    """
+    Reads layers through sources, made by layerFeatureSources() on the
+    thread the layers belong to, while exporting on this thread
+    """
+    current.sources = sources
+    try:
+        yield
+    finally:
+        current.sources = None
+
+
+def layerFeatureSources(layers):
+    """
+    Feature sources for the vector layers among layers, by layer id. They
+    must be made on the thread the layers belong to
+    """
+    return {layer.id(): QgsVectorLayerFeatureSource(layer)
+            for layer in layers if layer.type() == layer.VectorLayer}
+
+
+def featureSource(layer):
+    """A source of layer's features which any thread can read"""
+    sources = getattr(current, "sources", None)
+    if sources and layer.id() in sources:
+        return sources[layer.id()]
+    return QgsVectorLayerFeatureSource(layer)
+
+
+def quick25d(layer):
+    """
+    Whether layer is drawn as 2.5D, if that can be told without reading its
+    features, else None
+    """
+    if layer.type() != layer.VectorLayer:
+        return False
+    if layer.geometryType() != QgsWkbTypes.PolygonGeometry:
+        return False
+    vts = layer.customProperty("VectorTilesReader/vector_tile_source")
+    if vts is not None:
+        return False
+    renderer = layer.renderer()
+    if renderer is None or isinstance(renderer, QgsNullSymbolRenderer):
+        return False
+    if isinstance(renderer, Qgs25DRenderer):
+        return True
+    if isinstance(renderer, QgsCategorizedSymbolRenderer):
+        symbols = [category.symbol() for category in renderer.categories()]
+    elif isinstance(renderer, QgsGraduatedSymbolRenderer):
+        symbols = [ran.symbol() for ran in renderer.ranges()]
+    elif isinstance(renderer, QgsRuleBasedRenderer):
+        symbols = [rule.symbol()
+                   for rule in renderer.rootRule().children()]
+    else:
+        return None
+    return any(is25dSymbol(symbol) for symbol in symbols)
+
+
+def is25dSymbol(symbol):
+    if symbol is None or symbol.symbolLayerCount() < 3:
+        return False
+    return (isinstance(symbol.symbolLayer(1),
+                       QgsGeometryGeneratorSymbolLayer) and
+            isinstance(symbol.symbolLayer(2),
+                       QgsGeometryGeneratorSymbolLayer))
+
+
+class LayerAnalysis(object):
+    """
+    What an export reads from a vector layer's features, gathered in one
+    pass over them the first time any of it is needed: whether they are
+    drawn as 2.5D and with OSMBuildings shadows, their extent and count,
+    and the images the ExternalResource fields refer to
+    """
+
+    def __init__(self, layer, canvas=None):
+        self.layer = layer
+        self.canvas = canvas
+        fields = layer.fields()
+        self.imageFields = [
+            field.name() for index, field in enumerate(fields)
+            if layer.editorWidgetSetup(index).type() == 'ExternalResource']
+        self.scanned = False
+        self.lock = threading.Lock()
+
+    def is25d(self, restrictToCanvas=False):
+        """Whether the layer is drawn as 2.5D"""
+        quick = quick25d(self.layer)
+        if quick is not None:
+            return quick
+        self.scan()
+        if restrictToCanvas:
+            return self.symbols25dInCanvas
+        return self.symbols25d
+
+    def shadows(self):
+        """Whether OSMBuildings should draw the layer's shadows"""
+        self.scan()
+        return self.shadowsDrawn
+
+    def images(self, fieldName):
+        """The distinct file names an ExternalResource field refers to"""
+        if fieldName not in self.imageFields:
+            return []
+        self.scan()
+        return self.imageNames[fieldName]
+
+    # The count and extent are the provider's, whether or not the features
+    # have been scanned, so they don't depend on what asked first. Only
+    # where the provider can't tell are they scanned for
+
+    def featureCount(self):
+        count = self.layer.featureCount()
+        if count >= 0:
+            return count
+        self.scan()
+        return self.count
+
+    def extent(self):
+        extent = self.layer.extent()
+        if not extent.isNull() and not extent.isEmpty():
+            return extent
+        self.scan()
+        if self.bounds.isEmpty():
+            return extent
+        return self.bounds
+
+    def scan(self):
+        with self.lock:
+            if not self.scanned:
+                self._scan()
+                self.scanned = True
+
+    def _scan(self):
+        layer = self.layer
+        fields = layer.fields()
+        self.imageNames = {name: [] for name in self.imageFields}
+        seenImages = {name: set() for name in self.imageFields}
+        self.symbols25d = False
+        self.symbols25dInCanvas = False
+        self.shadowsDrawn = False
+        self.count = 0
+        self.bounds = QgsRectangle()
+        self.bounds.setMinimal()
+        # symbols are only looked at for layers which may be 2.5D
+        renderer = None
+        if quick25d(layer) is not False:
+            renderer = layer.renderer().clone()
+            if self.canvas is not None:
+                renderContext = QgsRenderContext.fromMapSettings(
+                    self.canvas.mapSettings())
+                canvasExtent = self.canvas.extent()
+            else:
+                renderContext = QgsRenderContext()
+                canvasExtent = None
+        request = QgsFeatureRequest()
+        if renderer is None:
+            request.setSubsetOfAttributes(
+                [fields.indexFromName(name)
+                 for name in self.imageFields])
+        else:
+            renderer.startRender(renderContext, fields)
+        try:
+            for feature in featureSource(layer).getFeatures(request):
+                self.count += 1
+                if self.count % CANCEL_CHECK_INTERVAL == 0:
+                    checkCancelled()
+                geom = feature.geometry()
+                if geom is not None and not geom.isNull():
+                    self.bounds.combineExtentWith(geom.boundingBox())
+                for name in self.imageFields:
+                    value = feature[name]
+                    if type(value) is str and value not in seenImages[name]:
+                        seenImages[name].add(value)
+                        self.imageNames[name].append(value)
+                if renderer is None:
+                    continue
+                symbol = renderer.symbolForFeature(feature, renderContext)
+                if symbol is None:
+                    continue
+                if is25dSymbol(symbol):
+                    self.symbols25d = True
+                    if (canvasExtent is None or
+                            (geom is not None and
+                             geom.intersects(canvasExtent))):
+                        self.symbols25dInCanvas = True
+                try:
+                    effects = symbol.symbolLayer(0).paintEffect()
+                    if not effects.effectList()[0].enabled():
+                        self.shadowsDrawn = True
+                except (AttributeError, IndexError):
+                    pass
+        finally:
+            if renderer is not None:
+                renderer.stopRender(renderContext)
+        if self.bounds.isNull() or self.count == 0:
+            self.bounds = QgsRectangle()
@@ -70,6 +70,12 @@ def writeFoldersAndFiles(pluginDir, feedback, outputProjectFileName,
                     jsStore + 'leaflet-heat.js')
     shutil.copyfile(jsDir + 'Leaflet.VectorGrid.js',
                     jsStore + 'Leaflet.VectorGrid.js')
+    shutil.copyfile(jsDir + 'qgis2web_topojson.js',
+                    jsStore + 'qgis2web_topojson.js')
+    shutil.copyfile(jsDir + 'qgis2web_compact.js',
+                    jsStore + 'qgis2web_compact.js')
+    shutil.copyfile(jsDir + 'qgis2web_chunks.js',
+                    jsStore + 'qgis2web_chunks.js')
     shutil.copyfile(jsDir + 'leaflet-hash.js', jsStore + 'leaflet-hash.js')
     shutil.copyfile(jsDir + 'leaflet.rotatedMarker.js',
                     jsStore + 'leaflet.rotatedMarker.js')
@@ -125,7 +131,9 @@ def writeFoldersAndFiles(pluginDir, feedback, outputProjectFileName,
 def writeHTMLstart(outputIndex, webpage_name, cluster_set, address, measure,
                    matchCRS, layerSearch, filterItems, canvas, locate,
                    qgis2webJS, template, feedback, useMultiStyle, useHeat,
-                   useShapes, useOSMB, useWMS, useWMTS, useVT):
+                   useShapes, useOSMB, useWMS, useWMTS, useVT,
+                   useTopoJSON=False, useCompact=False, useChunks=False,
+                   useExpressions=True):
     useCluster = False
     for cluster in cluster_set:
         if cluster:
@@ -146,6 +154,15 @@ def writeHTMLstart(outputIndex, webpage_name, cluster_set, address, measure,
     if useVT:
         jsAddress += """
         <script src="js/Leaflet.VectorGrid.js"></script>"""
+    if useTopoJSON:
+        jsAddress += """
+        <script src="js/qgis2web_topojson.js"></script>"""
+    if useCompact:
+        jsAddress += """
+        <script src="js/qgis2web_compact.js"></script>"""
+    if useChunks:
+        jsAddress += """
+        <script src="js/qgis2web_chunks.js"></script>"""
     if useShapes:
         jsAddress += """
         <script src="js/leaflet-svg-shape-markers.min.js"></script>"""
@@ -218,7 +235,9 @@ def writeHTMLstart(outputIndex, webpage_name, cluster_set, address, measure,
         <script src="js/proj4leaflet.js"></script>"""
     else:
         crsJS = ""
-    exp_js = """
+    exp_js = ""
+    if useExpressions:
+        exp_js = """
         <script src="js/qgis2web_expressions.js"></script>"""
 
     canvasSize = canvas.size()
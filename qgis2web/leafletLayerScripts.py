@@ -1,15 +1,12 @@
 import re
 import os
-from qgis.PyQt.QtCore import QSize
 from qgis.core import (QgsSingleSymbolRenderer,
                        QgsCategorizedSymbolRenderer,
                        QgsGraduatedSymbolRenderer,
                        QgsRuleBasedRenderer,
                        QgsNullSymbolRenderer,
                        QgsHeatmapRenderer,
-                       QgsSymbolLayerUtils,
                        QgsDataSourceUri,
-                       QgsRenderContext,
                        QgsWkbTypes)
 from qgis2web.leafletStyleScripts import getLayerStyle
 from qgis2web.leafletScriptStrings import (popupScript,
@@ -17,6 +14,7 @@ from qgis2web.leafletScriptStrings import (popupScript,
                                            pointToLayerFunction,
                                            wfsScript,
                                            clusterScript,
+                                           chunkLoaderScript,
                                            iconLegend)
 try:
     from vector_tiles_reader.plugin.util.tile_json import TileJSON
@@ -25,8 +23,9 @@ except ImportError:
     vt_enabled = False
 
 from qgis2web.exp2js import compile_to_file
+from qgis2web.layerAnalysis import analyseLayer
 from qgis2web.utils import (is25d, safeName, handleHiddenField, BLEND_MODES,
-                            TYPE_MAP)
+                            TYPE_MAP, TOPOJSON, CHUNKED)
 
 
 def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
@@ -35,7 +34,8 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
                      canvas, zIndex,
                      restrictToExtent, extent, feedback, labelCode, vtLabels,
                      vtStyles, useMultiStyle, useHeat, useVT, useShapes,
-                     useOSMB):
+                     useOSMB, tileZooms=None, layerFormat=None,
+                     sprite=None, evaluateRules=False, dataDefined=None):
     vts = layer.customProperty("VectorTilesReader/vector_tile_url")
     feedback.showFeedback("Writing %s as JSON..." % layer.name())
     zIndex = zIndex + 400
@@ -43,7 +43,8 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
     labeltext, vtLabels = getLabels(layer, safeLayerName,
                                     outputProjectFileName, vts, vtLabels,
                                     feedback)
-    labelCode += labeltext
+    if tileZooms is None:
+        labelCode += labeltext
     (new_pop, popFuncs) = getPopups(layer, safeLayerName, highlight,
                                     popupsOnHover, popup, vts, feedback)
     renderer = layer.renderer()
@@ -57,31 +58,8 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
     if is25d(layer, canvas, restrictToExtent, extent):
         useOSMB = True
         shadows = ""
-        renderer = layer.renderer()
-        renderContext = QgsRenderContext.fromMapSettings(canvas.mapSettings())
-        fields = layer.fields()
-        renderer.startRender(renderContext, fields)
-        for feat in layer.getFeatures():
-            if isinstance(renderer, QgsCategorizedSymbolRenderer):
-                classAttribute = renderer.classAttribute()
-                attrValue = feat.attribute(classAttribute)
-                catIndex = renderer.categoryIndexForValue(attrValue)
-                categories = renderer.categories()
-                symbol = categories[catIndex].symbol()
-            elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-                classAttribute = renderer.classAttribute()
-                attrValue = feat.attribute(classAttribute)
-                ranges = renderer.ranges()
-                for range in ranges:
-                    if (attrValue >= range.lowerValue() and
-                            attrValue <= range.upperValue()):
-                        symbol = range.symbol().clone()
-            else:
-                symbol = renderer.symbolForFeature(feat, renderContext)
-            symbolLayer = symbol.symbolLayer(0)
-            if not symbolLayer.paintEffect().effectList()[0].enabled():
-                shadows = "'2015-07-15 10:00:00'"
-        renderer.stopRender(renderContext)
+        if analyseLayer(layer, canvas).shadows():
+            shadows = "'2015-07-15 10:00:00'"
         new_obj = """
         var osmb = new OSMBuildings(map).date(new Date({shadows}));
         osmb.set(json_{sln});""".format(shadows=shadows, sln=safeLayerName)
@@ -120,19 +98,31 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
         if isLayer:
             vtStyles[vts][layer.name()][index] = style
         style = ""
+    elif tileZooms is not None:
+        useVT = True
+        (style, markerType, useMapUnits,
+         useShapes) = getLayerStyle(layer, safeLayerName, interactive,
+                                    markerFolder, outputProjectFileName,
+                                    useShapes, feedback, evaluateRules,
+                                    dataDefined)
+        (legend, symbol) = getLegend(layer, renderer, sprite, feedback)
+        legends[safeLayerName] = legend
+        new_obj = localVTLayer(layer, safeLayerName, interactive, usedFields,
+                               symbol, tileZooms)
     else:
         (style, markerType, useMapUnits,
          useShapes) = getLayerStyle(layer, safeLayerName, interactive,
                                     markerFolder, outputProjectFileName,
-                                    useShapes, feedback)
-        (legend, symbol) = getLegend(layer, renderer, outputProjectFileName,
-                                     safeLayerName, feedback)
+                                    useShapes, feedback, evaluateRules,
+                                    dataDefined)
+        (legend, symbol) = getLegend(layer, renderer, sprite, feedback)
         legends[safeLayerName] = legend
         (new_obj, legends, wfsLayers,
          useMultiStyle) = getLayer(layer, renderer, safeLayerName, interactive,
                                    outputProjectFileName, usedFields, legends,
                                    cluster, json, wfsLayers, markerType,
-                                   useMultiStyle, symbol, feedback)
+                                   useMultiStyle, symbol, feedback,
+                                   layerFormat == TOPOJSON)
     blend = BLEND_MODES[layer.blendMode()]
     if vts is None:
         new_obj = u"""{style}
@@ -147,13 +137,21 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
 """ + new_obj
     if is25d(layer, canvas, restrictToExtent, extent):
         pass
+    elif tileZooms is not None:
+        # vector grids have no bounds, so they stay out of bounds_group
+        if visible:
+            new_src += """
+        map.addLayer(layer_""" + safeLayerName + """);"""
     elif vts is not None:
         if addVT:
             sln = safeName(vts)
             new_src += """
         map.addLayer(layer_""" + sln + """);"""
     else:
-        new_src += """
+        if layerFormat == CHUNKED:
+            new_src += chunkLoaderScript(safeLayerName, cluster)
+        else:
+            new_src += """
         bounds_group.addLayer(layer_""" + safeLayerName + """);"""
         if visible:
             if cluster is False:
@@ -334,14 +332,10 @@ def getPopups(layer, safeLayerName, highlight, popupsOnHover, popup, vts,
     return new_pop, popFuncs
 
 
-def getLegend(layer, renderer, outputProjectFileName, safeLayerName, feedback):
+def getLegend(layer, renderer, sprite, feedback):
     if isinstance(renderer, QgsSingleSymbolRenderer):
         symbol = renderer.symbol()
-        legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(symbol,
-                                                             QSize(16, 16))
-        legendIcon.save(os.path.join(outputProjectFileName, "legend",
-                                     safeLayerName + ".png"))
-        legend = ('<img src="legend/' + safeLayerName + '.png" /> ')
+        legend = sprite.icon(symbol) + ' '
         legend += layer.name().replace("'", "\\'")
     elif isinstance(renderer, QgsNullSymbolRenderer):
         legend = ""
@@ -360,10 +354,8 @@ def getLegend(layer, renderer, outputProjectFileName, safeLayerName, feedback):
 
         legend = layer.name().replace("'", "\\'") + "<br />"
         legend += "<table>"
-        for cnt, c in enumerate(classes):
-            symbol = c.symbol()
-            legend = iconLegend(symbol, c, outputProjectFileName,
-                                safeLayerName, legend, cnt)
+        for c in classes:
+            legend = iconLegend(c.symbol(), c, sprite, legend)
         legend += "</table>"
         symbol = classes[0].symbol()
     return (legend, symbol)
@@ -371,7 +363,8 @@ def getLegend(layer, renderer, outputProjectFileName, safeLayerName, feedback):
 
 def getLayer(layer, renderer, safeLayerName, interactive,
              outputProjectFileName, usedFields, legends, cluster, json,
-             wfsLayers, markerType, useMultiStyle, symbol, feedback):
+             wfsLayers, markerType, useMultiStyle, symbol, feedback,
+             topology=False):
     if layer.geometryType() == QgsWkbTypes.PointGeometry:
         (new_obj,
          wfsLayers,
@@ -383,7 +376,7 @@ def getLayer(layer, renderer, safeLayerName, interactive,
         (new_obj, wfsLayers,
          useMultiStyle) = nonPointLayer(layer, safeLayerName, interactive,
                                         usedFields, json, wfsLayers, symbol,
-                                        useMultiStyle, feedback)
+                                        useMultiStyle, feedback, topology)
     return new_obj, legends, wfsLayers, useMultiStyle
 
 
@@ -418,7 +411,7 @@ def pointLayer(layer, safeLayerName, interactive, cluster, usedFields, json,
 
 
 def nonPointLayer(layer, safeLayerName, interactive, usedFields, json,
-                  wfsLayers, symbol, useMultiStyle, feedback):
+                  wfsLayers, symbol, useMultiStyle, feedback, topology=False):
     if layer.providerType() == 'WFS' and json is False:
         (new_obj, scriptTag,
          useMultiStyle) = buildNonPointWFS(safeLayerName, layer, symbol,
@@ -432,7 +425,8 @@ def nonPointLayer(layer, safeLayerName, interactive, usedFields, json,
             layerAttr = u'<a href="%s">%s</a>' % (attrUrl, attrText)
         new_obj, useMultiStyle = buildNonPointJSON(safeLayerName, usedFields,
                                                    layerAttr, interactive,
-                                                   symbol, useMultiStyle)
+                                                   symbol, useMultiStyle,
+                                                   topology)
     return new_obj, wfsLayers, useMultiStyle
 
 
@@ -495,6 +489,49 @@ def VTLayer(json_url):
     return vtJS
 
 
+def localVTLayer(layer, safeLayerName, interactive, usedFields, symbol,
+                 tileZooms):
+    layerAttr = ""
+    attrText = layer.attribution().replace('\n', ' ').replace('\r', ' ')
+    attrUrl = layer.attributionUrl()
+    if attrText != "":
+        layerAttr = u'<a href="%s">%s</a>' % (attrUrl, attrText)
+    if symbol:
+        slCount = max(symbol.symbolLayerCount(), 1)
+    else:
+        slCount = 1
+    styles = ", ".join(["style_%s_%d(feature)" % (safeLayerName, sl)
+                        for sl in range(slCount)])
+    vtJS = """
+        var layer_{sln} = L.vectorGrid.protobuf(
+            'data/{sln}/{{z}}/{{x}}/{{y}}.pbf', {{
+            rendererFactory: L.canvas.tile,
+            attribution: '{attr}',
+            interactive: {int},
+            pane: 'pane_{sln}',
+            minNativeZoom: {minZoom},
+            maxNativeZoom: {maxZoom},
+            vectorTileLayerStyles: {{
+                '{sln}': function(properties, zoom) {{
+                    var feature = {{properties: properties}};
+                    return [{styles}];
+                }}
+            }}
+        }});""".format(sln=safeLayerName, attr=layerAttr,
+                       int=str(interactive).lower(), minZoom=tileZooms[0],
+                       maxZoom=tileZooms[1], styles=styles)
+    if usedFields != 0:
+        vtJS += """
+        layer_{sln}.on('click', function(e) {{
+            var popupLayer = L.layerGroup();
+            pop_{sln}({{properties: e.layer.properties}}, popupLayer);
+            if (popupLayer.getPopup()) {{
+                popupLayer.getPopup().setLatLng(e.latlng).openOn(map);
+            }}
+        }});""".format(sln=safeLayerName)
+    return vtJS
+
+
 def buildPointJSON(symbol, sln, usedFields, interactive, markerType, layerAttr,
                    useMultiStyle):
     if symbol:
@@ -600,7 +637,7 @@ def buildPointWFS(p2lf, layerName, layer, interactive, cluster_set, symbol,
 
 
 def buildNonPointJSON(safeName, usedFields, layerAttr, interactive, symbol,
-                      useMultiStyle):
+                      useMultiStyle, topology=False):
     if usedFields != 0:
         onEachFeature = u"""
             onEachFeature: pop_{safeName},""".format(safeName=safeName)
@@ -623,7 +660,11 @@ def buildNonPointJSON(safeName, usedFields, layerAttr, interactive, symbol,
             styles += u"""style_%s_%s,""" % (safeName, sl)
     else:
         styles = u"""style_%s_0,""" % safeName
-    new_obj = u"""
+    new_obj = u""
+    if topology:
+        new_obj += u"""
+        json_{safeName} = topojsonToGeoJSON(json_{safeName});"""
+    new_obj += u"""
         var layer_{safeName} = new L.geoJson{multiStyle}(json_{safeName}, {{
             attribution: '{attr}',
             interactive: {int},
@@ -1,13 +1,10 @@
-import re
-import os
 import traceback
 from urllib.parse import parse_qs
-from qgis.PyQt.QtCore import QSize, QDateTime
+from qgis.PyQt.QtCore import QDateTime
 from qgis.core import (QgsProject,
                        QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform,
                        QgsMapLayer,
-                       QgsSymbolLayerUtils,
                        QgsSvgMarkerSymbolLayer,
                        QgsMessageLog,
                        Qgis,
@@ -15,9 +12,14 @@ from qgis.core import (QgsProject,
 from qgis2web.utils import scaleToZoom, safeName
 
 
-def jsonScript(layer):
+def jsonScript(layer, compact=False):
     json = """
         <script src="data/{layer}.js\"></script>""".format(layer=layer)
+    if compact:
+        json += """
+        <script>
+            json_{layer} = compactToGeoJSON(json_{layer});
+        </script>""".format(layer=layer)
     return json
 
 
@@ -230,19 +232,13 @@ def popupScript(safeLayerName, popFuncs, highlight, popupsOnHover):
     return popup
 
 
-def iconLegend(symbol, catr, outputProjectFileName, layerName, catLegend, cnt):
+def iconLegend(symbol, catr, sprite, catLegend):
     try:
-        iconSize = (symbol.size() * 4) + 5
+        iconSize = int((symbol.size() * 4) + 5)
     except Exception:
         iconSize = 16
-    legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(symbol,
-                                                         QSize(iconSize,
-                                                               iconSize))
-    safeLabel = re.sub(r'[\W_]+', '', catr.label()) + str(cnt)
-    legendIcon.save(os.path.join(outputProjectFileName, "legend",
-                                 layerName + "_" + safeLabel + ".png"))
-    catLegend += """<tr><td style="text-align: center;"><img src="legend/"""
-    catLegend += layerName + "_" + safeLabel + """.png" /></td><td>"""
+    catLegend += """<tr><td style="text-align: center;">"""
+    catLegend += sprite.icon(symbol, iconSize) + """</td><td>"""
     catLegend += catr.label().replace("'", "\\'") + "</td></tr>"
     return catLegend
 
@@ -289,6 +285,71 @@ def clusterScript(safeLayerName):
     return cluster
 
 
+def chunkLoaderScript(safeLayerName, cluster):
+    # markercluster only picks up the markers there when a layer is added
+    if cluster:
+        addCluster = """
+                cluster_{sln}.clearLayers();
+                cluster_{sln}.addLayer(layer_{sln});"""
+    else:
+        addCluster = ""
+    loader = """
+        var chunksExtent_{sln} = qgis2webChunksExtent('json_{sln}');
+        if (chunksExtent_{sln}) {{
+            bounds_group.addLayer(L.rectangle([
+                [chunksExtent_{sln}[1], chunksExtent_{sln}[0]],
+                [chunksExtent_{sln}[3], chunksExtent_{sln}[2]]]));
+        }}
+        function loadChunks_{sln}() {{
+            var bounds = map.getBounds();
+            qgis2webLoadChunks('json_{sln}',
+                [bounds.getWest(), bounds.getSouth(),
+                 bounds.getEast(), bounds.getNorth()],
+                function(geojson) {{
+                layer_{sln}.addData(geojson);
+                if (typeof filterFunc === 'function') {{
+                    filterFunc();
+                }}%s
+            }});
+        }}
+        map.on('moveend', loadChunks_{sln});
+        map.whenReady(loadChunks_{sln});""" % addCluster
+    return loader.format(sln=safeLayerName)
+
+
+def rasterTilesScript(layer, safeLayerName, zIndex, tileZooms, extension):
+    zIndex = zIndex + 400
+    pt2 = layer.extent()
+    crsSrc = layer.crs()
+    crsDest = QgsCoordinateReferenceSystem(4326)
+    try:
+        xform = QgsCoordinateTransform(crsSrc, crsDest, QgsProject.instance())
+    except Exception:
+        xform = QgsCoordinateTransform(crsSrc, crsDest)
+    pt3 = xform.transformBoundingBox(pt2)
+    bounds = '[[' + str(pt3.yMinimum()) + ','
+    bounds += str(pt3.xMinimum()) + '],['
+    bounds += str(pt3.yMaximum()) + ','
+    bounds += str(pt3.xMaximum()) + ']]'
+    # past the deepest zoom level exported, the last tiles are scaled up
+    raster = """
+        map.createPane('pane_{sln}');
+        map.getPane('pane_{sln}').style.zIndex = {zIndex};
+        var img_bounds_{sln} = {bounds};
+        var layer_{sln} = L.tileLayer('data/{sln}/{{z}}/{{x}}/{{y}}.{ext}', {{
+            pane: 'pane_{sln}',
+            bounds: img_bounds_{sln},
+            minZoom: {minZoom},
+            minNativeZoom: {minZoom},
+            maxNativeZoom: {maxZoom},
+            maxZoom: 28
+        }});
+        bounds_group.addLayer(L.rectangle(img_bounds_{sln}));""".format(
+        sln=safeLayerName, zIndex=zIndex, bounds=bounds, ext=extension,
+        minZoom=tileZooms[0], maxZoom=tileZooms[1])
+    return raster
+
+
 def wmsScript(layer, safeLayerName, useWMS, useWMTS, identify, minZoom,
               maxZoom, count):
     d = parse_qs(layer.source())
@@ -379,9 +440,9 @@ def wmsScript(layer, safeLayerName, useWMS, useWMTS, identify, minZoom,
     return wms, useWMS, useWMTS
 
 
-def rasterScript(layer, safeLayerName, zIndex):
+def rasterScript(layer, safeLayerName, zIndex, extension="png"):
     zIndex = zIndex + 400
-    out_raster = 'data/' + safeLayerName + '.png'
+    out_raster = 'data/' + safeLayerName + '.' + extension
     pt2 = layer.extent()
     crsSrc = layer.crs()
     crsDest = QgsCoordinateReferenceSystem(4326)
@@ -652,92 +713,145 @@ def endHTMLscript(wfsLayers, layerSearch, filterItems, labelCode, labels,
                               filterItems[item]["type"] + '"')
         endHTML += ",".join(filterList) + "};"
         endHTML += r"""
+        var filterIndexes = {};
+        function compareFilterEntries(a, b) {
+          return a[0] < b[0] ? -1 : (a[0] > b[0] ? 1 : 0);
+        }
+        function filterBound(entries, value, upper) {
+          var lo = 0;
+          var hi = entries.length;
+          while (lo < hi) {
+            var mid = (lo + hi) >>> 1;
+            if (upper ? !(value < entries[mid][0]) : entries[mid][0] < value) {
+              lo = mid + 1;
+            } else {
+              hi = mid;
+            }
+          }
+          return lo;
+        }
+        function filterIndex(layerName, features) {
+          var index = filterIndexes[layerName];
+          if (!index || index.features !== features) {
+            index = {features: features, sublayers: [], shown: [], fields: {}};
+            filterIndexes[layerName] = index;
+          }
+          if (index.sublayers.length == features.length) {
+            return index;
+          }
+          // chunked layers keep adding features as more chunks load, and
+          // filtered out sublayers are no longer in the layer to be found
+          var sublayers = new Map();
+          this[layerName].eachLayer(function(sublayer) {
+            sublayers.set(sublayer.feature, sublayer);
+          });
+          for (var i = index.sublayers.length; i < features.length; i++) {
+            index.sublayers.push(sublayers.get(features[i]));
+            index.shown.push(sublayers.has(features[i]));
+          }
+          index.fields = {};
+          return index;
+        }
+        function filterFieldIndex(index, key, type) {
+          if (key in index.fields) {
+            return index.fields[key];
+          }
+          var features = index.features;
+          var field;
+          if (type == "str" || type == "bool") {
+            field = Object.create(null);
+            for (var i = 0; i < features.length; i++) {
+              var value = String(features[i].properties[key]);
+              (field[value] = field[value] || []).push(i);
+            }
+          } else {
+            field = {entries: [], unvalued: []};
+            for (var i = 0; i < features.length; i++) {
+              var value = features[i].properties[key];
+              if (type == "int") {
+                value = parseInt(value);
+              }
+              if (value === null || value === undefined || value !== value) {
+                field.unvalued.push(i);
+              } else {
+                field.entries.push([value, i]);
+              }
+            }
+            field.entries.sort(compareFilterEntries);
+          }
+          index.fields[key] = field;
+          return field;
+        }
         function filterFunc() {
           map.eachLayer(function(lyr){
           if ("options" in lyr && "dataVar" in lyr["options"]){
-            features = this[lyr["options"]["dataVar"]].features.slice(0);
-            try{
-              for (key in Filters){
-                keyS = key.replace(/[^a-zA-Z0-9_]/g, "")
+            var layerName = lyr["options"]["layerName"];
+            var features = this[lyr["options"]["dataVar"]].features;
+            var index = filterIndex(layerName, features);
+            var hits = new Uint32Array(features.length);
+            var filters = 0;
+            function hit(matching, start, end) {
+              for (var i = start; i < end; i++) {
+                hits[matching[i]] += 1;
+              }
+            }
+            for (var key in Filters){
+              if (features.length == 0 || !(key in features[0].properties)) {
+                continue;
+              }
+              var keyS = key.replace(/[^a-zA-Z0-9_]/g, "");
+              try{
                 if (Filters[key] == "str" || Filters[key] == "bool"){
                   var selection = [];
                   var options = document.getElementById("sel_" + keyS).options
                   for (var i=0; i < options.length; i++) {
                     if (options[i].selected) selection.push(options[i].value);
                   }
-                    try{
-                      if (key in features[0].properties){
-                        for (i = features.length - 1;
-                          i >= 0; --i){
-                          if (selection.indexOf(
-                          features[i].properties[key])<0
-                          && selection.length>0) {
-                          features.splice(i,1);
-                          }
-                        }
-                      }
-                    } catch(err){
+                  if (selection.length == 0) {
+                    continue;
                   }
-                }
-                if (Filters[key] == "int"){
-                  sliderVals =  document.getElementById(
-                    "div_" + keyS).noUiSlider.get();
-                  try{
-                    if (key in features[0].properties){
-                    for (i = features.length - 1; i >= 0; --i){
-                      if (parseInt(features[i].properties[key])
-                          < sliderVals[0]
-                          || parseInt(features[i].properties[key])
-                          > sliderVals[1]){
-                            features.splice(i,1);
-                          }
-                        }
-                      }
-                    } catch(err){
-                    }
+                  var field = filterFieldIndex(index, key, Filters[key]);
+                  for (var i=0; i < selection.length; i++) {
+                    var matching = field[selection[i]] || [];
+                    hit(matching, 0, matching.length);
                   }
-                if (Filters[key] == "real"){
-                  sliderVals =  document.getElementById(
-                    "div_" + keyS).noUiSlider.get();
-                  try{
-                    if (key in features[0].properties){
-                    for (i = features.length - 1; i >= 0; --i){
-                      if (features[i].properties[key]
-                          < sliderVals[0]
-                          || features[i].properties[key]
-                          > sliderVals[1]){
-                            features.splice(i,1);
-                          }
-                        }
-                      }
-                    } catch(err){
-                    }
+                } else {
+                  var range;
+                  if (Filters[key] == "int" || Filters[key] == "real"){
+                    range = document.getElementById(
+                      "div_" + keyS).noUiSlider.get().map(Number);
+                  } else {
+                    var HTMLkey = key.replace(
+                      /[&\/\\#,+()$~%.'":*?<>{} ]/g, '');
+                    range = [document.getElementById("dat_" +
+                      HTMLkey + "_date1").value.replace(" ", "T"),
+                      document.getElementById("dat_" +
+                      HTMLkey + "_date2").value.replace(" ", "T")];
                   }
-                if (Filters[key] == "date"
-                  || Filters[key] == "datetime"
-                  || Filters[key] == "time"){
-                  try{
-                    if (key in features[0].properties){
-                      HTMLkey = key.replace(/[&\/\\#,+()$~%.'":*?<>{} ]/g, '');
-                      startdate = document.getElementById("dat_" +
-                        HTMLkey + "_date1").value.replace(" ", "T");
-                      enddate = document.getElementById("dat_" +
-                        HTMLkey + "_date2").value.replace(" ", "T");
-                      for (i = features.length - 1; i >= 0; --i){
-                        if (features[i].properties[key] < startdate
-                          || features[i].properties[key] > enddate){
-                          features.splice(i,1);
-                        }
-                      }
-                    }
-                  } catch(err){
+                  var field = filterFieldIndex(index, key, Filters[key]);
+                  var entries = field.entries;
+                  var start = filterBound(entries, range[0], false);
+                  var end = filterBound(entries, range[1], true);
+                  for (var i = start; i < end; i++) {
+                    hits[entries[i][1]] += 1;
                   }
+                  hit(field.unvalued, 0, field.unvalued.length);
+                }
+                filters += 1;
+              } catch(err){
+              }
+            }
+            for (var i = 0; i < features.length; i++) {
+              var show = hits[i] == filters;
+              if (show != index.shown[i] && index.sublayers[i]) {
+                if (show) {
+                  this[layerName].addLayer(index.sublayers[i]);
+                } else {
+                  this[layerName].removeLayer(index.sublayers[i]);
                 }
               }
-            } catch(err){
+              index.shown[i] = show;
             }
-          this[lyr["options"]["layerName"]].clearLayers();
-          this[lyr["options"]["layerName"]].addData(features);
           """ + labelCode + """
           }
           })
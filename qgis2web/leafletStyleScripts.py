@@ -1,4 +1,6 @@
+import json
 import os
+import re
 import shutil
 from qgis.core import (QgsSingleSymbolRenderer,
                        QgsCategorizedSymbolRenderer,
@@ -9,13 +11,16 @@ from qgis.core import (QgsSingleSymbolRenderer,
                        QgsSimpleLineSymbolLayer,
                        QgsSimpleFillSymbolLayer,
                        QgsLinePatternFillSymbolLayer,
-                       QgsSvgMarkerSymbolLayer)
+                       QgsSvgMarkerSymbolLayer,
+                       QgsSymbolLayer)
 from qgis2web.exp2js import compile_to_file
-from qgis2web.utils import getRGBAColor, handleHiddenField
+from qgis2web.utils import (getRGBAColor, handleHiddenField, RULE_ATTRIBUTE,
+                            dataDefinedJS, dataDefinedAttribute)
 
 
 def getLayerStyle(layer, sln, interactivity, markerFolder,
-                  outputProjectFilename, useShapes, feedback):
+                  outputProjectFilename, useShapes, feedback,
+                  evaluateRules=False, dataDefined=None):
     markerType = None
     useMapUnits = False
     renderer = layer.renderer()
@@ -40,7 +45,7 @@ def getLayerStyle(layer, sln, interactivity, markerFolder,
             (styleCode, markerType, useMapUnits,
              pattern) = getSymbolAsStyle(symbol, markerFolder,
                                          layer_alpha, interactivity, sln, sl,
-                                         useMapUnits, feedback)
+                                         useMapUnits, feedback, dataDefined)
             style += pattern
             style += """
         function style_%s_%s() {
@@ -50,58 +55,116 @@ def getLayerStyle(layer, sln, interactivity, markerFolder,
         classAttr = handleHiddenField(layer, renderer.classAttribute())
         symbol = renderer.categories()[0].symbol()
         slCount = symbol.symbolLayerCount()
-        patterns = ""
         if slCount < 1:
             slCount = 1
         for sl in range(slCount):
-            style += """
-        function style_%s_%s(feature) {
-            switch(String(feature.properties['%s'])) {""" % (sln, sl,
-                                                             classAttr)
+            # each distinct style is built once and looked up by value
+            patterns = ""
+            styles = []
+            entries = {}
+            index = {}
+            default = -1
             for cat in renderer.categories():
                 (styleCode, markerType, useMapUnits,
                  pattern) = getSymbolAsStyle(cat.symbol(), markerFolder,
                                              layer_alpha, interactivity, sln,
-                                             sl, useMapUnits, feedback)
+                                             sl, useMapUnits, feedback,
+                                             dataDefined)
                 patterns += pattern
+                if styleCode not in entries:
+                    entries[styleCode] = len(styles)
+                    styles.append(getTableEntry(styleCode))
                 if (cat.value() is not None and cat.value() != ""):
-                    style += """
-                case '%s':""" % str(cat.value()).replace("'", "\\'")
-                else:
-                    style += """
-                default:"""
-                style += """
-                    return %s
-                    break;""" % styleCode
-            style = patterns + style + """
-            }
-        }"""
+                    index.setdefault(str(cat.value()), entries[styleCode])
+                elif default == -1:
+                    default = entries[styleCode]
+            style += patterns + """
+        var categoryStyles_%(sln)s_%(sl)s = [%(styles)s];
+        var categoryIndex_%(sln)s_%(sl)s = %(index)s;
+        function style_%(sln)s_%(sl)s(feature) {
+            var key = String(feature.properties['%(attr)s']);
+            var entry = categoryStyles_%(sln)s_%(sl)s[
+                categoryIndex_%(sln)s_%(sl)s.hasOwnProperty(key) ?
+                categoryIndex_%(sln)s_%(sl)s[key] : %(default)d];
+            return typeof entry === 'function' ? entry(feature) : entry;
+        }""" % {"sln": sln, "sl": sl, "styles": ", ".join(styles),
+                "index": json.dumps(index), "attr": classAttr,
+                "default": default}
     elif isinstance(renderer, QgsGraduatedSymbolRenderer):
         classAttr = handleHiddenField(layer, renderer.classAttribute())
         symbol = renderer.ranges()[0].symbol()
         slCount = symbol.symbolLayerCount()
-        patterns = ""
+        # ranges sorted by upper bound, searched with a binary search
+        ranges = sorted(renderer.ranges(),
+                        key=lambda ran: (ran.upperValue(), ran.lowerValue()))
         if slCount < 1:
             slCount = 1
         for sl in range(slCount):
-            style += """
-        function style_%s_%s(feature) {""" % (sln, sl)
-            for ran in renderer.ranges():
+            patterns = ""
+            breaks = []
+            styles = []
+            for ran in ranges:
                 (styleCode, markerType, useMapUnits,
                  pattern) = getSymbolAsStyle(ran.symbol(), markerFolder,
                                              layer_alpha, interactivity, sln,
-                                             sl, useMapUnits, feedback)
+                                             sl, useMapUnits, feedback,
+                                             dataDefined)
+                patterns += pattern
+                breaks.append("[%f, %f]" % (ran.lowerValue(),
+                                            ran.upperValue()))
+                styles.append(getTableEntry(styleCode))
+            style += patterns + """
+        var rangeBreaks_%(sln)s_%(sl)s = [%(breaks)s];
+        var rangeStyles_%(sln)s_%(sl)s = [%(styles)s];
+        function style_%(sln)s_%(sl)s(feature) {
+            var value = feature.properties['%(attr)s'];
+            var breaks = rangeBreaks_%(sln)s_%(sl)s;
+            var low = 0;
+            var high = breaks.length;
+            while (low < high) {
+                var middle = (low + high) >> 1;
+                if (breaks[middle][1] < value) {
+                    low = middle + 1;
+                } else {
+                    high = middle;
+                }
+            }
+            if (low == breaks.length || !(breaks[low][0] <= value)) {
+                return;
+            }
+            var entry = rangeStyles_%(sln)s_%(sl)s[low];
+            return typeof entry === 'function' ? entry(feature) : entry;
+        }""" % {"sln": sln, "sl": sl, "breaks": ", ".join(breaks),
+                "styles": ", ".join(styles), "attr": classAttr}
+    elif isinstance(renderer, QgsRuleBasedRenderer) and evaluateRules:
+        # the rule each feature is drawn with was worked out on export,
+        # which is only done when every rule has each symbol layer
+        symbol = renderer.rootRule().children()[0].symbol()
+        slCount = symbol.symbolLayerCount()
+        if slCount < 1:
+            slCount = 1
+        for sl in range(slCount):
+            patterns = ""
+            styles = []
+            for rule in renderer.rootRule().children():
+                (styleCode, markerType, useMapUnits,
+                 pattern) = getSymbolAsStyle(rule.symbol(), markerFolder,
+                                             layer_alpha, interactivity, sln,
+                                             sl, useMapUnits, feedback,
+                                             dataDefined)
                 patterns += pattern
-                style += """
-            if (feature.properties['%(a)s'] >= %(l)f """
-                style += """&& feature.properties['%(a)s'] <= %(u)f ) {
-                return %(s)s
-            }"""
-                style = style % {"a": classAttr, "l": ran.lowerValue(),
-                                 "u": ran.upperValue(),
-                                 "s": styleCode}
-            style = patterns + style + """
-        }"""
+                styles.append(getTableEntry(styleCode))
+            style += patterns + """
+        var ruleStyles_%(sln)s_%(sl)s = [%(styles)s];
+        function style_%(sln)s_%(sl)s(feature) {
+            var entry = ruleStyles_%(sln)s_%(sl)s[
+                feature.properties['%(attr)s']];
+            if (entry === undefined) {
+                return {fill: false, stroke: false};
+            }
+            return typeof entry === 'function' ? entry(feature) : entry;
+        }""" % {"sln": sln, "sl": sl, "styles": ", ".join(styles),
+                "attr": RULE_ATTRIBUTE}
     elif isinstance(renderer, QgsRuleBasedRenderer):
         symbol = renderer.rootRule().children()[0].symbol()
         slCount = symbol.symbolLayerCount()
@@ -136,7 +199,7 @@ def getLayerStyle(layer, sln, interactivity, markerFolder,
                      pattern) = getSymbolAsStyle(rule.symbol(), markerFolder,
                                                  layer_alpha, interactivity,
                                                  sln, sl, useMapUnits,
-                                                 feedback)
+                                                 feedback, dataDefined)
                     patterns += pattern
                     name = "".join((sln, "rule", str(count)))
                     exp = rule.filterExpression()
@@ -166,8 +229,18 @@ def getLayerStyle(layer, sln, interactivity, markerFolder,
     return style, markerType, useMapUnits, useShapes
 
 
+def getTableEntry(styleCode):
+    # Styles depending on the feature or the zoom are built for each
+    # feature, the rest are shared by every feature using them
+    if re.search(r"\b(feature|geoStyle)\b", styleCode) is None:
+        return styleCode
+    return """function(feature) {
+            return %s
+        }""" % styleCode
+
+
 def getSymbolAsStyle(symbol, markerFolder, layer_transparency, interactivity,
-                     sln, sl, useMapUnits, feedback):
+                     sln, sl, useMapUnits, feedback, dataDefined=None):
     interactive = str(interactivity).lower()
     markerType = None
     pattern = ""
@@ -183,15 +256,24 @@ def getSymbolAsStyle(symbol, markerFolder, layer_transparency, interactivity,
     except Exception:
         props = {}
     if isinstance(sl, QgsSimpleMarkerSymbolLayer):
-        color = getRGBAColor(props["color"], alpha)
-        borderColor = getRGBAColor(props["outline_color"], alpha)
+        color = dataDefinedJS(dataDefined, sl,
+                              QgsSymbolLayer.PropertyFillColor,
+                              getRGBAColor(props["color"], alpha), "Leaflet",
+                              alpha=alpha)
+        borderColor = dataDefinedJS(dataDefined, sl,
+                                    QgsSymbolLayer.PropertyStrokeColor,
+                                    getRGBAColor(props["outline_color"],
+                                                 alpha), "Leaflet",
+                                    alpha=alpha)
         borderWidth = props["outline_width"]
         borderUnits = props["outline_width_unit"]
         lineStyle = props["outline_style"]
         sizeUnits = props["size_unit"]
         size = sl.size()
         if sizeUnits != "MapUnit":
-            size = size * 2
+            size = dataDefinedJS(dataDefined, sl,
+                                 QgsSymbolLayer.PropertySize, size * 2,
+                                 "Leaflet", 2)
         shape = 8
         try:
             shape = sl.shape()
@@ -213,15 +295,18 @@ def getSymbolAsStyle(symbol, markerFolder, layer_transparency, interactivity,
     elif isinstance(sl, QgsSvgMarkerSymbolLayer):
         path = os.path.join(markerFolder, os.path.basename(sl.path()))
         svgSize = sl.size() * 3.8
-        if symbol.dataDefinedAngle().isActive():
+        rot = str(sl.angle() * 0.0174533)
+        if dataDefinedAttribute(dataDefined, sl,
+                                QgsSymbolLayer.PropertyAngle):
+            rot = dataDefinedJS(dataDefined, sl, QgsSymbolLayer.PropertyAngle,
+                                rot, "Leaflet", 0.0174533)
+        elif symbol.dataDefinedAngle().isActive():
+            # not evaluated on export, so only a field can be read
             if symbol.dataDefinedAngle().useExpression():
                 rot = "0"
             else:
-                rot = "feature.get("
-                rot += symbol.dataDefinedAngle().expressionOrField()
-                rot += ") * 0.0174533"
-        else:
-            rot = str(sl.angle() * 0.0174533)
+                rot = "feature.properties['%s'] * 0.0174533" % (
+                    symbol.dataDefinedAngle().expressionOrField())
         shutil.copy(sl.path(), path)
         style = """
         rotationAngle: %s,
@@ -230,7 +315,10 @@ def getSymbolAsStyle(symbol, markerFolder, layer_transparency, interactivity,
                                     svgSize))
         markerType = "marker"
     elif isinstance(sl, QgsSimpleLineSymbolLayer):
-        color = getRGBAColor(props["line_color"], alpha)
+        color = dataDefinedJS(dataDefined, sl,
+                              QgsSymbolLayer.PropertyStrokeColor,
+                              getRGBAColor(props["line_color"], alpha),
+                              "Leaflet", alpha=alpha)
         line_width = props["line_width"]
         line_style = props["line_style"]
         line_units = props["line_width_unit"]
@@ -244,9 +332,16 @@ def getSymbolAsStyle(symbol, markerFolder, layer_transparency, interactivity,
         style += """
                 fillOpacity: 0,"""
     elif isinstance(sl, QgsSimpleFillSymbolLayer):
-        fillColor = getRGBAColor(props["color"], alpha)
+        fillColor = dataDefinedJS(dataDefined, sl,
+                                  QgsSymbolLayer.PropertyFillColor,
+                                  getRGBAColor(props["color"], alpha),
+                                  "Leaflet", alpha=alpha)
 
-        borderColor = getRGBAColor(props["outline_color"], alpha)
+        borderColor = dataDefinedJS(dataDefined, sl,
+                                    QgsSymbolLayer.PropertyStrokeColor,
+                                    getRGBAColor(props["outline_color"],
+                                                 alpha), "Leaflet",
+                                    alpha=alpha)
         borderStyle = props["outline_style"]
         borderWidth = props["outline_width"]
         line_units = props["outline_width_unit"]
@@ -40,12 +40,16 @@ from qgis2web.leafletFileScripts import (writeFoldersAndFiles,
                                          writeCSS,
                                          writeHTMLstart)
 from qgis2web.leafletLayerScripts import writeVectorLayer
+from qgis2web.legendSprite import LegendSprite
+from qgis2web.layerAnalysis import layerAnalyses
+from qgis2web.exp2js import write_expressions
 from qgis2web.leafletScriptStrings import (jsonScript,
                                            scaleDependentLabelScript,
                                            mapScript,
                                            featureGroupsScript,
                                            extentScript,
                                            rasterScript,
+                                           rasterTilesScript,
                                            wmsScript,
                                            scaleDependentLayerScript,
                                            addressSearchScript,
@@ -58,12 +62,22 @@ from qgis2web.leafletScriptStrings import (jsonScript,
                                            titleSubScript,
                                            getVTStyles,
                                            getVTLabels)
-from qgis2web.utils import (ALL_ATTRIBUTES, exportVector,
-                            exportRaster, safeName, returnFilterValues)
+from qgis2web.utils import (ALL_ATTRIBUTES, vectorExportJob,
+                            vectorTileExportJobs, rasterExportJob,
+                            runExportJobs, vectorExportFormat,
+                            VECTOR_TILES, TOPOJSON, COMPACT, CHUNKED,
+                            RASTER_TILE_FORMATS, rasterExportFormat,
+                            rasterTileExportJobs, rasterTileZooms,
+                            vectorTileZooms, simplifyOptions, safeName,
+                            returnFilterValues, compressAssets,
+                            getUsedAttributes, rasterEncoding,
+                            rasterImageExtension, rulesEvaluatedOnExport,
+                            rulesShareSymbolLayers,
+                            dataDefinedExportedAttributes, onMainThread)
 from qgis2web.writer import (Writer,
                              WriterResult,
                              translator)
-from qgis2web.feedbackDialog import Feedback
+from qgis2web.feedbackDialog import Feedback, ExportCancelled
 
 
 class LeafletWriter(Writer):
@@ -87,21 +101,25 @@ class LeafletWriter(Writer):
         if not feedback:
             feedback = Feedback()
         feedback.showFeedback('Creating Leaflet map...')
-        self.preview_file = self.writeLeaflet(
-            iface,
-            feedback,
-            layer_list=self.layers,
-            popup=self.popup,
-            visible=self.visible,
-            interactive=self.interactive,
-            json=self.json,
-            cluster=self.cluster,
-            getFeatureInfo=self.getFeatureInfo,
-            params=self.params,
-            folder=dest_folder)
+        with layerAnalyses():
+            self.preview_file, rebuilt = self.writeLeaflet(
+                iface,
+                feedback,
+                layer_list=self.layers,
+                popup=self.popup,
+                visible=self.visible,
+                interactive=self.interactive,
+                json=self.json,
+                cluster=self.cluster,
+                getFeatureInfo=self.getFeatureInfo,
+                params=self.params,
+                folder=dest_folder)
         result = WriterResult()
         result.index_file = self.preview_file
         result.folder = os.path.dirname(self.preview_file)
+        result.rebuilt_layers = rebuilt
+        if self.params["Data export"]["Pre-compress files"]:
+            compressAssets(result.folder, feedback)
         for dirpath, dirnames, filenames in os.walk(result.folder):
             result.files.extend([os.path.join(dirpath, f) for f in filenames])
         return result
@@ -111,8 +129,23 @@ class LeafletWriter(Writer):
             cls, iface, feedback, folder,
             layer_list, visible, interactive, cluster,
             json, getFeatureInfo, params, popup):
+        if onMainThread():
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        # cancelling raises ExportCancelled from anywhere in the export
+        try:
+            return cls.writeLeafletFiles(iface, feedback, folder, layer_list,
+                                         visible, interactive, cluster, json,
+                                         getFeatureInfo, params, popup)
+        finally:
+            if onMainThread():
+                QApplication.restoreOverrideCursor()
+
+    @classmethod
+    def writeLeafletFiles(
+            cls, iface, feedback, folder,
+            layer_list, visible, interactive, cluster,
+            json, getFeatureInfo, params, popup):
         outputProjectFileName = folder
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         legends = {}
         mapUnitLayers = []
         canvas = iface.mapCanvas()
@@ -124,9 +157,19 @@ class LeafletWriter(Writer):
         stamp = datetime.now().strftime("%Y_%m_%d-%H_%M_%S_%f")
         outputProjectFileName = os.path.join(outputProjectFileName,
                                              'qgis2web_' + stamp)
+        feedback.setOutputFolder(outputProjectFileName)
         outputIndex = os.path.join(outputProjectFileName, 'index.html')
 
         minify = params["Data export"]["Minify GeoJSON files"]
+        useCache = params["Data export"]["Reuse unchanged layers"]
+        vectorFormat = params["Data export"]["Vector format"]
+        rasterFormat = params["Data export"]["Raster format"]
+        resampling = params["Data export"]["Raster resampling"]
+        encoding = params["Data export"]["Raster encoding"]
+        quality = int(params["Data export"]["Raster quality"])
+        simplify = params["Data export"]["Simplify geometries"]
+        usedOnly = params["Data export"]["Export only used attributes"]
+        evaluateRules = params["Data export"]["Evaluate rules on export"]
         precision = params["Data export"]["Precision"]
         extent = params["Scale/Zoom"]["Extent"]
         minZoom = params["Scale/Zoom"]["Min zoom level"]
@@ -147,7 +190,8 @@ class LeafletWriter(Writer):
 
         usedFields = [ALL_ATTRIBUTES] * len(popup)
 
-        QgsApplication.initQgis()
+        if onMainThread():
+            QgsApplication.initQgis()
 
         dataStore, cssStore = writeFoldersAndFiles(pluginDir, feedback,
                                                    outputProjectFileName,
@@ -176,35 +220,76 @@ class LeafletWriter(Writer):
         jsons = ""
         crs = QgsCoordinateReferenceSystem.EpsgCrsId
         exp_crs = QgsCoordinateReferenceSystem(4326, crs)
+        tileZooms = vectorTileZooms(minZoom, maxZoom)
+        simplify = simplifyOptions(simplify, maxZoom)
+        if matchCRS and rasterFormat in RASTER_TILE_FORMATS:
+            # The tiles are cut on the EPSG:3857 grid, which a map in the
+            # project CRS can't show, so rasters stay single images
+            QgsMessageLog.logMessage(
+                "Raster tiles need the map in EPSG:3857, exporting rasters "
+                "as single images to match the project CRS", "qgis2web",
+                level=Qgis.Warning)
+            rasterFormat = "Single image"
+        formats = [vectorExportFormat(layer, vectorFormat, jsonEncode,
+                                      canvas, restrictToExtent, extent) or
+                   rasterExportFormat(layer, rasterFormat)
+                   for layer, jsonEncode in zip(layer_list, json)]
+        evaluatedRules = [rulesEvaluatedOnExport(layer, layerFormat,
+                                                 evaluateRules) and
+                          rulesShareSymbolLayers(layer)
+                          for layer, layerFormat in zip(layer_list, formats)]
+        dataDefined = [dataDefinedExportedAttributes(layer, layerFormat)
+                       for layer, layerFormat in zip(layer_list, formats)]
         lyrCount = 0
+        exportJobs = []
         for layer, jsonEncode, eachPopup, clst in zip(layer_list, json,
                                                       popup, cluster):
+            if feedback.cancelled():
+                raise ExportCancelled()
             rawLayerName = layer.name()
             safeLayerName = safeName(rawLayerName) + "_" + str(lyrCount)
             vts = layer.customProperty("VectorTilesReader/vector_tile_url")
+            usedAttributes = None
+            if usedOnly and layer.type() == QgsMapLayer.VectorLayer:
+                usedAttributes = getUsedAttributes(
+                    layer, safeLayerName, eachPopup, interactive[lyrCount],
+                    params, evaluatedRules[lyrCount])
             if layer.providerType() != 'WFS' or jsonEncode is True:
-                if layer.type() == QgsMapLayer.VectorLayer and vts is None:
-                    feedback.showFeedback('Exporting %s to JSON...' %
-                                          layer.name())
-                    exportVector(layer, safeLayerName, dataStore,
-                                 restrictToExtent, iface, extent, precision,
-                                 exp_crs, minify)
-                    jsons += jsonScript(safeLayerName)
+                if formats[lyrCount] == VECTOR_TILES:
+                    exportJobs.extend(vectorTileExportJobs(
+                        layer, safeLayerName, dataStore, restrictToExtent,
+                        iface, extent, tileZooms, usedAttributes,
+                        evaluatedRules[lyrCount], dataDefined[lyrCount]))
+                elif layer.type() == QgsMapLayer.VectorLayer and vts is None:
+                    exportJobs.append(vectorExportJob(
+                        layer, safeLayerName, dataStore, restrictToExtent,
+                        iface, extent, precision, exp_crs, minify, simplify,
+                        formats[lyrCount], usedAttributes,
+                        evaluatedRules[lyrCount], dataDefined[lyrCount]))
+                    jsons += jsonScript(safeLayerName,
+                                        formats[lyrCount] == COMPACT)
                     scaleDependentLabels = \
                         scaleDependentLabelScript(layer, safeLayerName)
                     labelVisibility += scaleDependentLabels
-                    feedback.completeStep()
 
                 elif layer.type() == QgsMapLayer.RasterLayer:
-                    if layer.dataProvider().name() != "wms":
-                        layersFolder = os.path.join(outputProjectFileName,
-                                                    "data")
-                        exportRaster(layer, lyrCount, layersFolder,
-                                     feedback, iface, matchCRS)
+                    layersFolder = os.path.join(outputProjectFileName,
+                                                "data")
+                    if formats[lyrCount] in RASTER_TILE_FORMATS:
+                        exportJobs.extend(rasterTileExportJobs(
+                            layer, safeLayerName, layersFolder,
+                            rasterTileZooms(layer, minZoom, maxZoom),
+                            formats[lyrCount], quality))
+                    elif layer.dataProvider().name() != "wms":
+                        exportJobs.append(rasterExportJob(
+                            layer, lyrCount, layersFolder, iface, matchCRS,
+                            int(maxZoom), resampling,
+                            rasterEncoding(layer, encoding), quality))
             if layer.hasScaleBasedVisibility():
                 scaleDependentLayers += scaleDependentLayerScript(
                     layer, safeLayerName, clst)
             lyrCount += 1
+        rebuilt = runExportJobs(exportJobs, feedback, useCache)
         if scaleDependentLayers != "":
             scaleDependentLayers = scaleDependentScript(scaleDependentLayers)
 
@@ -242,6 +327,7 @@ class LeafletWriter(Writer):
         new_src += middle
         new_src += extentCode
 
+        sprite = LegendSprite("legend/sprite.png")
         for count, layer in enumerate(layer_list):
             rawLayerName = layer.name()
             safeLayerName = safeName(rawLayerName) + "_" + str(count)
@@ -269,7 +355,13 @@ class LeafletWriter(Writer):
                                              restrictToExtent, extent,
                                              feedback, labelCode, vtLabels,
                                              vtStyles, useMultiStyle, useHeat,
-                                             useVT, useShapes, useOSMB)
+                                             useVT, useShapes, useOSMB,
+                                             tileZooms
+                                             if formats[count] == VECTOR_TILES
+                                             else None,
+                                             formats[count], sprite,
+                                             evaluatedRules[count],
+                                             dataDefined[count])
                 if useMapUnits:
                     mapUnitLayers.append(safeLayerName)
             elif layer.type() == QgsMapLayer.RasterLayer:
@@ -282,16 +374,31 @@ class LeafletWriter(Writer):
                                                          minZoom, maxZoom,
                                                          count)
                     feedback.completeStep()
+                elif formats[count] in RASTER_TILE_FORMATS:
+                    feedback.showFeedback('Writing %s as raster tiles...' %
+                                          layer.name())
+                    new_obj = rasterTilesScript(
+                        layer, safeLayerName, count,
+                        rasterTileZooms(layer, minZoom, maxZoom),
+                        RASTER_TILE_FORMATS[formats[count]][0])
+                    feedback.completeStep()
                 else:
                     useRaster = True
                     feedback.showFeedback('Writing %s as raster layer...' %
                                           layer.name())
-                    new_obj = rasterScript(layer, safeLayerName, count)
+                    new_obj = rasterScript(
+                        layer, safeLayerName, count,
+                        rasterImageExtension(os.path.join(
+                            outputProjectFileName, "data"), safeLayerName))
                     feedback.completeStep()
                 if visible[count]:
                     new_obj += """
         map.addLayer(layer_""" + safeLayerName + """);"""
                 new_src += new_obj
+        sprite.write(os.path.join(outputProjectFileName, "legend"))
+        useExpressions = write_expressions(
+            os.path.join(outputProjectFileName, "js",
+                         "qgis2web_expressions.js"))
         the_src = new_src
         new_src = jsons + """
         <script>"""
@@ -373,10 +480,10 @@ class LeafletWriter(Writer):
             writeHTMLstart(outputIndex, title, cluster, addressSearch,
                            measure, matchCRS, layerSearch, filterItems, canvas,
                            locate, new_src, template, feedback, useMultiStyle,
-                           useHeat, useShapes, useOSMB, useWMS, useWMTS, useVT)
+                           useHeat, useShapes, useOSMB, useWMS, useWMTS, useVT,
+                           TOPOJSON in formats, COMPACT in formats,
+                           CHUNKED in formats, useExpressions)
         except Exception:
             QgsMessageLog.logMessage(traceback.format_exc(),
                                      "qgis2web", level=Qgis.Critical)
-        finally:
-            QApplication.restoreOverrideCursor()
-        return outputIndex
+        return outputIndex, rebuilt
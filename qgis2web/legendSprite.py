@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+from qgis.PyQt.QtCore import Qt, QSize, QBuffer, QIODevice
+from qgis.PyQt.QtGui import QImage, QPainter
+
+# Icons are laid out in rows across a sheet this wide
+SPRITE_WIDTH = 512
+
+
+class LegendSprite(object):
+    """
+    Collects the legend icons of one export into a single sprite sheet.
+    Every symbol is rendered once and identical renderings share a cell, so
+    a layer with thousands of categories in a handful of styles only adds a
+    handful of icons, and the layers list loads them all in one request.
+    Cells are placed as icons are added, so their HTML is known straight
+    away and the sheet is written once every layer has been seen
+    """
+
+    def __init__(self, url):
+        # the sheet's address, relative to the page showing the icons
+        self.url = url
+        self.cells = {}
+        self.images = []
+        self.x = 0
+        self.y = 0
+        self.rowHeight = 0
+
+    def icon(self, symbol, size=16):
+        """Returns the HTML showing symbol's legend icon"""
+        # an image rather than a pixmap, as exports may run off the GUI
+        # thread
+        image = symbol.asImage(QSize(size, size))
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, "PNG")
+        digest = hashlib.sha1(bytes(buffer.data())).hexdigest()
+        if digest not in self.cells:
+            self.cells[digest] = self._place(image)
+            self.images.append((digest, image))
+        x, y, width, height = self.cells[digest]
+        return ('<span style="display: inline-block; width: %dpx; '
+                'height: %dpx; background: url(%s) %dpx %dpx"></span>' %
+                (width, height, self.url, -x, -y))
+
+    def write(self, folder, name="sprite"):
+        """
+        Writes the sheet as name.png, and an index of its cells as
+        name.json, to folder
+        """
+        if not self.images:
+            return
+        width = max(x + w for x, y, w, h in self.cells.values())
+        height = self.y + self.rowHeight
+        sheet = QImage(width, height, QImage.Format_ARGB32)
+        sheet.fill(Qt.transparent)
+        painter = QPainter(sheet)
+        for digest, image in self.images:
+            x, y, w, h = self.cells[digest]
+            painter.drawImage(x, y, image)
+        painter.end()
+        sheet.save(os.path.join(folder, name + ".png"))
+        index = {digest: {"x": x, "y": y, "width": w, "height": h}
+                 for digest, (x, y, w, h) in self.cells.items()}
+        with open(os.path.join(folder, name + ".json"), "w") as f:
+            json.dump(index, f, sort_keys=True)
+
+    def _place(self, image):
+        width, height = image.width(), image.height()
+        if self.x and self.x + width > SPRITE_WIDTH:
+            self.x = 0
+            self.y += self.rowHeight
+            self.rowHeight = 0
+        cell = (self.x, self.y, width, height)
+        self.x += width
+        self.rowHeight = max(self.rowHeight, height)
+        return cell
@@ -25,6 +25,7 @@ import webbrowser
 # This import is to enable SIP API V2
 # noinspection PyUnresolvedReferences
 from qgis.core import (Qgis,
+                       QgsApplication,
                        QgsWkbTypes,
                        QgsProject,
                        QgsMapLayer,
@@ -46,6 +47,7 @@ from qgis.PyQt.QtGui import (QIcon)
 from qgis.PyQt.QtWidgets import (QAction,
                                  QAbstractItemView,
                                  QDialog,
+                                 QDialogButtonBox,
                                  QHBoxLayout,
                                  QTreeWidgetItem,
                                  QComboBox,
@@ -70,6 +72,7 @@ from qgis2web.mapboxWriter import MapboxWriter
 from qgis2web.writerRegistry import (WRITER_REGISTRY)
 from qgis2web.exporter import (EXPORTER_REGISTRY)
 from qgis2web.feedbackDialog import FeedbackDialog
+from qgis2web.exportTask import ExportTask
 
 from qgis.gui import QgsColorButton
 
@@ -91,12 +94,17 @@ class MainDialog(QDialog, FORM_CLASS):
         self.iface = iface
 
         self.previewUrl = None
+        # the preview and export running in the background, if any
+        self.previewTask = None
+        self.exportTask = None
         self.layer_search_combo = None
         self.layer_filter_select = None
         self.exporter_combo = None
 
         self.feedback = FeedbackDialog(self)
         self.feedback.setModal(True)
+        self.feedback.buttonBox.button(
+            QDialogButtonBox.Cancel).clicked.connect(self.cancelExport)
 
         stgs = QSettings()
 
@@ -294,11 +302,6 @@ class MainDialog(QDialog, FORM_CLASS):
                     else:
                         treeOption.setDisabled(False)
 
-    def createPreview(self):
-        writer = self.createWriter()
-        return writer.write(self.iface,
-                            dest_folder=utils.tempFolder()).index_file
-
     def shouldAutoPreview(self):
         """
         Returns a tuple, with a bool for whether the preview should
@@ -334,8 +337,34 @@ class MainDialog(QDialog, FORM_CLASS):
             self.previewMap()
 
     def previewMap(self):
-        preview_file = self.createPreview()
-        self.loadPreviewFile(preview_file)
+        """
+        Writes the preview in the background, replacing any preview still
+        being written
+        """
+        if self.previewTask is not None:
+            self.previewTask.cancel()
+        task = ExportTask(self.createWriter(), self.iface,
+                          utils.tempFolder(),
+                          description=self.tr('Updating web map preview'))
+        task.taskCompleted.connect(lambda: self.previewCompleted(task))
+        task.taskTerminated.connect(lambda: self.taskEnded(task))
+        self.previewTask = task
+        QgsApplication.taskManager().addTask(task)
+
+    def previewCompleted(self, task):
+        if task is self.previewTask:
+            self.loadPreviewFile(task.results.index_file)
+        self.taskEnded(task)
+
+    def taskEnded(self, task):
+        if task is self.previewTask:
+            self.previewTask = None
+        if task is self.exportTask:
+            self.exportTask = None
+
+    def cancelExport(self):
+        if self.exportTask is not None:
+            self.exportTask.cancel()
 
     def saveMap(self):
         writer = self.createWriter()
@@ -345,13 +374,20 @@ class MainDialog(QDialog, FORM_CLASS):
 
         self.feedback.reset()
         self.feedback.show()
-        results = writer.write(self.iface,
-                               dest_folder=write_folder,
-                               feedback=self.feedback)
+        task = ExportTask(writer, self.iface, write_folder, self.feedback,
+                          self.tr('Exporting web map'))
+        task.taskCompleted.connect(lambda: self.exportCompleted(task))
+        task.taskTerminated.connect(lambda: self.taskEnded(task))
+        self.exportTask = task
+        QgsApplication.taskManager().addTask(task)
+
+    def exportCompleted(self, task):
+        self.taskEnded(task)
         self.feedback.showFeedback('Success')
         if self.closeFeedbackOnSuccess.checkState() == Qt.Checked:
             self.feedback.close()
-        result = self.exporter.postProcess(results, feedback=self.feedback)
+        result = self.exporter.postProcess(task.results,
+                                           feedback=self.feedback)
         if result and (not os.environ.get('CI') and
                        not os.environ.get('TRAVIS')):
             webbrowser.open_new_tab(self.exporter.destinationUrl())
@@ -829,6 +865,22 @@ class TreeLayerItem(QTreeWidgetItem):
                 self.addChild(self.getFeatureInfoItem)
                 tree.setItemWidget(self.getFeatureInfoItem, 1,
                                    self.getFeatureInfoCheck)
+            else:
+                self.imageFormatItem = QTreeWidgetItem(self)
+                self.imageFormatCombo = QComboBox()
+                for option in ("Default", "Automatic", "PNG", "Palette PNG",
+                               "JPEG", "WebP"):
+                    self.imageFormatCombo.addItem(option)
+                index = self.imageFormatCombo.findText(
+                    layer.customProperty("qgis2web/Image format", "Default"))
+                if index != -1:
+                    self.imageFormatCombo.setCurrentIndex(index)
+                self.imageFormatItem.setText(0, "Image format")
+                self.imageFormatCombo.currentTextChanged.connect(
+                    self.changeImageFormat)
+                self.addChild(self.imageFormatItem)
+                tree.setItemWidget(self.imageFormatItem, 1,
+                                   self.imageFormatCombo)
 
     @property
     def popup(self):
@@ -882,6 +934,9 @@ class TreeLayerItem(QTreeWidgetItem):
         self.layer.setCustomProperty("qgis2web/GetFeatureInfo",
                                      isGetFeatureInfo)
 
+    def changeImageFormat(self, imageFormat):
+        self.layer.setCustomProperty("qgis2web/Image format", imageFormat)
+
 
 class TreeSettingItem(QTreeWidgetItem):
 
@@ -41,7 +41,7 @@ def writeFoldersAndFiles(pluginDir, feedback, outputProjectFileName,
 
 def writeHTMLstart(outputIndex, webpage_name, cluster_set, address, measure,
                    layerSearch, canvas, locate, qgis2webJS, template,
-                   feedback):
+                   feedback, useExpressions=True):
     useCluster = False
     for cluster in cluster_set:
         if cluster:
@@ -109,7 +109,9 @@ def writeHTMLstart(outputIndex, webpage_name, cluster_set, address, measure,
     else:
         locateJS = ""
     extraJS = ""
-    exp_js = """
+    exp_js = ""
+    if useExpressions:
+        exp_js = """
         <script src="js/qgis2web_expressions.js"></script>"""
 
     canvasSize = canvas.size()
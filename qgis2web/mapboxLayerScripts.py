@@ -1,6 +1,5 @@
 import re
 import os
-from PyQt5.QtCore import QSize
 from qgis.core import (QgsVectorLayer,
                        QgsSingleSymbolRenderer,
                        QgsCategorizedSymbolRenderer,
@@ -10,9 +9,7 @@ from qgis.core import (QgsVectorLayer,
                        QgsSimpleMarkerSymbolLayer,
                        QgsSimpleLineSymbolLayer,
                        QgsSimpleFillSymbolLayer,
-                       QgsSymbolLayerUtils,
                        QgsDataSourceUri,
-                       QgsRenderContext,
                        QgsExpression,
                        QgsWkbTypes)
 from qgis.utils import Qgis
@@ -30,6 +27,7 @@ try:
 except:
     vt_enabled = False
 from qgis2web.exp2js import compile_to_file
+from qgis2web.layerAnalysis import analyseLayer
 from qgis2web.utils import (writeTmpLayer, removeSpaces, exportImages, is25d,
                             safeName, handleHiddenField, add25dAttributes,
                             BLEND_MODES, TYPE_MAP, MB_TYPE_MAP)
@@ -40,7 +38,7 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
                      cluster, visible, json, legends, new_src, canvas, zIndex,
                      restrictToExtent, extent, feedback, labelCode, vtLabels,
                      vtStyles, useMultiStyle, useHeat, useVT, useShapes,
-                     useOSMB, vtSources, layers):
+                     useOSMB, vtSources, layers, sprite=None):
     vts = layer.customProperty("VectorTilesReader/vector_tile_url")
     feedback.showFeedback("Writing %s as JSON..." % layer.name())
     zIndex = zIndex + 400
@@ -58,31 +56,8 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
     if is25d(layer, canvas, restrictToExtent, extent):
         useOSMB = True
         shadows = ""
-        renderer = layer.renderer()
-        renderContext = QgsRenderContext.fromMapSettings(canvas.mapSettings())
-        fields = layer.fields()
-        renderer.startRender(renderContext, fields)
-        for feat in layer.getFeatures():
-            if isinstance(renderer, QgsCategorizedSymbolRenderer):
-                classAttribute = renderer.classAttribute()
-                attrValue = feat.attribute(classAttribute)
-                catIndex = renderer.categoryIndexForValue(attrValue)
-                categories = renderer.categories()
-                symbol = categories[catIndex].symbol()
-            elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-                classAttribute = renderer.classAttribute()
-                attrValue = feat.attribute(classAttribute)
-                ranges = renderer.ranges()
-                for range in ranges:
-                    if (attrValue >= range.lowerValue() and
-                            attrValue <= range.upperValue()):
-                        symbol = range.symbol().clone()
-            else:
-                symbol = renderer.symbolForFeature(feat, renderContext)
-            symbolLayer = symbol.symbolLayer(0)
-            if not symbolLayer.paintEffect().effectList()[0].enabled():
-                shadows = "'2015-07-15 10:00:00'"
-        renderer.stopRender(renderContext)
+        if analyseLayer(layer, canvas).shadows():
+            shadows = "'2015-07-15 10:00:00'"
         new_obj = """
         var osmb = new OSMBuildings(map).date(new Date({shadows}));
         osmb.set(json_{sln});""".format(shadows=shadows, sln=safeLayerName)
@@ -147,8 +122,7 @@ def writeVectorLayer(layer, safeLayerName, usedFields, highlight,
     else:
         mblayers = getLayerStyle(layer)
         markerType = mblayers[0]["type"]
-        (legend, symbol) = getLegend(layer, renderer, outputProjectFileName,
-                                     safeLayerName)
+        (legend, symbol) = getLegend(layer, renderer, sprite)
         legends[safeLayerName] = legend
         (new_obj, legends, wfsLayers,
          useMultiStyle) = getLayer(layer, renderer, safeLayerName,
@@ -369,14 +343,10 @@ def getPopups(layer, safeLayerName, highlight, popupsOnHover, popup, vts):
     return new_pop
 
 
-def getLegend(layer, renderer, outputProjectFileName, safeLayerName):
+def getLegend(layer, renderer, sprite):
     if isinstance(renderer, QgsSingleSymbolRenderer):
         symbol = renderer.symbol()
-        legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(symbol,
-                                                             QSize(16, 16))
-        legendIcon.save(os.path.join(outputProjectFileName, "legend",
-                                     safeLayerName + ".png"))
-        legend = ('<img src="legend/' + safeLayerName + '.png" /> ')
+        legend = sprite.icon(symbol) + ' '
         legend += layer.name()
     else:
         if isinstance(renderer, QgsCategorizedSymbolRenderer):
@@ -386,10 +356,8 @@ def getLegend(layer, renderer, outputProjectFileName, safeLayerName):
         elif isinstance(renderer, QgsRuleBasedRenderer):
             classes = renderer.rootRule().children()
         legend = "<table>"
-        for cnt, c in enumerate(classes):
-            symbol = c.symbol()
-            legend = iconLegend(symbol, c, outputProjectFileName,
-                                safeLayerName, legend, cnt)
+        for c in classes:
+            legend = iconLegend(c.symbol(), c, sprite, legend)
         legend += "</table>"
         symbol = classes[0].symbol()
     return (legend, symbol)
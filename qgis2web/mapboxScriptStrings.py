@@ -1,16 +1,12 @@
-import re
-import os
 import traceback
 import json
 from urllib.parse import parse_qs
-from PyQt5.QtCore import QSize
 from qgis.core import (QgsProject,
                        QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform,
                        QgsMapLayer,
                        QgsPalLayerSettings,
                        QgsSvgMarkerSymbolLayer,
-                       QgsSymbolLayerUtils,
                        QgsMessageLog,
                        Qgis,
                        QgsWkbTypes)
@@ -230,19 +226,13 @@ map.on('mouseleave', '%s', function () {
     return popup
 
 
-def iconLegend(symbol, catr, outputProjectFileName, layerName, catLegend, cnt):
+def iconLegend(symbol, catr, sprite, catLegend):
     try:
-        iconSize = (symbol.size() * 4) + 5
+        iconSize = int((symbol.size() * 4) + 5)
     except:
         iconSize = 16
-    legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(symbol,
-                                                         QSize(iconSize,
-                                                               iconSize))
-    safeLabel = re.sub(r'[\W_]+', '', catr.label()) + unicode(cnt)
-    legendIcon.save(os.path.join(outputProjectFileName, "legend",
-                                 layerName + "_" + safeLabel + ".png"))
-    catLegend += """<tr><td style="text-align: center;"><img src="legend/"""
-    catLegend += layerName + "_" + safeLabel + """.png" /></td><td>"""
+    catLegend += """<tr><td style="text-align: center;">"""
+    catLegend += sprite.icon(symbol, iconSize) + """</td><td>"""
     catLegend += catr.label().replace("'", "\\'") + "</td></tr>"
     return catLegend
 
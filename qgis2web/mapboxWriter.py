@@ -42,6 +42,9 @@ from qgis2web.mapboxFileScripts import (writeFoldersAndFiles,
                                         writeCSS,
                                         writeHTMLstart)
 from qgis2web.mapboxLayerScripts import writeVectorLayer
+from qgis2web.legendSprite import LegendSprite
+from qgis2web.layerAnalysis import layerAnalyses
+from qgis2web.exp2js import write_expressions
 from qgis2web.mapboxScriptStrings import (jsonScript,
                                           scaleDependentLabelScript,
                                           mapScript,
@@ -60,12 +63,15 @@ from qgis2web.mapboxScriptStrings import (jsonScript,
                                           titleSubScript,
                                           getVTStyles,
                                           getVTLabels)
-from qgis2web.utils import (ALL_ATTRIBUTES, PLACEMENT, exportVector,
-                            exportRaster, safeName, scaleToZoom)
+from qgis2web.utils import (ALL_ATTRIBUTES, PLACEMENT, vectorExportJob,
+                            rasterExportJob, runExportJobs, safeName,
+                            scaleToZoom, simplifyOptions, compressAssets,
+                            getUsedAttributes, rasterEncoding,
+                            rasterImageExtension, onMainThread)
 from qgis2web.writer import (Writer,
                              WriterResult,
                              translator)
-from qgis2web.feedbackDialog import Feedback
+from qgis2web.feedbackDialog import Feedback, ExportCancelled
 from qgis2web.bridgestyle.qgis import layerStyleAsMapbox
 
 
@@ -91,21 +97,25 @@ class MapboxWriter(Writer):
             feedback = Feedback()
 
         feedback.showFeedback('Creating Mapbox map...')
-        self.preview_file = self.writeMapbox(
-            iface,
-            feedback,
-            layer_list=self.layers,
-            groups=self.groups,
-            popup=self.popup,
-            visible=self.visible,
-            json=self.json,
-            cluster=self.cluster,
-            getFeatureInfo=self.getFeatureInfo,
-            params=self.params,
-            folder=dest_folder)
+        with layerAnalyses():
+            self.preview_file, rebuilt = self.writeMapbox(
+                iface,
+                feedback,
+                layer_list=self.layers,
+                groups=self.groups,
+                popup=self.popup,
+                visible=self.visible,
+                json=self.json,
+                cluster=self.cluster,
+                getFeatureInfo=self.getFeatureInfo,
+                params=self.params,
+                folder=dest_folder)
         result = WriterResult()
         result.index_file = self.preview_file
         result.folder = os.path.dirname(self.preview_file)
+        result.rebuilt_layers = rebuilt
+        if self.params["Data export"]["Pre-compress files"]:
+            compressAssets(result.folder, feedback)
         for dirpath, dirnames, filenames in os.walk(result.folder):
             result.files.extend([os.path.join(dirpath, f) for f in filenames])
         return result
@@ -116,7 +126,8 @@ class MapboxWriter(Writer):
             layer_list, groups, visible, cluster,
             json, getFeatureInfo, params, popup):
         outputProjectFileName = folder
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        if onMainThread():
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         legends = {}
         mapUnitLayers = []
         canvas = iface.mapCanvas()
@@ -128,13 +139,21 @@ class MapboxWriter(Writer):
         stamp = datetime.now().strftime("%Y_%m_%d-%H_%M_%S_%f")
         outputProjectFileName = os.path.join(outputProjectFileName,
                                              'qgis2web_' + unicode(stamp))
+        feedback.setOutputFolder(outputProjectFileName)
         outputIndex = os.path.join(outputProjectFileName, 'index.html')
 
         minify = params["Data export"]["Minify GeoJSON files"]
+        useCache = params["Data export"]["Reuse unchanged layers"]
+        usedOnly = params["Data export"]["Export only used attributes"]
+        resampling = params["Data export"]["Raster resampling"]
+        encoding = params["Data export"]["Raster encoding"]
+        quality = int(params["Data export"]["Raster quality"])
         precision = params["Data export"]["Precision"]
         extent = params["Scale/Zoom"]["Extent"]
         minZoom = params["Scale/Zoom"]["Min zoom level"]
         maxZoom = params["Scale/Zoom"]["Max zoom level"]
+        simplify = simplifyOptions(
+            params["Data export"]["Simplify geometries"], maxZoom)
         restrictToExtent = params["Scale/Zoom"]["Restrict to extent"]
         matchCRS = params["Appearance"]["Match project CRS"]
         addressSearch = params["Appearance"]["Add address search"]
@@ -150,7 +169,8 @@ class MapboxWriter(Writer):
 
         usedFields = [ALL_ATTRIBUTES] * len(popup)
 
-        QgsApplication.initQgis()
+        if onMainThread():
+            QgsApplication.initQgis()
 
         crsSrc = mapSettings.destinationCrs()
         crs = QgsCoordinateReferenceSystem.EpsgCrsId
@@ -191,21 +211,29 @@ class MapboxWriter(Writer):
         new_src = ""
         jsons = ""
         sources = []
+        imageLayers = []
         crs = QgsCoordinateReferenceSystem.EpsgCrsId
         exp_crs = QgsCoordinateReferenceSystem(4326, crs)
         lyrCount = 0
+        exportJobs = []
         for layer, jsonEncode, eachPopup, clst in zip(layer_list, json,
                                                       popup, cluster):
+            if feedback.cancelled():
+                raise ExportCancelled()
             rawLayerName = layer.name()
             safeLayerName = safeName(rawLayerName) + "_" + unicode(lyrCount)
             vts = layer.customProperty("VectorTilesReader/vector_tile_url")
             if layer.providerType() != 'WFS' or jsonEncode is True:
                 if layer.type() == QgsMapLayer.VectorLayer and vts is None:
-                    feedback.showFeedback('Exporting %s to JSON...' %
-                                          layer.name())
-                    exportVector(layer, safeLayerName, dataStore,
-                                 restrictToExtent, iface, extent, precision,
-                                 exp_crs, minify)
+                    usedAttributes = None
+                    if usedOnly:
+                        # Mapbox layers always open their popups
+                        usedAttributes = getUsedAttributes(
+                            layer, safeLayerName, eachPopup, True, params)
+                    exportJobs.append(vectorExportJob(
+                        layer, safeLayerName, dataStore, restrictToExtent,
+                        iface, extent, precision, exp_crs, minify, simplify,
+                        usedAttributes=usedAttributes))
                     jsons += jsonScript(safeLayerName)
                     sources.append("""
         "%s": {
@@ -216,33 +244,16 @@ class MapboxWriter(Writer):
                     scaleDependentLabels = \
                         scaleDependentLabelScript(layer, safeLayerName)
                     labelVisibility += scaleDependentLabels
-                    feedback.completeStep()
 
                 elif layer.type() == QgsMapLayer.RasterLayer:
                     if layer.dataProvider().name() != "wms":
                         layersFolder = os.path.join(outputProjectFileName,
                                                     "data")
-                        exportRaster(layer, lyrCount, layersFolder,
-                                     feedback, iface, matchCRS)
-                        rasterPath = './data/' + safeLayerName + '.png'
-                        extent = layer.extent()
-                        bbox = xform.transformBoundingBox(extent)
-                        sources.append("""
-        "%s": {
-            "type": "image",
-            "url": "%s",
-            "coordinates": [
-                [%f, %f],
-                [%f, %f],
-                [%f, %f],
-                [%f, %f]
-            ]
-        }""" % (
-                            safeLayerName, rasterPath,
-                            bbox.xMinimum(), bbox.yMinimum(),
-                            bbox.xMaximum(), bbox.yMinimum(),
-                            bbox.xMaximum(), bbox.yMaximum(),
-                            bbox.xMinimum(), bbox.yMaximum()))
+                        exportJobs.append(rasterExportJob(
+                            layer, lyrCount, layersFolder, iface, matchCRS,
+                            int(maxZoom), resampling,
+                            rasterEncoding(layer, encoding), quality))
+                        imageLayers.append((layer, safeLayerName))
                     else:
                         tileProps = parse_qs(layer.source())
                         if ('type' in tileProps and
@@ -263,8 +274,33 @@ class MapboxWriter(Writer):
             "tileSize": 256
         }""" % (safeLayerName, url))
             lyrCount += 1
+        rebuilt = runExportJobs(exportJobs, feedback, useCache)
+        # image sources point at whichever format each export chose
+        for layer, safeLayerName in imageLayers:
+            rasterPath = './data/%s.%s' % (
+                safeLayerName, rasterImageExtension(
+                    os.path.join(outputProjectFileName, "data"),
+                    safeLayerName))
+            bbox = xform.transformBoundingBox(layer.extent())
+            sources.append("""
+        "%s": {
+            "type": "image",
+            "url": "%s",
+            "coordinates": [
+                [%f, %f],
+                [%f, %f],
+                [%f, %f],
+                [%f, %f]
+            ]
+        }""" % (
+                safeLayerName, rasterPath,
+                bbox.xMinimum(), bbox.yMinimum(),
+                bbox.xMaximum(), bbox.yMinimum(),
+                bbox.xMaximum(), bbox.yMaximum(),
+                bbox.xMinimum(), bbox.yMaximum()))
 
         popupCode = ""
+        sprite = LegendSprite("legend/sprite.png")
         for count, layer in enumerate(layer_list):
             rawLayerName = layer.name()
             safeLayerName = safeName(rawLayerName) + "_" + unicode(count)
@@ -294,7 +330,8 @@ class MapboxWriter(Writer):
                                             feedback, labelCode, vtLabels,
                                             vtStyles, useMultiStyle,
                                             useHeat, useVT, useShapes,
-                                            useOSMB, vtSources, layers)
+                                            useOSMB, vtSources, layers,
+                                            sprite)
                 popupCode += popups
             elif layer.type() == QgsMapLayer.RasterLayer:
                 if layer.dataProvider().name() == "wms":
@@ -307,6 +344,10 @@ class MapboxWriter(Writer):
                                           layer.name())
                     layers.append(rasterScript(layer, safeLayerName, count))
                     feedback.completeStep()
+        sprite.write(os.path.join(outputProjectFileName, "legend"))
+        useExpressions = write_expressions(
+            os.path.join(outputProjectFileName, "js",
+                         "qgis2web_expressions.js"))
         glyphs = ("https://glfonts.lukasmartinelli.ch/fonts/{fontstack}/"
                   "{range}.pbf")
         s = """
@@ -385,11 +426,11 @@ var autolinker = new Autolinker({truncate: {length: 30, location: 'smart'}});
         # try:
         writeHTMLstart(outputIndex, title, cluster, addressSearch, measure,
                        layerSearch, canvas, locate, new_src, template,
-                       feedback)
+                       feedback, useExpressions)
         # except Exception as e:
         #     QgsMessageLog.logMessage(traceback.format_exc(), "qgis2web",
         #                              level=QgsMessageLog.CRITICAL)
         #     QApplication.restoreOverrideCursor()
         # finally:
         #     QApplication.restoreOverrideCursor()
-        return outputIndex
+        return outputIndex, rebuilt
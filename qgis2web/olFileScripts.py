@@ -3,7 +3,8 @@ import os
 import shutil
 from qgis.PyQt.QtCore import QDir
 from qgis.core import QgsDataSourceUri
-from qgis2web.utils import safeName
+from qgis2web.utils import (safeName, VECTOR_TILES, TOPOJSON, COMPACT,
+                            CHUNKED)
 
 
 def writeFiles(folder, restrictToExtent, feedback):
@@ -79,8 +80,17 @@ def writeLayerSearch(cssAddress, jsAddress, controlCount, layerSearch,
     return (jsAddress, cssAddress, layerSearch, controlCount)
 
 
-def writeScriptIncludes(layers, json, matchCRS):
+def writeScriptIncludes(layers, json, matchCRS, formats=None):
     geojsonVars = ""
+    if formats and TOPOJSON in formats:
+        geojsonVars += ('<script src="resources/qgis2web_topojson.js">'
+                        '</script>')
+    if formats and COMPACT in formats:
+        geojsonVars += ('<script src="resources/qgis2web_compact.js">'
+                        '</script>')
+    if formats and CHUNKED in formats:
+        geojsonVars += ('<script src="resources/qgis2web_chunks.js">'
+                        '</script>')
     wfsVars = ""
     styleVars = ""
     for count, (layer, encode2json) in enumerate(zip(layers, json)):
@@ -88,9 +98,13 @@ def writeScriptIncludes(layers, json, matchCRS):
         sln = safeName(layer.name()) + "_" + str(count)
         if layer.type() == layer.VectorLayer:
             if layer.providerType() != "WFS" or encode2json:
-                if vts is None:
+                if (vts is None and
+                        not (formats and formats[count] == VECTOR_TILES)):
                     geojsonVars += ('<script src="layers/%s"></script>' %
                                     (sln + ".js"))
+                    if formats and formats[count] == COMPACT:
+                        geojsonVars += ('<script>json_%s = compactToGeoJSON('
+                                        'json_%s);</script>' % (sln, sln))
             else:
                 layerSource = layer.source()
                 if ("retrictToRequestBBOX" in layerSource or
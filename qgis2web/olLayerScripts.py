@@ -5,7 +5,6 @@ from urllib.parse import parse_qs
 
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProject,
-                       QgsRenderContext,
                        QgsSingleSymbolRenderer,
                        QgsCategorizedSymbolRenderer,
                        QgsGraduatedSymbolRenderer,
@@ -13,7 +12,11 @@ from qgis.core import (QgsProject,
                        QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform,
                        QgsWkbTypes)
-from qgis2web.utils import safeName, is25d, BLEND_MODES
+from qgis2web.layerAnalysis import analyseLayer
+from qgis2web.utils import (safeName, is25d, BLEND_MODES, VECTOR_TILES,
+                            TOPOJSON, CHUNKED, RASTER_TILE_FORMATS,
+                            rasterTileZooms, rasterTileExtent,
+                            rasterImageExtension)
 
 try:
     from vector_tiles_reader.plugin.util.tile_json import TileJSON
@@ -30,7 +33,8 @@ except ImportError:
 
 def writeLayersAndGroups(layers, groups, visible, interactive, folder, popup,
                          settings, json, matchCRS, clustered, getFeatureInfo,
-                         iface, restrictToExtent, extent, bounds, authid):
+                         iface, restrictToExtent, extent, bounds, authid,
+                         formats=None, tileZooms=None, legend=None):
 
     canvas = iface.mapCanvas()
     layerVars = ""
@@ -43,11 +47,27 @@ def writeLayersAndGroups(layers, groups, visible, interactive, folder, popup,
         if is25d(layer, canvas, restrictToExtent, extent):
             pass
         else:
+            layerFormat = formats[count] if formats else None
+            if layerFormat == VECTOR_TILES:
+                layerTileZooms = tileZooms
+            elif layerFormat in RASTER_TILE_FORMATS:
+                layerTileZooms = rasterTileZooms(
+                    layer, settings["Scale/Zoom"]["Min zoom level"],
+                    settings["Scale/Zoom"]["Max zoom level"])
+            else:
+                layerTileZooms = None
+            imageExtension = "png"
+            if layer.type() == layer.RasterLayer:
+                imageExtension = rasterImageExtension(
+                    os.path.join(folder, "layers"),
+                    safeName(layer.name()) + "_" + str(count))
             (layerVar,
              vtLayers) = layerToJavascript(iface, layer, encode2json, matchCRS,
                                            interactive[count], cluster, info,
                                            restrictToExtent, extent, count,
-                                           vtLayers)
+                                           vtLayers, layerTileZooms,
+                                           layerFormat, imageExtension,
+                                           legend)
             layerVars += "\n" + "\n".join([layerVar])
     (groupVars, groupedLayers) = buildGroups(groups, qms, layer_names_id)
     (mapLayers, layerObjs, osmb) = layersAnd25d(layers, canvas,
@@ -99,7 +119,8 @@ ol.proj.get("%s").setExtent(%s);
 
 def layerToJavascript(iface, layer, encode2json, matchCRS, interactive,
                       cluster, info, restrictToExtent, extent, count,
-                      vtLayers):
+                      vtLayers, tileZooms=None, layerFormat=None,
+                      imageExtension="png", legend=None):
     (minResolution, maxResolution) = getScaleRes(layer)
     layerName = safeName(layer.name()) + "_" + str(count)
     rawName = layer.name()
@@ -121,6 +142,10 @@ def layerToJavascript(iface, layer, encode2json, matchCRS, interactive,
                 return getVT(vts), vtLayers
             else:
                 return "", vtLayers
+        if tileZooms is not None:
+            return getLocalVT(layerName, layerAttr, interactive,
+                              minResolution, maxResolution, tileZooms,
+                              renderer, layer, legend), vtLayers
         if isinstance(renderer, QgsHeatmapRenderer):
             (pointLayerType, hmRadius,
              hmRamp, hmWeight, hmWeightMax) = getHeatmap(layer, renderer)
@@ -134,7 +159,8 @@ def layerToJavascript(iface, layer, encode2json, matchCRS, interactive,
             return getJSON(layerName, crsConvert, layerAttr, interactive,
                            cluster, pointLayerType, minResolution,
                            maxResolution, hmRadius, hmRamp, hmWeight,
-                           hmWeightMax, renderer, layer), vtLayers
+                           hmWeightMax, renderer, layer,
+                           layerFormat, legend), vtLayers
     elif layer.type() == layer.RasterLayer:
         if layer.providerType().lower() == "wms":
             source = layer.source()
@@ -150,8 +176,13 @@ def layerToJavascript(iface, layer, encode2json, matchCRS, interactive,
                 return getWMS(source, layer, layerAttr, layerName, opacity,
                               minResolution, maxResolution, info), vtLayers
         elif layer.providerType().lower() == "gdal":
+            if tileZooms is not None:
+                return getRasterTiles(iface, layer, layerName, layerAttr,
+                                      minResolution, maxResolution, tileZooms,
+                                      layerFormat, matchCRS), vtLayers
             return getRaster(iface, layer, layerName, layerAttr, minResolution,
-                             maxResolution, matchCRS), vtLayers
+                             maxResolution, matchCRS,
+                             imageExtension), vtLayers
 
 
 def getScaleRes(layer):
@@ -179,31 +210,8 @@ def getAttribution(layer):
 
 def build25d(canvas, layer, count):
     shadows = ""
-    renderer = layer.renderer()
-    renderContext = QgsRenderContext.fromMapSettings(canvas.mapSettings())
-    fields = layer.fields()
-    renderer.startRender(renderContext, fields)
-    for feat in layer.getFeatures():
-        if isinstance(renderer, QgsCategorizedSymbolRenderer):
-            classAttribute = renderer.classAttribute()
-            attrValue = feat.attribute(classAttribute)
-            catIndex = renderer.categoryIndexForValue(attrValue)
-            categories = renderer.categories()
-            symbol = categories[catIndex].symbol()
-        elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-            classAttribute = renderer.classAttribute()
-            attrValue = feat.attribute(classAttribute)
-            ranges = renderer.ranges()
-            for range in ranges:
-                if (attrValue >= range.lowerValue() and
-                        attrValue <= range.upperValue()):
-                    symbol = range.symbol().clone()
-        else:
-            symbol = renderer.symbolForFeature(feat, renderContext)
-        symbolLayer = symbol.symbolLayer(0)
-        if not symbolLayer.paintEffect().effectList()[0].enabled():
-            shadows = "'2015-07-15 10:00:00'"
-    renderer.stopRender(renderContext)
+    if analyseLayer(layer, canvas).shadows():
+        shadows = "'2015-07-15 10:00:00'"
     osmb = """
 var osmb = new OSMBuildings(map).date(new Date({shadows}));
 osmb.set(json_{sln}_{count});""".format(shadows=shadows,
@@ -377,8 +385,34 @@ function get%(n)sJson(geojson) {
 
 def getJSON(layerName, crsConvert, layerAttr, interactive, cluster,
             pointLayerType, minResolution, maxResolution, hmRadius, hmRamp,
-            hmWeight, hmWeightMax, renderer, layer):
-    layerCode = '''var format_%(n)s = new ol.format.GeoJSON();
+            hmWeight, hmWeightMax, renderer, layer, layerFormat=None,
+            legend=None):
+    layerCode = ""
+    if layerFormat == TOPOJSON:
+        layerCode += "json_%(n)s = topojsonToGeoJSON(json_%(n)s);\n" % {
+            "n": layerName}
+    if layerFormat == CHUNKED:
+        # only the chunks in view are fetched, each of them once. Features
+        # without a geometry are in no chunk, but in the index itself, so
+        # are added straight away
+        layerCode += '''var format_%(n)s = new ol.format.GeoJSON();
+var jsonSource_%(n)s = new ol.source.Vector({
+    attributions: '%(layerAttr)s',
+    strategy: ol.loadingstrategy.bbox,
+    loader: function(extent, resolution, projection) {
+        qgis2webLoadChunks('json_%(n)s',
+            ol.proj.transformExtent(extent, projection, 'EPSG:4326'),
+            function(geojson) {
+                jsonSource_%(n)s.addFeatures(
+                    format_%(n)s.readFeatures(geojson, %(crs)s));
+            });
+    }
+});
+jsonSource_%(n)s.addFeatures(
+    format_%(n)s.readFeatures(json_%(n)s, %(crs)s));''' % {
+            "n": layerName, "crs": crsConvert, "layerAttr": layerAttr}
+    else:
+        layerCode += '''var format_%(n)s = new ol.format.GeoJSON();
 var features_%(n)s = format_%(n)s.readFeatures(json_%(n)s, %(crs)s);
 var jsonSource_%(n)s = new ol.source.Vector({
     attributions: '%(layerAttr)s',
@@ -407,33 +441,65 @@ jsonSource_%(n)s.addFeatures(features_%(n)s);''' % {"n": layerName,
                                             "int": str(interactive).lower()}
     else:
         layerCode += writeHeatmap(hmRadius, hmRamp, hmWeight, hmWeightMax)
+    layerCode += getTitle(renderer, layer, legend)
+    return layerCode
+
+
+def getLocalVT(layerName, layerAttr, interactive, minResolution,
+               maxResolution, tileZooms, renderer, layer, legend=None):
+    # ol.Feature rather than ol.render.Feature, so that popups and
+    # highlighting work the same as for GeoJSON layers
+    layerCode = '''var lyr_%(n)s = new ol.layer.VectorTile({
+                declutter: true,
+                source: new ol.source.VectorTile({
+                    attributions: '%(layerAttr)s',
+                    format: new ol.format.MVT({featureClass: ol.Feature}),
+                    url: './layers/%(n)s/{z}/{x}/{y}.pbf',
+                    tileGrid: ol.tilegrid.createXYZ({
+                        tileSize: 256, minZoom: %(minZoom)d,
+                        maxZoom: %(maxZoom)d
+                    })
+                }),%(min)s %(max)s
+                style: style_%(n)s,
+                interactive: %(int)s,''' % {"n": layerName,
+                                            "layerAttr": layerAttr,
+                                            "minZoom": tileZooms[0],
+                                            "maxZoom": tileZooms[1],
+                                            "min": minResolution,
+                                            "max": maxResolution,
+                                            "int": str(interactive).lower()}
+    layerCode += getTitle(renderer, layer, legend)
+    return layerCode
+
+
+def getTitle(renderer, layer, legend):
     if isinstance(renderer, QgsSingleSymbolRenderer):
-        layerCode += '''
-                title: '<img src="styles/legend/%(icon)s.png" /> %(name)s'
-            });''' % {"icon": layerName,
+        title = '''
+                title: '%(icon)s %(name)s'
+            });''' % {"icon": legend.icon(renderer.symbol()),
                       "name": layer.name().replace("'", "\\'")}
     elif isinstance(renderer, QgsCategorizedSymbolRenderer):
-        layerCode += getLegend(renderer.categories(), layer, layerName)
+        title = getLegend(renderer.categories(), layer, legend)
     elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-        layerCode += getLegend(renderer.ranges(), layer, layerName)
+        title = getLegend(renderer.ranges(), layer, legend)
     else:
-        layerCode += '''
+        title = '''
                 title: '%(name)s'
             });''' % {"name": layer.name()}
-    return layerCode
+    return title
 
 
-def getLegend(subitems, layer, layerName):
+def getLegend(subitems, layer, legend):
     icons = ""
-    for count, subitem in enumerate(subitems):
+    for subitem in subitems:
         text = subitem.label().replace("'", "\\'")
         icons += ("""\\
-    <img src="styles/legend/%(icon)s_%(count)s.png" /> %(text)s<br />""" %
-                  {"icon": layerName, "count": count, "text": text})
-    legend = '''
+    %(icon)s %(text)s<br />""" % {"icon": legend.icon(subitem.symbol()),
+                                  "text": text})
+    title = '''
     title: '%(name)s<br />%(icons)s'
         });''' % {"icons": icons, "name": layer.name()}
-    return legend
+    return title
 
 
 def isCluster(cluster, renderer):
@@ -617,7 +683,7 @@ def getWMS(source, layer, layerAttr, layerName, opacity, minResolution,
 
 
 def getRaster(iface, layer, layerName, layerAttr, minResolution, maxResolution,
-              matchCRS):
+              matchCRS, extension="png"):
     crsSrc = layer.crs()
     projectCRS = iface.mapCanvas().mapSettings().destinationCrs()
     if not (matchCRS and crsSrc == projectCRS):
@@ -643,16 +709,52 @@ def getRaster(iface, layer, layerName, layerAttr, minResolution, maxResolution,
                             %(minRes)s
                             %(maxRes)s
                             source: new ol.source.ImageStatic({
-                               url: "./layers/%(n)s.png",
+                               url: "./layers/%(n)s.%(ext)s",
     attributions: '%(layerAttr)s',
                                 projection: '%(mapCRS)s',
                                 alwaysInRange: true,
                                 imageExtent: %(extent)s
                             })
                         });''' % {"n": layerName,
+                                  "ext": extension,
                                   "extent": sExtent,
                                   "name": layer.name(),
                                   "minRes": minResolution,
                                   "maxRes": maxResolution,
                                   "mapCRS": mapCRS,
                                   "layerAttr": layerAttr}
+
+
+def getRasterTiles(iface, layer, layerName, layerAttr, minResolution,
+                   maxResolution, tileZooms, layerFormat, matchCRS):
+    # The extent keeps tiles outside the layer from being requested. It is
+    # in map units, so it is left out when the map is not in EPSG:3857.
+    projectCRS = iface.mapCanvas().mapSettings().destinationCrs()
+    if matchCRS and projectCRS.authid() != "EPSG:3857":
+        tileExtent = ""
+    else:
+        extent = rasterTileExtent(layer)
+        tileExtent = "extent: [%f, %f, %f, %f]," % (
+            extent.xMinimum(), extent.yMinimum(), extent.xMaximum(),
+            extent.yMaximum())
+    return '''var lyr_%(n)s = new ol.layer.Tile({
+                            opacity: 1,
+                            title: "%(name)s",
+                            %(minRes)s
+                            %(maxRes)s
+                            %(extent)s
+                            source: new ol.source.XYZ({
+                                attributions: '%(layerAttr)s',
+                                url: './layers/%(n)s/{z}/{x}/{y}.%(ext)s',
+                                minZoom: %(minZoom)d,
+                                maxZoom: %(maxZoom)d
+                            })
+                        });''' % {"n": layerName,
+                                  "name": layer.name(),
+                                  "minRes": minResolution,
+                                  "maxRes": maxResolution,
+                                  "extent": tileExtent,
+                                  "layerAttr": layerAttr,
+                                  "ext": RASTER_TILE_FORMATS[layerFormat][0],
+                                  "minZoom": tileZooms[0],
+                                  "maxZoom": tileZooms[1]}
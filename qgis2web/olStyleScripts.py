@@ -2,10 +2,11 @@ import os
 import shutil
 import re
 import codecs
+import json
 import math
 import xml.etree.ElementTree
 import traceback
-from qgis.PyQt.QtCore import QDir, QSize
+from qgis.PyQt.QtCore import QDir
 from qgis.core import (QgsSingleSymbolRenderer,
                        QgsCategorizedSymbolRenderer,
                        QgsGraduatedSymbolRenderer,
@@ -16,17 +17,20 @@ from qgis.core import (QgsSingleSymbolRenderer,
                        QgsSimpleLineSymbolLayer,
                        QgsSimpleFillSymbolLayer,
                        QgsLinePatternFillSymbolLayer,
-                       QgsSymbolLayerUtils)
+                       QgsSymbolLayer)
 from qgis2web.exp2js import compile_to_file
-from qgis2web.utils import safeName, getRGBAColor, handleHiddenField, TYPE_MAP
+from qgis2web.utils import (safeName, getRGBAColor, handleHiddenField,
+                            TYPE_MAP, RULE_ATTRIBUTE, dataDefinedJS,
+                            dataDefinedAttribute)
 
 
-def exportStyles(layers, folder, clustered, feedback):
+def exportStyles(layers, folder, clustered, feedback, evaluatedRules=None,
+                 dataDefined=None):
     stylesFolder = os.path.join(folder, "styles")
     QDir().mkpath(stylesFolder)
-    legendFolder = os.path.join(stylesFolder, "legend")
-    QDir().mkpath(legendFolder)
+    QDir().mkpath(os.path.join(stylesFolder, "legend"))
     vtStyles = {}
+    vtDefs = {}
     mapUnitLayers = []
     for count, (layer, cluster) in enumerate(zip(layers, clustered)):
         sln = safeName(layer.name()) + "_" + str(count)
@@ -40,26 +44,38 @@ def exportStyles(layers, folder, clustered, feedback):
 
         renderer = layer.renderer()
         layer_alpha = layer.opacity()
+        layerProperties = (dataDefined[count]
+                           if dataDefined is not None else None)
 
         try:
             if isinstance(renderer, QgsSingleSymbolRenderer):
                 (style, pattern, setPattern, value,
                  useMapUnits) = singleSymbol(renderer, stylesFolder,
-                                             layer_alpha, sln, legendFolder,
-                                             layer, feedback)
+                                             layer_alpha, sln, layer,
+                                             feedback, layerProperties)
             elif isinstance(renderer, QgsCategorizedSymbolRenderer):
                 (style, pattern, setPattern, value, defs,
                  useMapUnits) = categorized(defs, sln, layer, renderer,
-                                            legendFolder, stylesFolder,
-                                            layer_alpha, feedback)
+                                            stylesFolder, layer_alpha,
+                                            cluster, feedback,
+                                            layerProperties)
             elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-                (style, pattern, setPattern, value,
-                 useMapUnits) = graduated(layer, renderer, legendFolder, sln,
-                                          stylesFolder, layer_alpha, feedback)
+                (style, pattern, setPattern, value, defs,
+                 useMapUnits) = graduated(defs, layer, renderer, sln,
+                                          stylesFolder, layer_alpha, cluster,
+                                          feedback, layerProperties)
+            elif (isinstance(renderer, QgsRuleBasedRenderer) and
+                    evaluatedRules is not None and evaluatedRules[count]):
+                (style, pattern, setPattern, value, defs,
+                 useMapUnits) = evaluatedRuleBased(defs, renderer,
+                                                   stylesFolder, layer_alpha,
+                                                   sln, layer, cluster,
+                                                   feedback, layerProperties)
             elif isinstance(renderer, QgsRuleBasedRenderer):
                 (style, pattern, setPattern, value,
                  useMapUnits) = ruleBased(renderer, folder, stylesFolder,
-                                          layer_alpha, sln, layer, feedback)
+                                          layer_alpha, sln, layer, feedback,
+                                          layerProperties)
             else:
                 value = "''"
                 style = """
@@ -101,8 +117,9 @@ var style_%(name)s = %(style)s;
                         {"defs": defs, "pattern": pattern, "name": sln,
                          "style": style, "setPattern": setPattern})
         elif style != "" and style != "''":
-            new_vtStyle = defs
-            new_vtStyle += "if (feature.get('layer') == "
+            # the style tables are built once for the whole tile layer
+            vtDefs[vts] = vtDefs.get(vts, "") + defs + "\n"
+            new_vtStyle = "if (feature.get('layer') == "
             new_vtStyle += """'%s' && feature.getGeometry().getType() == '%s'){
             return %s(feature, resolution);
         }""" % (
@@ -121,10 +138,10 @@ var style_%(name)s = %(style)s;
         path = os.path.join(stylesFolder, styleName + "_style.js")
 
         with codecs.open(path, "w", "utf-8") as f:
-            f.write('''
+            f.write('''%(defs)s
 var style_%(name)s = function(feature, resolution) {
     %(style)s;
-}''' % {"defs": defs, "pattern": pattern, "name": styleName,
+}''' % {"defs": vtDefs[k], "pattern": pattern, "name": styleName,
                     "style": styleString, "setPattern": setPattern})
     return mapUnitLayers
 
@@ -206,51 +223,58 @@ def getLabelFormat(layer):
     return (labelRes, size, face, color, bufferColor, bufferWidth)
 
 
-def singleSymbol(renderer, stylesFolder, layer_alpha, sln, legendFolder,
-                 layer, feedback):
+def singleSymbol(renderer, stylesFolder, layer_alpha, sln, layer, feedback,
+                 dataDefined=None):
     symbol = renderer.symbol()
     (style, pattern, setPattern,
      useMapUnits) = getSymbolAsStyle(symbol, stylesFolder,
                                      layer_alpha, renderer, sln, layer,
-                                     feedback)
+                                     feedback, dataDefined=dataDefined)
     style = "var style = " + style
-    legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(
-        symbol, QSize(16, 16))
-    legendIcon.save(os.path.join(legendFolder, sln + ".png"))
     value = 'var value = ""'
     return (style, pattern, setPattern, value, useMapUnits)
 
 
-def categorized(defs, sln, layer, renderer, legendFolder, stylesFolder,
-                layer_alpha, feedback):
-    # cluster = False
-    defs += """
-function categories_%s(feature, value, size, resolution, labelText,
-                       labelFont, labelFill, bufferColor, bufferWidth,
-                       placement) {
-                switch(value.toString()) {""" % sln
-    cats = []
+def categorized(defs, sln, layer, renderer, stylesFolder, layer_alpha,
+                cluster, feedback, dataDefined=None):
+    # Every distinct category style is built once, when the script loads,
+    # and looked up by value. Styles which depend on the feature or the
+    # resolution are written as functions building them instead
+    styles = []
+    entries = {}
+    index = {}
+    default = -1
     useAnyMapUnits = False
-    for cnt, cat in enumerate(renderer.categories()):
-        legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(cat.symbol(),
-                                                             QSize(16, 16))
-        legendIcon.save(os.path.join(legendFolder,
-                                     sln + "_" + str(cnt) + ".png"))
-        if (cat.value() is not None and cat.value() != ""):
-            categoryStr = "case '%s':" % str(cat.value()).replace("'", "\\'")
-        else:
-            categoryStr = "default:"
+    for cat in renderer.categories():
         (style, pattern, setPattern,
          useMapUnits) = (getSymbolAsStyle(cat.symbol(), stylesFolder,
                                           layer_alpha, renderer, sln, layer,
-                                          feedback))
+                                          feedback, labels=False,
+                                          dataDefined=dataDefined))
         if useMapUnits:
             useAnyMapUnits = True
-        categoryStr += '''
-                    return %s;
-                    break;''' % style
-        cats.append(categoryStr)
-    defs += "\n".join(cats) + "}};"
+        if style not in entries:
+            entries[style] = len(styles)
+            styles.append(getStyleTableEntry(style, cluster))
+        if (cat.value() is not None and cat.value() != ""):
+            index.setdefault(str(cat.value()), entries[style])
+        elif default == -1:
+            default = entries[style]
+    defs += """
+var categoryStyles_%(sln)s = [%(styles)s];
+var categoryIndex_%(sln)s = %(index)s;
+function categories_%(sln)s(feature, value, size, resolution, labelText,
+                       labelFont, labelFill, bufferColor, bufferWidth,
+                       placement) {
+                var key = String(value);
+                var entry = categoryStyles_%(sln)s[
+                    categoryIndex_%(sln)s.hasOwnProperty(key) ?
+                    categoryIndex_%(sln)s[key] : %(default)d];
+                return tableStyle(entry, feature, size, resolution, labelText,
+                                  labelFont, labelFill, bufferColor,
+                                  bufferWidth, placement);
+};""" % {"sln": sln, "styles": ",\n".join(styles),
+         "index": json.dumps(index), "default": default}
     style = """
 var style = categories_%s(feature, value, size, resolution, labelText,
                           labelFont, labelFill, bufferColor,
@@ -259,35 +283,64 @@ var style = categories_%s(feature, value, size, resolution, labelText,
     return (style, pattern, setPattern, value, defs, useAnyMapUnits)
 
 
-def graduated(layer, renderer, legendFolder, sln, stylesFolder, layer_alpha,
-              feedback):
-    # cluster = False
-    ranges = []
-    elseif = ""
+def getStyleTableEntry(style, cluster):
+    # Styles are shared by every feature using them, unless they have to be
+    # rebuilt for each feature. Clustered point styles grow with the cluster
+    # size, and pattern fills are only created once the script has loaded
+    names = ["feature", "resolution", "m2px"]
+    if cluster:
+        names.append("size")
+    if (re.search(r"\b(%s)\b" % "|".join(names), style) is None and
+            "fill_" not in style):
+        return style
+    return """function(feature, size, resolution) {
+    return %s;
+}""" % style
+
+
+def graduated(defs, layer, renderer, sln, stylesFolder, layer_alpha, cluster,
+              feedback, dataDefined=None):
+    # The ranges are sorted by their upper bound, so the range holding a
+    # value is found with a binary search over the breaks, and its styles
+    # are built once, when the script loads
+    ranges = sorted(renderer.ranges(),
+                    key=lambda ran: (ran.upperValue(), ran.lowerValue()))
+    breaks = []
+    styles = []
     useAnyMapUnits = False
-    for cnt, ran in enumerate(renderer.ranges()):
-        legendIcon = QgsSymbolLayerUtils.symbolPreviewPixmap(
-            ran.symbol(), QSize(16, 16))
-        legendIcon.save(os.path.join(
-            legendFolder, sln + "_" + str(cnt) + ".png"))
+    for ran in ranges:
         (symbolstyle, pattern, setPattern,
          useMapUnits) = getSymbolAsStyle(ran.symbol(), stylesFolder,
                                          layer_alpha, renderer, sln, layer,
-                                         feedback)
-        ranges.append("""%sif (value >= %f && value <= %f) {
-            style = %s
-                    }""" % (elseif, ran.lowerValue(), ran.upperValue(),
-                            symbolstyle))
-        elseif = " else "
+                                         feedback, labels=False,
+                                         dataDefined=dataDefined)
+        breaks.append("[%f, %f]" % (ran.lowerValue(), ran.upperValue()))
+        styles.append(getStyleTableEntry(symbolstyle, cluster))
         if useMapUnits:
             useAnyMapUnits = True
-    style = "".join(ranges)
+    defs += """
+var rangeBreaks_%(sln)s = [%(breaks)s];
+var rangeStyles_%(sln)s = [%(styles)s];
+function ranges_%(sln)s(feature, value, size, resolution, labelText,
+                       labelFont, labelFill, bufferColor, bufferWidth,
+                       placement) {
+                var entry = rangeStyles_%(sln)s[
+                    rangeIndex(rangeBreaks_%(sln)s, value)];
+                return tableStyle(entry, feature, size, resolution, labelText,
+                                  labelFont, labelFill, bufferColor,
+                                  bufferWidth, placement);
+};""" % {"sln": sln, "breaks": ", ".join(breaks),
+         "styles": ",\n".join(styles)}
+    style = """
+var style = ranges_%s(feature, value, size, resolution, labelText,
+                      labelFont, labelFill, bufferColor,
+                      bufferWidth, placement)""" % sln
     value = getValue(layer, renderer)
-    return (style, pattern, setPattern, value, useAnyMapUnits)
+    return (style, pattern, setPattern, value, defs, useAnyMapUnits)
 
 
 def ruleBased(renderer, folder, stylesFolder, layer_alpha, sln, layer,
-              feedback):
+              feedback, dataDefined=None):
     # cluster = False
     template = """
         function rules_%s(feature, value) {
@@ -314,7 +367,8 @@ def ruleBased(renderer, folder, stylesFolder, layer_alpha, sln, layer,
         symbol = rule.symbol()
         (styleCode, pattern, setPattern,
          useMapUnits) = getSymbolAsStyle(symbol, stylesFolder, layer_alpha,
-                                         renderer, sln, layer, feedback)
+                                         renderer, sln, layer, feedback,
+                                         dataDefined=dataDefined)
         name = "".join((sln, "rule", str(count)))
         exp = rule.filterExpression()
         if rule.isElse():
@@ -335,6 +389,44 @@ def ruleBased(renderer, folder, stylesFolder, layer_alpha, sln, layer,
     return (style, pattern, setPattern, value, useAnyMapUnits)
 
 
+def evaluatedRuleBased(defs, renderer, stylesFolder, layer_alpha, sln, layer,
+                       cluster, feedback, dataDefined=None):
+    # The rule each feature is drawn with was worked out on export, so the
+    # styles are looked up by the index stored in the feature
+    styles = []
+    pattern = ""
+    setPattern = ""
+    useAnyMapUnits = False
+    for rule in renderer.rootRule().children():
+        if rule.symbol() is None:
+            styles.append("[]")
+            continue
+        (styleCode, pattern, setPattern,
+         useMapUnits) = getSymbolAsStyle(rule.symbol(), stylesFolder,
+                                         layer_alpha, renderer, sln, layer,
+                                         feedback, labels=False,
+                                         dataDefined=dataDefined)
+        styles.append(getStyleTableEntry(styleCode, cluster))
+        if useMapUnits:
+            useAnyMapUnits = True
+    defs += """
+var ruleStyles_%(sln)s = [%(styles)s];
+function rules_%(sln)s(feature, value, size, resolution, labelText,
+                       labelFont, labelFill, bufferColor, bufferWidth,
+                       placement) {
+                return tableStyle(ruleStyles_%(sln)s[value], feature, size,
+                                  resolution, labelText, labelFont,
+                                  labelFill, bufferColor, bufferWidth,
+                                  placement);
+};""" % {"sln": sln, "styles": ",\n".join(styles)}
+    style = """
+var style = rules_%s(feature, value, size, resolution, labelText,
+                     labelFont, labelFill, bufferColor,
+                     bufferWidth, placement)""" % sln
+    value = 'var value = feature.get("%s");' % RULE_ATTRIBUTE
+    return (style, pattern, setPattern, value, defs, useAnyMapUnits)
+
+
 def getValue(layer, renderer):
     classAttr = handleHiddenField(layer, renderer.classAttribute())
     value = ('var value = feature.get("%s");' % classAttr)
@@ -408,7 +500,7 @@ def getStyle(style, cluster, labelRes, labelText, sln, size,
 
 
 def getSymbolAsStyle(symbol, stylesFolder, layer_transparency, renderer, sln,
-                     layer, feedback):
+                     layer, feedback, labels=True, dataDefined=None):
     styles = {}
     useMapUnits = False
     if layer_transparency == 0:
@@ -421,13 +513,22 @@ def getSymbolAsStyle(symbol, stylesFolder, layer_transparency, renderer, sln,
         pattern = ""
         setPattern = ""
         if isinstance(sl, QgsSimpleMarkerSymbolLayer):
-            color = getRGBAColor(props["color"], alpha)
-            borderColor = getRGBAColor(props["outline_color"], alpha)
+            color = dataDefinedJS(dataDefined, sl,
+                                  QgsSymbolLayer.PropertyFillColor,
+                                  getRGBAColor(props["color"], alpha),
+                                  "OpenLayers3", alpha=alpha)
+            borderColor = dataDefinedJS(dataDefined, sl,
+                                        QgsSymbolLayer.PropertyStrokeColor,
+                                        getRGBAColor(props["outline_color"],
+                                                     alpha),
+                                        "OpenLayers3", alpha=alpha)
             borderWidth = props["outline_width"]
             sizeUnits = props["size_unit"]
             size = None
             if sizeUnits != "MapUnit":
-                size = sl.size() * 2
+                size = dataDefinedJS(dataDefined, sl,
+                                     QgsSymbolLayer.PropertySize,
+                                     sl.size() * 2, "OpenLayers3", 2)
             try:
                 shape = sl.shape()
             except Exception:
@@ -494,15 +595,19 @@ def getSymbolAsStyle(symbol, stylesFolder, layer_transparency, renderer, sln,
             except Exception:
                 svgHeight = "5"
 
-            if symbol.dataDefinedAngle().isActive():
+            rot = str(sl.angle() * 0.0174533)
+            if dataDefinedAttribute(dataDefined, sl,
+                                    QgsSymbolLayer.PropertyAngle):
+                rot = dataDefinedJS(dataDefined, sl,
+                                    QgsSymbolLayer.PropertyAngle, rot,
+                                    "OpenLayers3", 0.0174533)
+            elif symbol.dataDefinedAngle().isActive():
+                # not evaluated on export, so only a field can be read
                 if symbol.dataDefinedAngle().useExpression():
                     rot = "0"
                 else:
-                    rot = "feature.get("
-                    rot += symbol.dataDefinedAngle().expressionOrField()
-                    rot += ") * 0.0174533"
-            else:
-                rot = str(sl.angle() * 0.0174533)
+                    rot = "feature.get('%s') * 0.0174533" % (
+                        symbol.dataDefinedAngle().expressionOrField())
             shutil.copy(sl.path(), path)
             style = ("image: %s" %
                      getIcon("styles/" + os.path.basename(sl.path()),
@@ -514,7 +619,10 @@ def getSymbolAsStyle(symbol, stylesFolder, layer_transparency, renderer, sln,
             text: '%s',
             %s})""" % (char, getFillStyle(color, props))
         elif isinstance(sl, QgsSimpleLineSymbolLayer):
-            color = getRGBAColor(props["line_color"], alpha)
+            color = dataDefinedJS(dataDefined, sl,
+                                  QgsSymbolLayer.PropertyStrokeColor,
+                                  getRGBAColor(props["line_color"], alpha),
+                                  "OpenLayers3", alpha=alpha)
             line_width = props["line_width"]
             line_style = props["line_style"]
             line_units = props["line_width_unit"]
@@ -524,9 +632,16 @@ def getSymbolAsStyle(symbol, stylesFolder, layer_transparency, renderer, sln,
             style, useMapUnits = getStrokeStyle(color, line_style, line_width,
                                                 line_units, lineCap, lineJoin)
         elif isinstance(sl, QgsSimpleFillSymbolLayer):
-            fillColor = getRGBAColor(props["color"], alpha)
-
-            borderColor = getRGBAColor(props["outline_color"], alpha)
+            fillColor = dataDefinedJS(dataDefined, sl,
+                                      QgsSymbolLayer.PropertyFillColor,
+                                      getRGBAColor(props["color"], alpha),
+                                      "OpenLayers3", alpha=alpha)
+
+            borderColor = dataDefinedJS(dataDefined, sl,
+                                        QgsSymbolLayer.PropertyStrokeColor,
+                                        getRGBAColor(props["outline_color"],
+                                                     alpha),
+                                        "OpenLayers3", alpha=alpha)
             borderStyle = props["outline_style"]
             borderWidth = props["outline_width"]
             line_units = props["outline_width_unit"]
@@ -587,7 +702,7 @@ def getSymbolAsStyle(symbol, stylesFolder, layer_transparency, renderer, sln,
             style += ","
         ts = ""
         vts = layer.customProperty("VectorTilesReader/vector_tile_url")
-        if vts is None:
+        if vts is None and labels:
             ts = """
         text: createTextStyle(feature, resolution, labelText, labelFont,
                               labelFill, placement, bufferColor,
@@ -26,7 +26,13 @@ from qgis.core import (QgsProject,
 from qgis.PyQt.QtCore import Qt, QObject
 from qgis.PyQt.QtGui import QCursor
 from qgis.PyQt.QtWidgets import QApplication
-from qgis2web.utils import exportLayers, replaceInTemplate
+from qgis2web.utils import (exportLayers, replaceInTemplate,
+                            vectorExportFormat, rasterExportFormat,
+                            vectorTileZooms,
+                            simplifyOptions, compressAssets,
+                            getUsedAttributes, safeName,
+                            rulesEvaluatedOnExport,
+                            dataDefinedExportedAttributes, onMainThread)
 from qgis2web.olFileScripts import (writeFiles,
                                     writeHTMLstart,
                                     writeLayerSearch,
@@ -49,6 +55,9 @@ from qgis2web.olScriptStrings import (measureScript,
                                       getM2px,
                                       getMapUnitLayers)
 from qgis2web.olStyleScripts import exportStyles
+from qgis2web.legendSprite import LegendSprite
+from qgis2web.layerAnalysis import analyseLayer, layerAnalyses
+from qgis2web.exp2js import write_expressions
 from qgis2web.writer import (Writer,
                              WriterResult,
                              translator)
@@ -78,20 +87,25 @@ class OpenLayersWriter(Writer):
 
         feedback.showFeedback('Creating OpenLayers map...')
 
-        self.preview_file = self.writeOL(iface, feedback,
-                                         layers=self.layers,
-                                         groups=self.groups,
-                                         popup=self.popup,
-                                         visible=self.visible,
-                                         interactive=self.interactive,
-                                         json=self.json,
-                                         clustered=self.cluster,
-                                         getFeatureInfo=self.getFeatureInfo,
-                                         settings=self.params,
-                                         folder=dest_folder)
+        with layerAnalyses():
+            self.preview_file, rebuilt = self.writeOL(
+                iface, feedback,
+                layers=self.layers,
+                groups=self.groups,
+                popup=self.popup,
+                visible=self.visible,
+                interactive=self.interactive,
+                json=self.json,
+                clustered=self.cluster,
+                getFeatureInfo=self.getFeatureInfo,
+                settings=self.params,
+                folder=dest_folder)
         result = WriterResult()
         result.index_file = self.preview_file
         result.folder = os.path.dirname(self.preview_file)
+        result.rebuilt_layers = rebuilt
+        if self.params["Data export"]["Pre-compress files"]:
+            compressAssets(result.folder, feedback)
         for dirpath, dirnames, filenames in os.walk(result.folder):
             result.files.extend([os.path.join(dirpath, f) for f in filenames])
         return result
@@ -100,15 +114,39 @@ class OpenLayersWriter(Writer):
     def writeOL(cls, iface, feedback, layers, groups, popup, visible,
                 interactive, json, clustered, getFeatureInfo, settings,
                 folder):
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        if onMainThread():
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        # cancelling raises ExportCancelled from anywhere in the export
+        try:
+            return cls.writeOLFiles(iface, feedback, layers, groups, popup,
+                                    visible, interactive, json, clustered,
+                                    getFeatureInfo, settings, folder)
+        finally:
+            if onMainThread():
+                QApplication.restoreOverrideCursor()
+
+    @classmethod
+    def writeOLFiles(cls, iface, feedback, layers, groups, popup, visible,
+                     interactive, json, clustered, getFeatureInfo, settings,
+                     folder):
         mapSettings = iface.mapCanvas().mapSettings()
         controlCount = 0
         stamp = datetime.now().strftime("%Y_%m_%d-%H_%M_%S_%f")
         folder = os.path.join(folder, 'qgis2web_' + stamp)
+        feedback.setOutputFolder(folder)
         restrictToExtent = settings["Scale/Zoom"]["Restrict to extent"]
         matchCRS = settings["Appearance"]["Match project CRS"]
         precision = settings["Data export"]["Precision"]
         optimize = settings["Data export"]["Minify GeoJSON files"]
+        useCache = settings["Data export"]["Reuse unchanged layers"]
+        vectorFormat = settings["Data export"]["Vector format"]
+        rasterFormat = settings["Data export"]["Raster format"]
+        resampling = settings["Data export"]["Raster resampling"]
+        encoding = settings["Data export"]["Raster encoding"]
+        quality = int(settings["Data export"]["Raster quality"])
+        simplify = settings["Data export"]["Simplify geometries"]
+        usedOnly = settings["Data export"]["Export only used attributes"]
+        evaluateRules = settings["Data export"]["Evaluate rules on export"]
         extent = settings["Scale/Zoom"]["Extent"]
         mapbounds = bounds(iface, extent == "Canvas extent", layers, matchCRS)
         fullextent = bounds(iface, False, layers, matchCRS)
@@ -126,21 +164,56 @@ class OpenLayersWriter(Writer):
         widgetAccent = settings["Appearance"]["Widget Icon"]
         widgetBackground = settings["Appearance"]["Widget Background"]
 
+        tileZooms = vectorTileZooms(minZoom, maxZoom)
+        simplify = simplifyOptions(simplify, maxZoom)
+        formats = [vectorExportFormat(layer, vectorFormat, encode2json,
+                                      iface.mapCanvas(), restrictToExtent,
+                                      extent) or
+                   rasterExportFormat(layer, rasterFormat)
+                   for layer, encode2json in zip(layers, json)]
+        evaluatedRules = [rulesEvaluatedOnExport(layer, layerFormat,
+                                                 evaluateRules)
+                          for layer, layerFormat in zip(layers, formats)]
+        dataDefined = [dataDefinedExportedAttributes(layer, layerFormat)
+                       for layer, layerFormat in zip(layers, formats)]
+        usedAttributes = None
+        if usedOnly:
+            usedAttributes = []
+            for count, layer in enumerate(layers):
+                sln = safeName(layer.name()) + "_" + str(count)
+                if layer.type() == layer.VectorLayer:
+                    usedAttributes.append(getUsedAttributes(
+                        layer, sln, popup[count], interactive[count],
+                        settings, evaluatedRules[count]))
+                else:
+                    usedAttributes.append(None)
+
         writeFiles(folder, restrictToExtent, feedback)
-        exportLayers(iface, layers, folder, precision, optimize,
-                     popup, json, restrictToExtent, extent, feedback, matchCRS)
-        mapUnitsLayers = exportStyles(layers, folder, clustered, feedback)
+        rebuilt = exportLayers(iface, layers, folder, precision, optimize,
+                               popup, json, restrictToExtent, extent,
+                               feedback, matchCRS, useCache, formats,
+                               tileZooms, simplify, usedAttributes,
+                               (minZoom, maxZoom), resampling, encoding,
+                               quality, evaluateRules, dataDefined)
+        mapUnitsLayers = exportStyles(layers, folder, clustered, feedback,
+                                      evaluatedRules, dataDefined)
         mapUnitLayers = getMapUnitLayers(mapUnitsLayers)
+        legend = LegendSprite("styles/legend/sprite.png")
         osmb = writeLayersAndGroups(layers, groups, visible, interactive,
                                     folder, popup, settings, json, matchCRS,
                                     clustered, getFeatureInfo, iface,
                                     restrictToExtent, extent, mapbounds,
-                                    mapSettings.destinationCrs().authid())
+                                    mapSettings.destinationCrs().authid(),
+                                    formats, tileZooms, legend)
+        legend.write(os.path.join(folder, "styles", "legend"))
+        useExpressions = write_expressions(
+            os.path.join(folder, "resources", "qgis2web_expressions.js"))
         (jsAddress,
          cssAddress, controlCount) = writeHTMLstart(settings, controlCount,
                                                     osmb, feedback)
         (geojsonVars, wfsVars, styleVars) = writeScriptIncludes(layers,
-                                                                json, matchCRS)
+                                                                json, matchCRS,
+                                                                formats)
         popupLayers = "popupLayers = [%s];" % ",".join(
             ['1' for field in popup])
         project = QgsProject.instance()
@@ -178,7 +251,7 @@ class OpenLayersWriter(Writer):
         ol3qgis2webjs = getJS(osmb)
         ol3layers = getLayers()
         mapSize = iface.mapCanvas().size()
-        exp_js = getExpJS()
+        exp_js = getExpJS() if useExpressions else ""
         grid = getGrid(project)
         values = {"@PAGETITLE@": pageTitle,
                   "@CSSADDRESS@": cssAddress,
@@ -245,8 +318,7 @@ class OpenLayersWriter(Writer):
                   "w") as f:
             out = replaceInScript("qgis2web.js", values)
             f.write(out)
-        QApplication.restoreOverrideCursor()
-        return os.path.join(folder, "index.html")
+        return os.path.join(folder, "index.html"), rebuilt
 
 
 def replaceInScript(template, values):
@@ -281,6 +353,10 @@ def bounds(iface, useCanvas, layers, matchCRS):
     else:
         extent = None
         for layer in layers:
+            if layer.type() == layer.VectorLayer:
+                bounds = analyseLayer(layer).extent()
+            else:
+                bounds = layer.extent()
             if not matchCRS:
                 epsg3857 = QgsCoordinateReferenceSystem("EPSG:3857")
                 try:
@@ -290,13 +366,12 @@ def bounds(iface, useCanvas, layers, matchCRS):
                     transform = QgsCoordinateTransform(layer.crs(), epsg3857)
 
                 try:
-                    layerExtent = transform.transformBoundingBox(
-                        layer.extent())
+                    layerExtent = transform.transformBoundingBox(bounds)
                 except QgsCsException:
                     layerExtent = QgsRectangle(-20026376.39, -20048966.10,
                                                20026376.39, 20048966.10)
             else:
-                layerExtent = layer.extent()
+                layerExtent = bounds
             if extent is None:
                 extent = layerExtent
             else:
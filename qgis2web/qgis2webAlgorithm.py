@@ -22,18 +22,13 @@
 """
 
 from collections import OrderedDict
-import traceback
-from qgis.core import (Qgis,
-                       QgsProcessing,
+from qgis.core import (QgsProcessing,
                        QgsProject,
-                       QgsMapLayer,
                        QgsProcessingParameterVectorLayer,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterString,
-                       QgsProcessingParameterBoolean,
-                       QgsMessageLog,
-                       QgsWkbTypes)
+                       QgsProcessingParameterBoolean)
 from qgis.utils import iface
 
 from qgis.core import QgsProcessingAlgorithm
@@ -43,6 +38,7 @@ from .exporter import (EXPORTER_REGISTRY)
 from .olwriter import (OpenLayersWriter)
 from .leafletWriter import (LeafletWriter)
 from .configparams import getDefaultParams
+from .headless import exportedLayers, projectInterface
 
 defaultParams = getDefaultParams()
 
@@ -98,60 +94,16 @@ class exportProject(qgis2webAlgorithm):
 
         writer = WRITER_REGISTRY.createWriterFromProject()
         (writer.layers, writer.groups, writer.popup,
-         writer.visible, writer.json,
-         writer.cluster) = self.getLayersAndGroups()
+         writer.visible, writer.interactive, writer.json,
+         writer.cluster,
+         writer.getFeatureInfo) = exportedLayers(QgsProject.instance())
         exporter = EXPORTER_REGISTRY.createFromProject()
         write_folder = exporter.exportDirectory()
-        writer.write(iface, write_folder)
+        writer.write(iface or projectInterface(QgsProject.instance(),
+                                               writer.layers),
+                     write_folder)
         return {}
 
-    def getLayersAndGroups(self):
-        root_node = QgsProject.instance().layerTreeRoot()
-        tree_layers = root_node.findLayers()
-        layers = []
-        popup = []
-
-        for tree_layer in tree_layers:
-            layer = tree_layer.layer()
-            if (layer.type() != QgsMapLayer.PluginLayer and
-                    (layer.type() != QgsMapLayer.VectorLayer or
-                     layer.wkbType() != QgsWkbTypes.NoGeometry) and
-                    root_node.findLayer(layer.id()).isVisible()):
-                try:
-                    # if layer.type() == QgsMapLayer.VectorLayer:
-                    #    testDump = layer.renderer().dump()
-                    layers.append(layer)
-                    layerPopups = []
-                    if layer.type() == QgsMapLayer.VectorLayer:
-                        for field in layer.fields():
-                            fieldList = []
-                            k = field.name()
-                            cProp = "qgis2web/popup/" + field.name()
-                            v = layer.customProperty(cProp, "")
-                            fieldList.append(k.strip())
-                            fieldList.append(v.strip())
-                            layerPopups.append(tuple(fieldList))
-                    popup.append(OrderedDict(layerPopups))
-                except Exception:
-                    QgsMessageLog.logMessage(traceback.format_exc(),
-                                             "qgis2web",
-                                             level=Qgis.Critical)
-
-        visible = []
-        json = []
-        cluster = []
-        for layer in layers:
-            visible.append(layer.customProperty("qgis2web/Visible", True))
-            json.append(layer.customProperty("qgis2web/Encode to JSON", True))
-            cluster.append(layer.customProperty("qgis2web/Cluster", 0) == 2)
-
-        return (layers[::-1],
-                {},
-                popup[::-1],
-                visible[::-1],
-                json[::-1],
-                cluster[::-1])
-
 
 class exportLayer(qgis2webAlgorithm):
     """This is an example algorithm that takes a vector layer and
@@ -409,7 +361,9 @@ class exportVector(exportLayer):
         writer.getFeatureInfo = [False]
         exporter = EXPORTER_REGISTRY.createFromProject()
         write_folder = exporter.exportDirectory()
-        writer.write(iface, write_folder)
+        writer.write(iface or projectInterface(QgsProject.instance(),
+                                               writer.layers),
+                     write_folder)
 
         return {}
 
@@ -522,7 +476,9 @@ class exportRaster(exportLayer):
         writer.cluster = [False]
         exporter = EXPORTER_REGISTRY.createFromProject()
         write_folder = exporter.exportDirectory()
-        writer.write(iface, write_folder)
+        writer.write(iface or projectInterface(QgsProject.instance(),
+                                               writer.layers),
+                     write_folder)
 
         return {}
 
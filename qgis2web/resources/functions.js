@@ -33,6 +33,52 @@ var createTextStyle = function(feature, resolution, labelText, labelFont,
     return textStyle;
 };
 
+// Returns the styles for one entry of a layer's style table: either an
+// array of styles shared by every feature using it, or a function building
+// one for styles which depend on the feature. A label is set on a copy of
+// the last style, and only when the feature has one, so the shared styles
+// are never changed
+function tableStyle(entry, feature, size, resolution, labelText, labelFont,
+                    labelFill, bufferColor, bufferWidth, placement) {
+    if (!entry) {
+        return entry;
+    }
+    var styles = typeof entry === "function" ?
+        entry(feature, size, resolution) : entry;
+    var text = createTextStyle(feature, resolution, labelText, labelFont,
+                               labelFill, placement, bufferColor, bufferWidth);
+    if (!text) {
+        return styles;
+    }
+    if (!styles.length) {
+        return [new ol.style.Style({text: text})];
+    }
+    styles = styles.slice();
+    var last = styles[styles.length - 1].clone();
+    last.setText(text);
+    styles[styles.length - 1] = last;
+    return styles;
+}
+
+// Returns the index of the range holding value in breaks, a list of
+// [lower, upper] bounds sorted by upper bound, or -1 if no range holds it
+function rangeIndex(breaks, value) {
+    var low = 0;
+    var high = breaks.length;
+    while (low < high) {
+        var middle = (low + high) >> 1;
+        if (breaks[middle][1] < value) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    if (low < breaks.length && breaks[low][0] <= value) {
+        return low;
+    }
+    return -1;
+}
+
 function stripe(stripeWidth, gapWidth, angle, color) {
     var canvas = document.createElement('canvas');
     var context = canvas.getContext('2d');
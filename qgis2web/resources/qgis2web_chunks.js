@@ -0,0 +1,62 @@
+// Loads the layers written by qgis2web as chunked GeoJSON a piece at a
+// time. Every chunk is a script calling qgis2webChunkLoaded, so chunks
+// load from file:// as well as from a web server, and each one is only
+// requested once. Loaded features are also added to the layer's own
+// FeatureCollection, for the code which reads it directly.
+var qgis2webChunks = {};
+
+function qgis2webLoadChunks(name, extent, callback) {
+    var layer = window[name];
+    var state = qgis2webChunks[name];
+    if (!state) {
+        state = qgis2webChunks[name] = {requested: {}, callback: callback};
+    }
+    var bboxes = layer.chunks.bboxes;
+    for (var i = 0; i < bboxes.length; i++) {
+        var bbox = bboxes[i];
+        var id = bbox[0];
+        if (state.requested[id] || bbox[1] > extent[2] ||
+                bbox[3] < extent[0] || bbox[2] > extent[3] ||
+                bbox[4] < extent[1]) {
+            continue;
+        }
+        state.requested[id] = true;
+        var script = document.createElement("script");
+        script.src = layer.chunks.url + id + ".js";
+        script.onerror = (function(id) {
+            // try again next time the chunk comes into view
+            return function() {
+                delete state.requested[id];
+            };
+        })(id);
+        document.head.appendChild(script);
+    }
+}
+
+function qgis2webChunkLoaded(name, id, features) {
+    var layer = window[name];
+    for (var i = 0; i < features.length; i++) {
+        layer.features.push(features[i]);
+    }
+    qgis2webChunks[name].callback({
+        type: "FeatureCollection",
+        features: features
+    });
+}
+
+// The extent of everything in a chunked layer, as [xmin, ymin, xmax, ymax],
+// or null if it has no chunks
+function qgis2webChunksExtent(name) {
+    var bboxes = window[name].chunks.bboxes;
+    if (!bboxes.length) {
+        return null;
+    }
+    var extent = bboxes[0].slice(1);
+    for (var i = 1; i < bboxes.length; i++) {
+        extent[0] = Math.min(extent[0], bboxes[i][1]);
+        extent[1] = Math.min(extent[1], bboxes[i][2]);
+        extent[2] = Math.max(extent[2], bboxes[i][3]);
+        extent[3] = Math.max(extent[3], bboxes[i][4]);
+    }
+    return extent;
+}
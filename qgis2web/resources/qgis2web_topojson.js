@@ -0,0 +1,78 @@
+// Turns the TopoJSON written by qgis2web back into a GeoJSON
+// FeatureCollection. Anything that is not a topology is returned as is.
+function topojsonToGeoJSON(topology) {
+    if (!topology || topology.type !== "Topology") {
+        return topology;
+    }
+    var scale = topology.transform.scale;
+    var translate = topology.transform.translate;
+    var arcs = [];
+    for (var a = 0; a < topology.arcs.length; a++) {
+        var arc = topology.arcs[a];
+        var x = 0, y = 0;
+        var points = [];
+        for (var p = 0; p < arc.length; p++) {
+            x += arc[p][0];
+            y += arc[p][1];
+            points.push([x * scale[0] + translate[0],
+                         y * scale[1] + translate[1]]);
+        }
+        arcs.push(points);
+    }
+
+    function line(ids) {
+        var points = [];
+        for (var i = 0; i < ids.length; i++) {
+            var id = ids[i];
+            var arc = id < 0 ? arcs[~id].slice().reverse() : arcs[id];
+            // consecutive arcs share their end and start points
+            for (var p = i ? 1 : 0; p < arc.length; p++) {
+                points.push(arc[p]);
+            }
+        }
+        return points;
+    }
+
+    function lines(arcs) {
+        var result = [];
+        for (var i = 0; i < arcs.length; i++) {
+            result.push(line(arcs[i]));
+        }
+        return result;
+    }
+
+    function geometry(object) {
+        var coordinates;
+        switch (object.type) {
+            case "LineString":
+                coordinates = line(object.arcs);
+                break;
+            case "MultiLineString":
+            case "Polygon":
+                coordinates = lines(object.arcs);
+                break;
+            case "MultiPolygon":
+                coordinates = [];
+                for (var i = 0; i < object.arcs.length; i++) {
+                    coordinates.push(lines(object.arcs[i]));
+                }
+                break;
+            default:
+                return null;
+        }
+        return {type: object.type, coordinates: coordinates};
+    }
+
+    var features = [];
+    for (var name in topology.objects) {
+        var geometries = topology.objects[name].geometries;
+        for (var g = 0; g < geometries.length; g++) {
+            features.push({
+                type: "Feature",
+                properties: geometries[g].properties || {},
+                geometry: geometry(geometries[g])
+            });
+        }
+    }
+    return {type: "FeatureCollection", features: features};
+}
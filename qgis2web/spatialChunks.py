@@ -0,0 +1,91 @@
+import math
+import os
+
+# Features per chunk the grid is sized for, and the largest grid used
+CHUNK_FEATURES = 1000
+MAX_GRID = 32
+# Records are appended to their chunk file once this many characters are
+# buffered, so memory use stays bounded however large the layer is
+FLUSH_SIZE = 1024 * 1024
+
+
+def gridSize(featureCount):
+    """Returns the number of rows and columns of the chunk grid"""
+    if featureCount <= CHUNK_FEATURES:
+        return 1
+    return min(MAX_GRID, int(math.ceil(math.sqrt(featureCount /
+                                                 CHUNK_FEATURES))))
+
+
+class ChunkWriter(object):
+    """
+    Splits features over a regular grid laid across the layer extent and
+    writes each cell to its own script. A feature goes to the cell holding
+    the centre of its bounding box, and the index records the bounding box
+    of everything in each cell, so a map only loads the cells it shows
+    """
+
+    def __init__(self, folder, varName, extent, grid, recordSeparator):
+        self.folder = folder
+        self.varName = varName
+        # (xmin, ymin, xmax, ymax) of the layer
+        self.extent = extent
+        self.grid = grid
+        self.recordSeparator = recordSeparator
+        self.buffers = {}
+        self.buffered = {}
+        self.bboxes = {}
+        self.started = set()
+
+    def addFeature(self, record, bbox):
+        """Adds a serialized feature whose geometry covers bbox"""
+        xmin, ymin, xmax, ymax = self.extent
+        column = self._cell((bbox[0] + bbox[2]) / 2, xmin, xmax)
+        row = self._cell((bbox[1] + bbox[3]) / 2, ymin, ymax)
+        chunk = row * self.grid + column
+        if chunk in self.bboxes:
+            known = self.bboxes[chunk]
+            self.bboxes[chunk] = [min(known[0], bbox[0]),
+                                  min(known[1], bbox[1]),
+                                  max(known[2], bbox[2]),
+                                  max(known[3], bbox[3])]
+        else:
+            self.bboxes[chunk] = list(bbox)
+            self.buffers[chunk] = []
+            self.buffered[chunk] = 0
+        self.buffers[chunk].append(record)
+        self.buffered[chunk] += len(record)
+        if self.buffered[chunk] > FLUSH_SIZE:
+            self._flush(chunk)
+
+    def close(self):
+        """
+        Writes out whatever is still buffered and returns the index: one
+        [chunk, xmin, ymin, xmax, ymax] entry per chunk file
+        """
+        for chunk in self.bboxes:
+            self._flush(chunk, "]);\n")
+        return [[chunk] + self.bboxes[chunk]
+                for chunk in sorted(self.bboxes)]
+
+    def _cell(self, value, minimum, maximum):
+        if maximum <= minimum:
+            return 0
+        cell = int((value - minimum) / (maximum - minimum) * self.grid)
+        return max(0, min(self.grid - 1, cell))
+
+    def _flush(self, chunk, footer=""):
+        records = self.buffers[chunk]
+        if chunk in self.started:
+            mode = "a"
+            text = self.recordSeparator if records else ""
+        else:
+            mode = "w"
+            text = 'qgis2webChunkLoaded("%s", %d, [' % (self.varName, chunk)
+            self.started.add(chunk)
+        text += self.recordSeparator.join(records) + footer
+        with open(os.path.join(self.folder, "%d.js" % chunk), mode,
+                  encoding="utf8") as f:
+            f.write(text)
+        self.buffers[chunk] = []
+        self.buffered[chunk] = 0
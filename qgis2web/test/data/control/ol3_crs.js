@@ -14,7 +14,7 @@ var lyr_airports_0 = new ol.layer.Vector({
                 source:jsonSource_airports_0, 
                 style: style_airports_0,
                 interactive: true,
-                title: '<img src="styles/legend/airports_0.png" /> airports'
+                title: '<span style="display: inline-block; width: 16px; height: 16px; background: url(styles/legend/sprite.png) 0px 0px"></span> airports'
             });
 
 lyr_airports_0.setVisible(true);
@@ -65,7 +65,17 @@ class qgis2web_classDialogTest(unittest.TestCase):
     def defaultParams(self):
         return {'Data export': {'Minify GeoJSON files': True,
                                 'Exporter': 'Export to folder',
-                                'Precision': 'maintain'},
+                                'Export only used attributes': False,
+                                'Evaluate rules on export': False,
+                                'Pre-compress files': False,
+                                'Precision': 'maintain',
+                                'Raster encoding': 'PNG',
+                                'Raster format': 'Single image',
+                                'Raster quality': '85',
+                                'Raster resampling': 'Cubic',
+                                'Reuse unchanged layers': False,
+                                'Simplify geometries': 'None',
+                                'Vector format': 'GeoJSON'},
                 'Scale/Zoom': {'Min zoom level': '1',
                                'Restrict to extent': False,
                                'Extent': 'Fit to layers extent',
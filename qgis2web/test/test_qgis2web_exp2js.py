@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+
+# This import is to enable SIP API V2
+# noinspection PyUnresolvedReferences
+import qgis  # pylint: disable=unused-import
+
+from qgis.core import QgsExpression
+from qgis2web.exp2js import (compile, compile_to_file, handle_condition,
+                             write_expressions)
+from qgis2web.utils import tempFolder
+from qgis.testing import unittest, start_app
+
+print("test_qgis2web_exp2js")
+start_app()
+
+
+class qgis2web_exp2jsTest(unittest.TestCase):
+
+    """Test compiling QGIS expressions to JS"""
+
+    def test01_CaseWithElse(self):
+        """Test a CASE compiles to nested conditional expressions"""
+        exp = QgsExpression("""CASE WHEN "COLA" = 1 THEN 'one'
+                                    WHEN "COLA" = 2 THEN 'two'
+                                    ELSE 'many' END""")
+        self.assertEqual(
+            handle_condition(exp.rootNode(), "Leaflet"),
+            "((feature.properties['COLA']  == 1) ? 'one' : "
+            "((feature.properties['COLA']  == 2) ? 'two' : 'many'))")
+
+    def test02_CaseWithoutElse(self):
+        """Test a CASE without ELSE gives null when nothing matches"""
+        exp = QgsExpression("""CASE WHEN "COLA" = 1 THEN 'one'
+                                    WHEN "COLA" = 2 THEN 'two' END""")
+        self.assertEqual(
+            handle_condition(exp.rootNode(), "OpenLayers3"),
+            "((feature.get('COLA')  == 1) ? 'one' : "
+            "((feature.get('COLA')  == 2) ? 'two' : null))")
+        functionjs, name, _ = compile(exp.expression(), "case", "Leaflet")
+        self.assertNotIn("function(", functionjs)
+
+    def test03_CompiledOnce(self):
+        """Test an expression used by two rules is compiled once"""
+        filename = os.path.join(tempFolder(), "qgis2web_expressions.js")
+        exp = '"COLA" = 1'
+        first = compile_to_file(exp, "airports_0rule0", "Leaflet", filename)
+        second = compile_to_file(exp, "airports_1rule0", "Leaflet", filename)
+        self.assertEqual(first, second)
+        # the same expression for another library is compiled again
+        self.assertNotEqual(
+            compile_to_file(exp, "airports_2rule0", "OpenLayers3",
+                            filename), first)
+        self.assertTrue(write_expressions(filename))
+        with open(filename) as f:
+            expressions = f.read()
+        self.assertEqual(expressions.count("function %s(" % first), 1)
+        self.assertEqual(expressions.count("_eval_expression("), 2)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(qgis2web_exp2jsTest))
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
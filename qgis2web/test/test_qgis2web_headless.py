@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+
+# This import is to enable SIP API V2
+# noinspection PyUnresolvedReferences
+import qgis  # pylint: disable=unused-import
+
+from qgis.core import QgsProject, QgsRectangle
+from qgis2web.headless import (exportedLayers, exportProject,
+                               projectInterface)
+from qgis2web.utils import tempFolder
+from qgis2web.test.utilities import get_test_data_path, load_layer
+from qgis.testing import unittest, start_app
+
+print("test_qgis2web_headless")
+start_app()
+
+
+class qgis2web_headlessTest(unittest.TestCase):
+
+    """Test exporting without a QGIS interface"""
+
+    def setUp(self):
+        """Runs before each test"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        self.layer = load_layer(layer_path)
+        QgsProject.instance().addMapLayer(self.layer)
+
+    def tearDown(self):
+        """Runs after each test"""
+        QgsProject.instance().clear()
+
+    def test01_ExportedLayers(self):
+        """Test reading the exported layers from the project"""
+        (layers, groups, popup, visible, interactive, json, cluster,
+         getFeatureInfo) = exportedLayers(QgsProject.instance())
+        self.assertEqual(layers, [self.layer])
+        self.assertEqual(groups, {})
+        self.assertEqual(list(popup[0].keys()),
+                         [field.name() for field in self.layer.fields()])
+        self.assertEqual(popup[0]['NAME'], 'no label')
+        self.assertEqual(visible, [True])
+        self.assertEqual(interactive, [True])
+        self.assertEqual(cluster, [False])
+        self.assertEqual(getFeatureInfo, [False])
+
+    def test02_ProjectInterface(self):
+        """Test the canvas stand-in views the spec's extent"""
+        iface = projectInterface(QgsProject.instance(), [self.layer],
+                                 {"extent": [0, 0, 100, 100],
+                                  "size": [200, 200]})
+        canvas = iface.mapCanvas()
+        self.assertEqual(canvas.extent(), QgsRectangle(0, 0, 100, 100))
+        self.assertEqual(canvas.size().width(), 200)
+        self.assertEqual(canvas.mapSettings().destinationCrs(),
+                         QgsProject.instance().crs())
+
+    def test03_ExportProject(self):
+        """Test exporting the project without an interface"""
+        folder = tempFolder()
+        result = exportProject(QgsProject.instance(),
+                               {"format": "leaflet", "output": folder,
+                                "params": {"Data export": {
+                                    "Minify GeoJSON files": False}}})
+        self.assertTrue(os.path.exists(result.index_file))
+        self.assertTrue(result.index_file.startswith(folder))
+
+    def test04_UnknownParameter(self):
+        """Test an unknown spec parameter is refused"""
+        with self.assertRaises(ValueError):
+            exportProject(QgsProject.instance(),
+                          {"params": {"Appearance": {"Nonsense": True}}})
+
+    def test05_ExportedGroups(self):
+        """Test layers in a layer tree group are exported as that group"""
+        root = QgsProject.instance().layerTreeRoot()
+        group = root.addGroup("airports")
+        group.addLayer(self.layer)
+        root.removeLayer(self.layer)
+        (layers, groups, popup, visible, interactive, json, cluster,
+         getFeatureInfo) = exportedLayers(QgsProject.instance())
+        self.assertEqual(layers, [self.layer])
+        self.assertEqual(groups, {"airports": [self.layer]})
+        self.assertEqual(popup, [{}])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(qgis2web_headlessTest))
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
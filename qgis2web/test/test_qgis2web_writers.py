@@ -14,15 +14,26 @@ __copyright__ = 'Copyright 2015, Riccardo Klinger / Geolicious'
 
 import os
 import difflib
+import json
+import gzip
 from collections import OrderedDict
 
 # This import is to enable SIP API V2
 # noinspection PyUnresolvedReferences
 import qgis  # pylint: disable=unused-import
-from qgis.core import QgsProject, QgsCoordinateReferenceSystem
+from qgis.core import (QgsProject, QgsCoordinateReferenceSystem,
+                       QgsSymbolLayer, QgsProperty, QgsSymbol,
+                       QgsRuleBasedRenderer)
+from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtWidgets import QApplication, QListWidgetItem
 from qgis2web.olwriter import OpenLayersWriter
 from qgis2web.leafletWriter import LeafletWriter
-from qgis2web.utils import tempFolder
+from qgis2web.utils import (tempFolder, mvt_enabled, returnFilterValues,
+                            ExportJob, runExportJobs, ruleMatcher,
+                            rulesShareSymbolLayers)
+from qgis2web.layerAnalysis import analyseLayer, layerAnalyses
+from qgis2web.feedbackDialog import Feedback, ExportCancelled
+from qgis2web.exportTask import ExportTask
 
 from osgeo import gdal
 from qgis2web.test.utilities import get_test_data_path, load_layer
@@ -61,7 +72,17 @@ class qgis2web_WriterTest(unittest.TestCase):
     def defaultParams(self):
         return {'Data export': {'Minify GeoJSON files': True,
                                 'Exporter': 'Export to folder',
-                                'Precision': 'maintain'},
+                                'Export only used attributes': False,
+                                'Evaluate rules on export': False,
+                                'Pre-compress files': False,
+                                'Precision': 'maintain',
+                                'Raster encoding': 'PNG',
+                                'Raster format': 'Single image',
+                                'Raster quality': '85',
+                                'Raster resampling': 'Cubic',
+                                'Reuse unchanged layers': False,
+                                'Simplify geometries': 'None',
+                                'Vector format': 'GeoJSON'},
                 'Scale/Zoom': {'Min zoom level': '1',
                                'Restrict to extent': False,
                                'Extent': 'Fit to layers extent',
@@ -1173,7 +1194,7 @@ class qgis2web_WriterTest(unittest.TestCase):
         assert 'new ol.control.LayerSwitcher' in test_qgis2web_output
 
         test_layers_output = read_output(result, 'layers/layers.js')
-        assert """title: '<img src="styles/legend/airports_0.png" /> airports'""" in test_layers_output
+        assert """title: '<span style="display: inline-block; width: 16px; height: 16px; background: url(styles/legend/sprite.png) 0px 0px"></span> airports'""" in test_layers_output
 
     def test40_Leaflet_scalebar(self):
         """Leaflet scale bar"""
@@ -3369,6 +3390,777 @@ class qgis2web_WriterTest(unittest.TestCase):
         self.assertEqual(
             test_output, control_output, diff(control_output, test_output))
 
+    def test103_OL3_reuse_unchanged_layers(self):
+        """OL3 reuse unchanged layers"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Reuse unchanged layers'] = True
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        first = writer.write(self.iface, tempFolder())
+        second = writer.write(self.iface, tempFolder())
+        self.assertEqual(second.rebuilt_layers, [])
+        self.assertEqual(read_output(second.index_file, 'layers/airports_0.js'),
+                         read_output(first.index_file, 'layers/airports_0.js'))
+
+        # a change of export settings rebuilds the layer
+        writer.params['Data export']['Precision'] = '3'
+        third = writer.write(self.iface, tempFolder())
+        self.assertEqual(third.rebuilt_layers, ['airports'])
+
+    @unittest.skipIf(not mvt_enabled, 'Test requires QgsVectorTileWriter')
+    def test104_OL3_vector_tiles(self):
+        """OL3 vector tiles"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Vector format'] = 'Vector tiles'
+        writer.params['Scale/Zoom']['Max zoom level'] = '4'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        tiles = [f for f in result.files if f.endswith('.pbf')]
+        self.assertTrue(tiles)
+        self.assertFalse(os.path.exists(
+            os.path.join(result.folder, 'layers', 'airports_0.js')))
+        self.assertIn("./layers/airports_0/{z}/{x}/{y}.pbf",
+                      read_output(result.index_file, 'layers/layers.js'))
+
+    def test105_OL3_simplify_geometries(self):
+        """OL3 simplify geometries"""
+        layer_path = get_test_data_path('layer', 'lakes.shp')
+        style_path = get_test_data_path('style', 'lakes_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'name', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        full = writer.write(self.iface, tempFolder())
+        writer.params['Data export']['Simplify geometries'] = 'Douglas-Peucker'
+        writer.params['Scale/Zoom']['Max zoom level'] = '5'
+        simplified = writer.write(self.iface, tempFolder())
+        self.assertLess(
+            len(read_output(simplified.index_file, 'layers/lakes_0.js')),
+            len(read_output(full.index_file, 'layers/lakes_0.js')))
+
+    def test106_OL3_topojson(self):
+        """OL3 TopoJSON"""
+        layer_path = get_test_data_path('layer', 'lakes.shp')
+        style_path = get_test_data_path('style', 'lakes_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Vector format'] = 'TopoJSON'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'name', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        self.assertIn('"type":"Topology"',
+                      read_output(result.index_file, 'layers/lakes_0.js'))
+        self.assertIn("json_lakes_0 = topojsonToGeoJSON(json_lakes_0);",
+                      read_output(result.index_file, 'layers/layers.js'))
+        self.assertIn('resources/qgis2web_topojson.js',
+                      read_output(result.index_file, 'index.html'))
+
+    def test107_Leaflet_compact_binary(self):
+        """Leaflet compact binary"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Vector format'] = 'Compact binary'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        self.assertIn('"type":"CompactFeatureCollection"',
+                      read_output(result.index_file, 'data/airports_0.js'))
+        index = read_output(result.index_file, 'index.html')
+        self.assertIn('js/qgis2web_compact.js', index)
+        self.assertIn('json_airports_0 = compactToGeoJSON(json_airports_0);',
+                      index)
+
+    def test108_OL3_precompressed_files(self):
+        """OL3 pre-compressed files"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Pre-compress files'] = True
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        layer_file = os.path.join(result.folder, 'layers', 'airports_0.js')
+        self.assertIn(layer_file + '.gz', result.files)
+        self.assertIn(os.path.join(result.folder, 'resources', 'ol.js.gz'),
+                      result.files)
+        with gzip.open(layer_file + '.gz', 'rb') as f:
+            with open(layer_file, 'rb') as original:
+                self.assertEqual(f.read(), original.read())
+
+    def test109_OL3_used_attributes(self):
+        """OL3 export only used attributes"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Export only used attributes'] = True
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict([(u'NAME', u'no label')])]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        test_output = read_output(result.index_file, 'layers/airports_0.js')
+        self.assertIn('"NAME":"NOATAK"', test_output)
+        self.assertNotIn('"USE"', test_output)
+        self.assertNotIn('"ELEV"', test_output)
+
+    def test110_OL3_chunked_geojson(self):
+        """OL3 chunked GeoJSON"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Vector format'] = 'Chunked GeoJSON'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])
+        ]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        index_output = read_output(result.index_file, 'layers/airports_0.js')
+        self.assertIn('"chunks":{"url":"layers/airports_0/"', index_output)
+        self.assertTrue(os.path.exists(os.path.join(
+            result.folder, 'layers', 'airports_0', '0.js')))
+        layers_output = read_output(result.index_file, 'layers/layers.js')
+        self.assertIn('ol.loadingstrategy.bbox', layers_output)
+        # features without a geometry are loaded from the index
+        self.assertIn('format_airports_0.readFeatures(json_airports_0,',
+                      layers_output)
+        self.assertIn('resources/qgis2web_chunks.js',
+                      read_output(result.index_file, 'index.html'))
+
+    def test111_OL3_raster_tiles(self):
+        """OL3 raster tiles"""
+        layer_path = get_test_data_path('layer', 'test.png')
+        layer = load_layer(layer_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Raster format'] = 'PNG tiles'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        test_output = read_output(result.index_file, 'layers/layers.js')
+        self.assertIn('new ol.source.XYZ', test_output)
+        self.assertIn("url: './layers/test_0/{z}/{x}/{y}.png'", test_output)
+        self.assertTrue(os.path.isdir(os.path.join(
+            result.folder, 'layers', 'test_0')))
+        self.assertFalse(os.path.exists(os.path.join(
+            result.folder, 'layers', 'test_0.png')))
+
+    def test112_OL3_raster_encoding(self):
+        """OL3 raster layer image format override"""
+        layer_path = get_test_data_path('layer', 'test.png')
+        layer = load_layer(layer_path)
+        layer.setCustomProperty("qgis2web/Image format", "JPEG")
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        test_output = read_output(result.index_file, 'layers/layers.js')
+        self.assertIn('url: "./layers/test_0.jpg"', test_output)
+        self.assertTrue(os.path.exists(os.path.join(
+            result.folder, 'layers', 'test_0.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(
+            result.folder, 'layers', 'test_0.png')))
+
+    def test113_OL3_legend_sprite(self):
+        """OL3 legend icons in one sprite sheet"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_categorized.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+        renderer = layer.renderer()
+        for count in range(len(renderer.categories())):
+            renderer.updateCategorySymbol(
+                count, renderer.categories()[0].symbol().clone())
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Appearance']['Add layers list'] = 'Collapsed'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        test_output = read_output(result.index_file, 'layers/layers.js')
+        self.assertIn('url(styles/legend/sprite.png)', test_output)
+        self.assertNotIn('<img src="styles/legend/', test_output)
+        legendFolder = os.path.join(result.folder, 'styles', 'legend')
+        self.assertEqual(sorted(os.listdir(legendFolder)),
+                         ['sprite.json', 'sprite.png'])
+        with open(os.path.join(legendFolder, 'sprite.json')) as f:
+            cells = json.load(f)
+        # every category draws the same icon, so it is packed once
+        self.assertEqual(len(cells), 1)
+        self.assertEqual(
+            test_output.count('url(styles/legend/sprite.png) 0px 0px'),
+            len(renderer.categories()))
+
+    def test114_OL3_categorized_shared_styles(self):
+        """OL3 categories with the same symbol share one style"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_categorized.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+        renderer = layer.renderer()
+        for count in range(len(renderer.categories())):
+            renderer.updateCategorySymbol(
+                count, renderer.categories()[0].symbol().clone())
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder()).index_file
+        test_output = read_output(result, 'styles/airports_0_style.js')
+        self.assertEqual(test_output.count('new ol.style.Style('), 1)
+        self.assertIn('var categoryIndex_airports_0 = {"Civilian/Public": 0',
+                      test_output)
+        self.assertNotIn('switch(', test_output)
+
+    def test115_Leaflet_graduated_unsorted_ranges(self):
+        """Leaflet graduated ranges are written sorted for binary search"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_graduated.qml')
+        control_path = get_test_data_path(
+            'control', 'leaflet_json_point_graduated.html')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+        layer.renderer().sortByValue(Qt.DescendingOrder)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        control_file = open(control_path, 'r')
+        control_output = control_file.read()
+        control_file.close()
+
+        # Export to web map
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])]
+        writer.json = [False]
+
+        result = writer.write(self.iface, tempFolder()).index_file
+        test_file = open(result)
+        test_output = test_file.read()
+        test_file.close()
+        self.assertEqual(
+            test_output, control_output, diff(control_output, test_output))
+
+    def test116_OL3_rulebased_evaluated_on_export(self):
+        """OL3 rule-based with rules evaluated on export"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_rule-based.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Evaluate rules on export'] = True
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder()).index_file
+        test_style = read_output(result, 'styles/airports_0_style.js')
+        self.assertIn('var ruleStyles_airports_0 = [', test_style)
+        self.assertIn('var value = feature.get("q2wRule");', test_style)
+        self.assertNotIn('_eval_expression', test_style)
+        expressions = result.replace('file://', '').replace(
+            'index.html', 'resources/qgis2web_expressions.js')
+        self.assertFalse(os.path.exists(expressions))
+        test_data = read_output(result, 'layers/airports_0.js')
+        self.assertIn('"q2wRule":', test_data)
+
+    def test117_Leaflet_rulebased_expressions_used_helpers(self):
+        """Leaflet expressions file only holds the helpers rules call"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_rule-based.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+
+        result = writer.write(self.iface, tempFolder()).index_file
+        expressions = read_output(result, 'js/qgis2web_expressions.js')
+        self.assertIn('_eval_expression(context) {', expressions)
+        self.assertNotIn('function fnc_', expressions)
+
+    def test118_OL3_data_defined_size_evaluated_on_export(self):
+        """OL3 data-defined symbol size evaluated on export"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+        symbolLayer = layer.renderer().symbol().symbolLayer(0)
+        symbolLayer.setDataDefinedProperty(
+            QgsSymbolLayer.PropertySize,
+            QgsProperty.fromExpression('"ELEV" / 1000'))
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder()).index_file
+        test_style = read_output(result, 'styles/airports_0_style.js')
+        self.assertIn("feature.get('q2wSize0') * 2", test_style)
+        # a size evaluated to 0 is kept
+        self.assertIn("feature.get('q2wSize0') != null ?", test_style)
+        test_data = read_output(result, 'layers/airports_0.js')
+        self.assertIn('"q2wSize0":', test_data)
+
+    def test119_layer_analysis_shared_by_export(self):
+        """Layer analysis is shared within an export and read in one pass"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        layer = load_layer(layer_path)
+
+        with layerAnalyses():
+            analysis = analyseLayer(layer)
+            self.assertIs(analysis, analyseLayer(layer))
+            self.assertFalse(analysis.scanned)
+            extent = analysis.extent()
+            self.assertFalse(analysis.shadows())
+            self.assertTrue(analysis.scanned)
+            self.assertEqual(analysis.featureCount(), layer.featureCount())
+            # the same before and after the scan
+            self.assertEqual(analysis.extent(), extent)
+            self.assertFalse(analysis.is25d())
+        self.assertIsNot(analysis, analyseLayer(layer))
+
+    def test120_filter_values_from_aggregates(self):
+        """Attribute filter values come from the provider's aggregates"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        layer = load_layer(layer_path)
+        index = layer.fields().indexFromName('ELEV')
+
+        uses = returnFilterValues([layer], 'USE', 'str')
+        self.assertEqual(uses['values'],
+                         ['Civilian/Public', 'Joint Military/Civilian',
+                          'Military', 'Other'])
+        elev = returnFilterValues([layer], 'ELEV', 'real')
+        self.assertEqual(elev['values'], [layer.minimumValue(index),
+                                          layer.maximumValue(index)])
+        self.assertIsNone(returnFilterValues([layer], 'USE', 'int'))
+
+    def test121_Leaflet_export_cancelled(self):
+        """Cancelled exports stop and a cancelled task leaves no output"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        layer = load_layer(layer_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+
+        class CancelledFeedback(Feedback):
+            def cancelled(self):
+                return True
+
+        folder = tempFolder()
+        with self.assertRaises(ExportCancelled):
+            writer.write(self.iface, folder, CancelledFeedback())
+        # the wait cursor is gone again
+        self.assertIsNone(QApplication.overrideCursor())
+        olWriter = OpenLayersWriter()
+        olWriter.params = writer.params
+        olWriter.groups = {}
+        olWriter.layers = [layer]
+        olWriter.visible = [True]
+        olWriter.interactive = [True]
+        olWriter.cluster = [False]
+        olWriter.popup = [OrderedDict()]
+        olWriter.json = [False]
+        olWriter.getFeatureInfo = [False]
+        with self.assertRaises(ExportCancelled):
+            olWriter.write(self.iface, folder, CancelledFeedback())
+        self.assertIsNone(QApplication.overrideCursor())
+
+        task = ExportTask(writer, self.iface, folder)
+        # another export writing into the same folder meanwhile
+        other = os.path.join(folder, 'qgis2web_other')
+        os.makedirs(other)
+        before = set(os.listdir(folder))
+        task.cancel()
+        self.assertFalse(task.run())
+        self.assertIsNone(task.results)
+        self.assertEqual(set(os.listdir(folder)), before)
+        self.assertTrue(os.path.isdir(other))
+
+    def test122_OL3_raster_export(self):
+        """OL3 raster warped to a single image with transparent nodata"""
+        layer_path = get_test_data_path('layer', 'test.png')
+        layer = load_layer(layer_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = OpenLayersWriter()
+        writer.params = self.defaultParams()
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+        writer.getFeatureInfo = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        test_output = read_output(result.index_file, 'layers/layers.js')
+        self.assertIn('url: "./layers/test_0.png"', test_output)
+        raster = gdal.Open(os.path.join(result.folder, 'layers',
+                                        'test_0.png'))
+        self.assertIsNotNone(raster)
+        self.assertGreater(raster.RasterXSize, 0)
+        self.assertGreater(raster.RasterYSize, 0)
+        self.assertEqual(raster.GetRasterBand(1).GetNoDataValue(), 0)
+        # nothing is left behind in memory
+        self.assertFalse(gdal.ReadDir('/vsimem/qgis2web'))
+
+    def test123_Leaflet_raster_tiles_match_crs(self):
+        """Leaflet raster tiles fall back to one image in the project CRS"""
+        layer_path = get_test_data_path('layer', 'test.png')
+        layer = load_layer(layer_path)
+
+        QgsProject.instance().addMapLayer(layer)
+        crs = QgsCoordinateReferenceSystem("EPSG:27700")
+        self.iface.mapCanvas().setDestinationCrs(crs)
+
+        # Export to web map
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.params['Appearance']['Match project CRS'] = True
+        writer.params['Data export']['Raster format'] = 'PNG tiles'
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        self.assertTrue(os.path.exists(os.path.join(
+            result.folder, 'data', 'test_0.png')))
+        self.assertFalse(os.path.exists(os.path.join(
+            result.folder, 'data', 'test_0')))
+        self.assertIn('L.imageOverlay', read_output(result.index_file,
+                                                    'index.html'))
+
+    def test124_Leaflet_chunked_geojson_attribute_filter(self):
+        """Leaflet attribute filter on chunked GeoJSON"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        style_path = get_test_data_path('style', 'airports_single.qml')
+        layer = load_layer(layer_path)
+        layer.loadNamedStyle(style_path)
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Vector format'] = 'Chunked GeoJSON'
+        writer.params['Appearance']['Attribute filter'] = [
+            QListWidgetItem('USE: str')]
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict(
+            [(u'ID', u'no label'), (u'fk_region', u'no label'), (u'ELEV', u'no label'),
+             (u'NAME', u'no label'), (u'USE', u'no label')])
+        ]
+        writer.json = [False]
+
+        result = writer.write(self.iface, tempFolder())
+        index_output = read_output(result.index_file, 'index.html')
+        self.assertIn("qgis2webLoadChunks('json_airports_0',", index_output)
+        # every loaded chunk is indexed and filtered
+        self.assertIn("""layer_airports_0.addData(geojson);
+                if (typeof filterFunc === 'function') {
+                    filterFunc();
+                }""", index_output)
+        self.assertIn(
+            'for (var i = index.sublayers.length; i < features.length; i++)',
+            index_output)
+
+    def test125_failed_export_job(self):
+        """A layer which fails to export fails the export"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        layer = load_layer(layer_path)
+
+        def fail():
+            raise IOError("No space left on device")
+
+        jobs = [ExportJob(layer, 'airports_%d' % count, count, lambda: None)
+                for count in range(3)]
+        jobs.append(ExportJob(layer, 'airports_failed', 1, fail))
+        with self.assertRaises(IOError):
+            runExportJobs(jobs, Feedback())
+
+    def test126_rules_evaluated_like_generated_chain(self):
+        """Rules evaluated on export draw what the generated rules would"""
+        layer_path = get_test_data_path('layer', 'airports.shp')
+        layer = load_layer(layer_path)
+        symbol = QgsSymbol.defaultSymbol(layer.geometryType())
+        root = QgsRuleBasedRenderer.Rule(None)
+        root.appendChild(QgsRuleBasedRenderer.Rule(
+            symbol.clone(), filterExp='"USE" = \'Military\''))
+        root.appendChild(QgsRuleBasedRenderer.Rule(symbol.clone(),
+                                                   elseRule=True))
+        root.appendChild(QgsRuleBasedRenderer.Rule(symbol.clone(),
+                                                   elseRule=True))
+        layer.setRenderer(QgsRuleBasedRenderer(root))
+
+        # the generated if/else chains draw with the last else rule
+        match, attributes = ruleMatcher(layer)
+        for feature in layer.getFeatures():
+            self.assertEqual(match(feature),
+                             0 if feature['USE'] == 'Military' else 2)
+        self.assertTrue(rulesShareSymbolLayers(layer))
+
+        # Leaflet can't draw each symbol layer with its own rule from one
+        # rule index, so it keeps the generated rules
+        twoLayers = symbol.clone()
+        twoLayers.appendSymbolLayer(symbol.symbolLayer(0).clone())
+        layer.renderer().rootRule().children()[0].setSymbol(twoLayers)
+        self.assertFalse(rulesShareSymbolLayers(layer))
+
+        QgsProject.instance().addMapLayer(layer)
+
+        # Export to web map
+        writer = LeafletWriter()
+        writer.params = self.defaultParams()
+        writer.params['Data export']['Evaluate rules on export'] = True
+        writer.groups = {}
+        writer.layers = [layer]
+        writer.visible = [True]
+        writer.interactive = [True]
+        writer.cluster = [False]
+        writer.popup = [OrderedDict()]
+        writer.json = [False]
+
+        result = writer.write(self.iface, tempFolder()).index_file
+        index = read_output(result, 'index.html')
+        self.assertNotIn('ruleStyles_airports_0', index)
+        self.assertIn('function style_airports_0_1(feature) {', index)
+        self.assertNotIn('"q2wRule":',
+                         read_output(result, 'data/airports_0.js'))
+
+
 def read_output(url, path):
     """ Given a url for the index.html file of a preview or export and the
     relative path to an output file open the file and return it's contents as a
@@ -0,0 +1,164 @@
+import math
+
+
+class Topology(object):
+    """
+    Builds a TopoJSON topology: coordinates are quantized to a grid, lines
+    shared between geometries are stored once as arcs, and arc coordinates
+    are delta-encoded
+    """
+
+    def __init__(self, step, origin=(0, 0)):
+        self.step = step
+        self.origin = (math.floor(origin[0] / step) * step,
+                       math.floor(origin[1] / step) * step)
+        # each line or ring is stored once as (coordinates, isRing), and
+        # geometries reference them by index until the arcs are known
+        self.lines = []
+        self.geometries = []
+
+    def addGeometry(self, geomType, parts, properties):
+        """
+        Adds a LineString, MultiLineString, Polygon or MultiPolygon given
+        as nested lists of (x, y) tuples, or a null geometry if geomType
+        is None
+        """
+        if geomType == "LineString":
+            lines = self._addLine(parts, False)
+        elif geomType == "MultiLineString":
+            lines = [line for line in (self._addLine(part, False)
+                                       for part in parts)
+                     if line is not None]
+        elif geomType == "Polygon":
+            lines = self._addPolygon(parts)
+        elif geomType == "MultiPolygon":
+            lines = [polygon for polygon in (self._addPolygon(part)
+                                             for part in parts) if polygon]
+        else:
+            lines = None
+        if lines is None or lines == []:
+            geomType = None
+        self.geometries.append((geomType, lines, properties))
+
+    def _addPolygon(self, rings):
+        exterior = self._addLine(rings[0], True) if rings else None
+        if exterior is None:
+            return None
+        return [exterior] + [ring for ring in (self._addLine(r, True)
+                                               for r in rings[1:])
+                             if ring is not None]
+
+    def _addLine(self, points, isRing):
+        ox, oy = self.origin
+        coords = []
+        for x, y in points:
+            point = (int(round((x - ox) / self.step)),
+                     int(round((y - oy) / self.step)))
+            if not coords or coords[-1] != point:
+                coords.append(point)
+        if isRing:
+            if coords and coords[0] != coords[-1]:
+                coords.append(coords[0])
+            if len(coords) < 4:
+                return None
+        elif len(coords) < 2:
+            return None
+        self.lines.append((coords, isRing))
+        return len(self.lines) - 1
+
+    def _junctions(self):
+        # A point is a junction where lines meet or part ways: it is seen
+        # again with different neighbours, or it ends a line
+        neighbours = {}
+        junctions = set()
+
+        def visit(point, previous, following):
+            known = neighbours.get(point)
+            if known is None:
+                neighbours[point] = (previous, following)
+            elif (known != (previous, following) and
+                    known != (following, previous)):
+                junctions.add(point)
+
+        for coords, isRing in self.lines:
+            if isRing:
+                points = coords[:-1]
+                count = len(points)
+                for i, point in enumerate(points):
+                    visit(point, points[i - 1], points[(i + 1) % count])
+            else:
+                junctions.add(coords[0])
+                junctions.add(coords[-1])
+                for i in range(1, len(coords) - 1):
+                    visit(coords[i], coords[i - 1], coords[i + 1])
+        return junctions
+
+    def encode(self, name):
+        """Returns the topology as a dict ready to be serialized"""
+        junctions = self._junctions()
+        arcs = []
+        arcIndex = {}
+
+        def arcId(coords):
+            key = tuple(coords)
+            if key in arcIndex:
+                return arcIndex[key]
+            if key[::-1] in arcIndex:
+                return ~arcIndex[key[::-1]]
+            arcIndex[key] = len(arcs)
+            arcs.append(coords)
+            return arcIndex[key]
+
+        def cut(coords):
+            ids = []
+            start = 0
+            for i in range(1, len(coords) - 1):
+                if coords[i] in junctions:
+                    ids.append(arcId(coords[start:i + 1]))
+                    start = i
+            ids.append(arcId(coords[start:]))
+            return ids
+
+        lineArcs = []
+        for coords, isRing in self.lines:
+            if isRing:
+                points = coords[:-1]
+                starts = [i for i, p in enumerate(points) if p in junctions]
+                if starts:
+                    start = starts[0]
+                else:
+                    # rings without junctions start at their lowest point,
+                    # so the same ring is always encoded the same way
+                    start = points.index(min(points))
+                coords = points[start:] + points[:start] + [points[start]]
+            lineArcs.append(cut(coords))
+
+        def resolve(lines, depth):
+            if depth == 0:
+                return lineArcs[lines]
+            return [resolve(line, depth - 1) for line in lines]
+
+        depths = {"LineString": 0, "MultiLineString": 1, "Polygon": 1,
+                  "MultiPolygon": 2}
+        geometries = []
+        for geomType, lines, properties in self.geometries:
+            if geomType is None:
+                geometries.append({"type": None, "properties": properties})
+            else:
+                geometries.append({"type": geomType,
+                                   "arcs": resolve(lines, depths[geomType]),
+                                   "properties": properties})
+
+        encodedArcs = []
+        for arc in arcs:
+            encoded = [list(arc[0])]
+            for (x0, y0), (x1, y1) in zip(arc, arc[1:]):
+                encoded.append([x1 - x0, y1 - y0])
+            encodedArcs.append(encoded)
+
+        return {"type": "Topology",
+                "transform": {"scale": [self.step, self.step],
+                              "translate": list(self.origin)},
+                "objects": {name: {"type": "GeometryCollection",
+                                   "geometries": geometries}},
+                "arcs": encodedArcs}
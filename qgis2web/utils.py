@@ -18,16 +18,25 @@
 import os
 import time
 import re
+import json
+import math
 import shutil
-import sys
-from io import StringIO
-from qgis.PyQt.QtCore import QDir, QVariant
-from qgis.PyQt.QtGui import QPainter
+import tempfile
+import gzip
+from collections import Counter
+from io import BytesIO
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from qgis.PyQt.QtCore import (Qt, QDir, QUrl, QVariant, QDate, QTime,
+                              QDateTime, QThread, QCoreApplication, QSize)
+from qgis.PyQt.QtGui import QPainter, QImage, QImageWriter, QColor, qRgba
 from qgis.core import (QgsApplication,
                        QgsProject,
                        QgsCoordinateReferenceSystem,
                        QgsCoordinateTransform,
                        QgsVectorLayer,
+                       QgsVectorFileWriter,
+                       QgsRectangle,
                        QgsField,
                        QgsFeature,
                        QgsFeatureRequest,
@@ -38,17 +47,39 @@ from qgis.core import (QgsApplication,
                        QgsCategorizedSymbolRenderer,
                        QgsGraduatedSymbolRenderer,
                        QgsRuleBasedRenderer,
-                       QgsNullSymbolRenderer,
-                       QgsVectorFileWriter,
+                       QgsHeatmapRenderer,
+                       QgsDataSourceUri,
                        QgsRasterFileWriter,
                        QgsRasterPipe,
+                       QgsRasterLayer,
+                       QgsMapSettings,
+                       QgsMapRendererCustomPainterJob,
                        QgsMessageLog,
                        QgsWkbTypes,
-                       Qgs25DRenderer,
-                       QgsGeometryGeneratorSymbolLayer)
+                       QgsSymbolLayer,
+                       QgsProperty,
+                       QgsMapToPixelSimplifier)
 from qgis.utils import Qgis
-import processing
-import tempfile
+try:
+    from qgis.core import QgsVectorTileWriter
+    mvt_enabled = True
+except ImportError:
+    mvt_enabled = False
+try:
+    import brotli
+    brotli_enabled = True
+except ImportError:
+    brotli_enabled = False
+from qgis2web.topoJSON import Topology
+from qgis2web.compactGeometry import GeometryEncoder
+from qgis2web.spatialChunks import ChunkWriter, gridSize
+from qgis2web.layerAnalysis import analyseLayer, quick25d, featureSource
+from qgis2web.feedbackDialog import (CANCEL_CHECK_INTERVAL, ExportCancelled,
+                                     running, cancellable, checkCancelled)
+from qgis2web.exportCache import (layerFingerprint,
+                                  restoreFromCache,
+                                  storeInCache)
+from osgeo import gdal
 
 NO_POPUP = 0
 ALL_ATTRIBUTES = 1
@@ -127,6 +158,72 @@ BLEND_MODES = {
 
 PLACEMENT = ['bottomleft', 'topleft', 'topright', 'bottomleft', 'bottomright']
 
+GEOJSON = "GeoJSON"
+VECTOR_TILES = "Vector tiles"
+TOPOJSON = "TopoJSON"
+COMPACT = "Compact binary"
+CHUNKED = "Chunked GeoJSON"
+# Deeper vector tiles are overzoomed by the clients
+VECTOR_TILE_MAX_ZOOM = 16
+
+SINGLE_IMAGE = "Single image"
+# Tiled raster formats, with their file extension and Qt image format
+RASTER_TILE_FORMATS = {"PNG tiles": ("png", "PNG"),
+                       "JPEG tiles": ("jpg", "JPG"),
+                       "WebP tiles": ("webp", "WEBP")}
+RASTER_TILE_SIZE = 256
+# Export jobs are sized in features written. A raster job renders about
+# this many pixels in the time a vector job writes a feature
+PIXELS_PER_FEATURE = 256
+# Rows of tiles are grouped into jobs of about this many tiles, so the
+# deepest zoom level is spread over every worker
+RASTER_TILES_PER_JOB = 256
+# Half the width of the EPSG:3857 world, and its resolution at zoom 0
+WEB_MERCATOR_EXTENT = 20037508.342789244
+WEB_MERCATOR_RESOLUTION = 156543.03392804097
+# GDAL kernels behind the "Raster resampling" choices
+RESAMPLING_METHODS = {"Cubic": "cubic", "Bilinear": "bilinear",
+                      "Lanczos": "lanczos", "Average": "average",
+                      "Nearest neighbour": "near"}
+# Single-image raster encodings, with their file extension and GDAL driver
+AUTOMATIC = "Automatic"
+RASTER_ENCODINGS = {"PNG": ("png", "PNG"), "Palette PNG": ("png", "PNG"),
+                    "JPEG": ("jpg", "JPEG"), "WebP": ("webp", "WEBP")}
+# Longest side of the image automatic encoding looks at
+RASTER_SAMPLE_SIZE = 1024
+# Rasters resampled for the max zoom level are rendered at up to this many
+# times its resolution, which the chosen kernel then resamples down
+RASTER_RENDER_OVERSAMPLING = 2
+
+# Used attributes keep their native JSON type; everything else is written
+# as text
+JSON_TYPES = {QVariant.Int: int, QVariant.UInt: int, QVariant.LongLong: int,
+              QVariant.ULongLong: int, QVariant.Double: float,
+              QVariant.Bool: bool}
+# Otherwise fields are typed as exports always have been
+LEGACY_JSON_TYPES = {QVariant.Int: float, QVariant.Double: float}
+
+MEMORY_FIELD_TYPES = {int: "integer", float: "double", bool: "boolean",
+                      str: "string"}
+
+# Holds the index of the rule a feature is drawn with, for rule-based
+# layers whose rules are evaluated on export
+RULE_ATTRIBUTE = "q2wRule"
+
+# The data-defined symbol layer properties evaluated on export, and the
+# name of the attributes holding them. Every distinct expression used for a
+# property gets its own attribute: q2wSize0, q2wSize1...
+DATA_DEFINED_PROPERTIES = ((QgsSymbolLayer.PropertySize, "q2wSize"),
+                           (QgsSymbolLayer.PropertyAngle, "q2wAngle"),
+                           (QgsSymbolLayer.PropertyFillColor, "q2wFill"),
+                           (QgsSymbolLayer.PropertyStrokeColor, "q2wStroke"))
+COLOR_PROPERTIES = (QgsSymbolLayer.PropertyFillColor,
+                    QgsSymbolLayer.PropertyStrokeColor)
+
+COMPRESSIBLE_EXTENSIONS = (".html", ".js", ".css", ".json", ".svg", ".map")
+# Below this the compressed copy doesn't pay for the extra request header
+COMPRESS_MIN_SIZE = 1024
+
 
 def tempFolder():
     tempDir = os.path.join(QDir.tempPath(), 'qgis2web')
@@ -136,6 +233,13 @@ def tempFolder():
     return os.path.abspath(tempDir)
 
 
+def onMainThread():
+    # Whether this is the thread the application runs on, the only one which
+    # may touch the cursor, widgets or application-wide state
+    app = QCoreApplication.instance()
+    return app is None or QThread.currentThread() == app.thread()
+
+
 def getUsedFields(layer):
     fields = []
     try:
@@ -148,47 +252,69 @@ def getUsedFields(layer):
     return fields
 
 
-def writeTmpLayer(layer, restrictToExtent, iface, extent):
-    if layer.wkbType() == QgsWkbTypes.NoGeometry:
-        return
+def getUsedAttributes(layer, sln, popup, interactive, params,
+                      evaluateRules=False):
+    # Everything the web map reads from a feature: popups, the renderer
+    # (class attributes, rule filters and data-defined properties), labels,
+    # the layer search and the attribute filters. Rule filters evaluated on
+    # export are not read by the web map
+    fields = set()
+    if interactive and popup:
+        fields.update(popup.keys())
+    renderContext = QgsRenderContext()
+    renderer = layer.renderer()
+    if evaluateRules and isinstance(renderer, QgsRuleBasedRenderer):
+        for rule in renderer.rootRule().children():
+            if rule.symbol() is not None:
+                fields.update(rule.symbol().usedAttributes(renderContext))
+    elif renderer is not None:
+        fields.update(renderer.usedAttributes(renderContext))
+    labeling = layer.labeling()
+    if labeling is not None and layer.labelsEnabled():
+        for provider in labeling.subProviders():
+            settings = labeling.settings(provider)
+            try:
+                fields.update(settings.referencedFields(renderContext))
+            except AttributeError:
+                fields.add(settings.fieldName)
+    labelField = layer.customProperty("labeling/fieldName")
+    if labelField:
+        fields.add(labelField)
+    layerSearch = params["Appearance"]["Layer search"]
+    if (layerSearch and layerSearch != "None" and
+            params["Appearance"]["Search layer"] == sln):
+        fields.add(layerSearch.split(": ")[-1])
+    for item in params["Appearance"]["Attribute filter"]:
+        fields.add(item.text().split(": ")[0])
+    return fields
+
 
+def getExportFields(layer, usedAttributes=None):
     fields = layer.fields()
-    usedFields = []
-    for count, field in enumerate(fields):
-        fieldIndex = fields.indexFromName(field.name())
-        editorWidget = layer.editorWidgetSetup(fieldIndex).type()
-        addField = False
-        try:
-            if layer.renderer().classAttribute() == field.name():
-                addField = True
-        except Exception:
-            pass
-        if layer.customProperty("labeling/fieldName") == field.name():
-            addField = True
-        if (editorWidget != 'Hidden'):
-            addField = True
-        if addField:
-            usedFields.append(count)
-    uri = TYPE_MAP[layer.wkbType()]
-    crs = layer.crs()
-    if crs.isValid():
-        uri += '?crs=' + crs.authid()
-    for field in usedFields:
-        fieldIndex = layer.fields().indexFromName(
-            layer.fields().field(field).name())
+    try:
+        classAttribute = layer.renderer().classAttribute()
+    except Exception:
+        classAttribute = None
+    labelField = layer.customProperty("labeling/fieldName")
+    jsonTypes = JSON_TYPES if usedAttributes is not None else LEGACY_JSON_TYPES
+    exportFields = []
+    for fieldIndex, field in enumerate(fields):
         editorWidget = layer.editorWidgetSetup(fieldIndex).type()
-        fieldType = layer.fields().field(field).type()
-        fieldName = layer.fields().field(field).name()
+        fieldName = field.name()
+        if (editorWidget == 'Hidden' and fieldName != classAttribute and
+                fieldName != labelField):
+            continue
+        if (usedAttributes is not None and
+                fieldName not in usedAttributes):
+            continue
         if (editorWidget == 'Hidden'):
             fieldName = "q2wHide_" + fieldName
-        if fieldType == QVariant.Double or fieldType == QVariant.Int:
-            fieldType = "double"
-        else:
-            fieldType = "string"
-        uri += '&field=' + fieldName + ":" + fieldType
-    newlayer = QgsVectorLayer(uri, layer.name(), 'memory')
-    writer = newlayer.dataProvider()
-    outFeat = QgsFeature()
+        exportFields.append((fieldIndex, fieldName,
+                             jsonTypes.get(field.type(), str)))
+    return exportFields
+
+
+def getExportRequest(layer, restrictToExtent, iface, extent):
     if restrictToExtent and extent == "Canvas extent":
         canvas = iface.mapCanvas()
         extent = canvas.extent()
@@ -202,77 +328,1092 @@ def writeTmpLayer(layer, restrictToExtent, iface, extent):
         projectedExtent = transform.transformBoundingBox(extent)
         request = QgsFeatureRequest(projectedExtent)
         request.setFlags(QgsFeatureRequest.ExactIntersect)
-        features = layer.getFeatures(request)
     else:
-        features = layer.getFeatures()
-    for feature in features:
-        if feature.geometry() is not None:
-            outFeat.setGeometry(feature.geometry())
-        attrs = [feature[f] for f in usedFields]
-        if attrs:
-            outFeat.setAttributes(attrs)
-        writer.addFeatures([outFeat])
-    return newlayer
+        request = QgsFeatureRequest()
+    return request
+
+
+def rulesEvaluatedOnExport(layer, layerFormat, evaluateRules):
+    # Rule membership can only be written to the data qgis2web exports
+    return (evaluateRules and layerFormat is not None and
+            layer.type() == layer.VectorLayer and
+            isinstance(layer.renderer(), QgsRuleBasedRenderer))
+
+
+def rulesShareSymbolLayers(layer):
+    # Leaflet styles each symbol layer on its own, skipping the rules whose
+    # symbol lacks it, so a feature can be drawn with a different rule for
+    # each of them. One rule index per feature can only stand for all of
+    # them when every rule has the symbol layers of the first
+    rules = layer.renderer().rootRule().children()
+    if not rules or rules[0].symbol() is None:
+        return False
+    slCount = rules[0].symbol().symbolLayerCount()
+    return all(rule.symbol() is not None and
+               rule.symbol().symbolLayerCount() >= slCount
+               for rule in rules)
+
+
+def ruleMatcher(layer):
+    # Prepares the filters of a rule-based layer's top level rules, which
+    # are the ones the web map draws. Returns a function giving the index of
+    # the rule a feature is drawn with (the first whose filter it matches,
+    # else the last else rule, as the generated if/else chains take, else
+    # None) and the fields the filters read, or
+    # None if they need them all. The filters are prepared once, so each
+    # feature only costs their evaluation
+    context = QgsExpressionContext(
+        QgsExpressionContextUtils.globalProjectLayerScopes(layer))
+    fields = layer.fields()
+    filters = []
+    elseIndex = None
+    attributes = set()
+    for index, rule in enumerate(layer.renderer().rootRule().children()):
+        if rule.isElse():
+            elseIndex = index
+            continue
+        expression = None
+        if rule.filterExpression():
+            expression = QgsExpression(rule.filterExpression())
+            expression.prepare(context)
+            for name in expression.referencedColumns():
+                if name == QgsFeatureRequest.ALL_ATTRIBUTES:
+                    attributes = None
+                elif attributes is not None and fields.lookupField(name) >= 0:
+                    attributes.add(fields.lookupField(name))
+        filters.append((index, expression))
+
+    def match(feature):
+        context.setFeature(feature)
+        for index, expression in filters:
+            if expression is None:
+                return index
+            value = expression.evaluate(context)
+            if not isinstance(value, QVariant) and value:
+                return index
+        return elseIndex
+
+    return match, sorted(attributes) if attributes is not None else None
+
+
+def dataDefinedExportedAttributes(layer, layerFormat):
+    # The attributes data-defined symbol properties are evaluated into,
+    # keyed by (property key, expression). They can only be written to the
+    # data qgis2web exports
+    if layerFormat is None or layer.type() != layer.VectorLayer:
+        return {}
+    return dataDefinedAttributes(layer)
+
+
+def dataDefinedAttributes(layer):
+    attributes = {}
+    renderer = layer.renderer()
+    if renderer is None:
+        return attributes
+    counts = Counter()
+    for symbol in renderer.symbols(QgsRenderContext()):
+        for sl in symbol.symbolLayers():
+            properties = sl.dataDefinedProperties()
+            for key, prefix in DATA_DEFINED_PROPERTIES:
+                prop = properties.property(key)
+                if not prop.isActive():
+                    continue
+                definition = (key, prop.asExpression())
+                if definition not in attributes:
+                    attributes[definition] = "%s%d" % (prefix,
+                                                       counts[prefix])
+                    counts[prefix] += 1
+    return attributes
+
+
+def dataDefinedAttribute(attributes, symbolLayer, key):
+    # The attribute a symbol layer's data-defined property was evaluated
+    # into, or None
+    if not attributes:
+        return None
+    prop = symbolLayer.dataDefinedProperties().property(key)
+    if not prop.isActive():
+        return None
+    return attributes.get((key, prop.asExpression()))
+
+
+def dataDefinedJS(attributes, symbolLayer, key, default, mapLib, factor=1,
+                  alpha=1):
+    # The JS reading a symbol layer property from the attribute its
+    # data-defined value was evaluated into, times factor, falling back to
+    # default where it couldn't be evaluated. Colours have their opacity
+    # multiplied by alpha, as static colours do. Without such an attribute
+    # default is returned as is
+    name = dataDefinedAttribute(attributes, symbolLayer, key)
+    if name is None:
+        return default
+    if mapLib == "Leaflet":
+        value = "feature.properties['%s']" % name
+    else:
+        value = "feature.get('%s')" % name
+    scaled = value
+    if factor != 1:
+        scaled = "%s * %s" % (value, factor)
+    if key in COLOR_PROPERTIES and alpha != 1:
+        # the evaluated colours are all written as rgba(r,g,b,a)
+        scaled = ("%s.replace(/[\\d.]+\\)$/, function(a) { "
+                  "return parseFloat(a) * %s + ')'; })" % (value, alpha))
+    return "(%s != null ? %s : %s)" % (value, scaled, default)
+
+
+def dataDefinedEvaluator(layer, attributes):
+    # Prepares the data-defined properties named in attributes. Returns a
+    # function giving a feature's values for them, in the order of the
+    # returned attribute names, and the fields they read, or None if they
+    # need them all. Every property shares one expression context, so each
+    # feature only costs their evaluation. Colours are written as CSS
+    context = QgsExpressionContext(
+        QgsExpressionContextUtils.globalProjectLayerScopes(layer))
+    fields = layer.fields()
+    properties = []
+    referenced = set()
+    for (key, expression), name in sorted(attributes.items(),
+                                          key=lambda item: item[1]):
+        prop = QgsProperty.fromExpression(expression)
+        prop.prepare(context)
+        properties.append((key, prop))
+        for field in prop.referencedFields(context):
+            if field == QgsFeatureRequest.ALL_ATTRIBUTES:
+                referenced = None
+            elif referenced is not None and fields.lookupField(field) >= 0:
+                referenced.add(fields.lookupField(field))
+
+    def evaluate(feature):
+        context.setFeature(feature)
+        values = []
+        for key, prop in properties:
+            if key in COLOR_PROPERTIES:
+                color, ok = prop.valueAsColor(context, QColor())
+                if ok and color.isValid():
+                    values.append("rgba(%d,%d,%d,%s)" % (
+                        color.red(), color.green(), color.blue(),
+                        round(color.alphaF(), 3)))
+                else:
+                    values.append(None)
+            else:
+                value, ok = prop.valueAsDouble(context, 0)
+                values.append(value if ok else None)
+        return values
+
+    names = sorted(attributes.values())
+    return (evaluate, names,
+            sorted(referenced) if referenced is not None else None)
+
+
+def writeTmpLayer(layer, restrictToExtent, iface, extent,
+                  usedAttributes=None, evaluateRules=False, dataDefined=None):
+    if layer.wkbType() == QgsWkbTypes.NoGeometry:
+        return
+    return tmpLayerCopier(layer, restrictToExtent, iface, extent,
+                          usedAttributes, evaluateRules, dataDefined)()
+
+
+def tmpLayerCopier(layer, restrictToExtent, iface, extent,
+                   usedAttributes=None, evaluateRules=False, dataDefined=None):
+    # Everything tied to the layer is read here. The returned function
+    # copies its features with the export fields into a memory layer, or,
+    # given a path, into a FlatGeobuf file, and may run on a worker thread
+    exportFields = getExportFields(layer, usedAttributes)
+    uri = TYPE_MAP[layer.wkbType()]
+    crs = layer.crs()
+    if crs.isValid():
+        uri += '?crs=' + crs.authid()
+    fields = layer.fields()
+    for fieldIndex, fieldName, jsonType in exportFields:
+        if jsonType is int and fields[fieldIndex].type() in (
+                QVariant.LongLong, QVariant.ULongLong):
+            fieldType = "int8"
+        else:
+            fieldType = MEMORY_FIELD_TYPES[jsonType]
+        uri += '&field=' + fieldName + ":" + fieldType
+    if evaluateRules:
+        rules, ruleAttributes = ruleMatcher(layer)
+        uri += '&field=' + RULE_ATTRIBUTE + ":integer"
+    if dataDefined:
+        dataDefinedValues, names, propertyAttributes = dataDefinedEvaluator(
+            layer, dataDefined)
+        colors = set(name for (key, expression), name in dataDefined.items()
+                     if key in COLOR_PROPERTIES)
+        for name in names:
+            fieldType = "string" if name in colors else "double"
+            uri += '&field=' + name + ":" + fieldType
+    name = layer.name()
+    wkbType = layer.wkbType()
+    source = featureSource(layer)
+    request = getExportRequest(layer, restrictToExtent, iface, extent)
+    transformContext = QgsProject.instance().transformContext()
+
+    def copy(path=None):
+        newlayer = QgsVectorLayer(uri, name, 'memory')
+        if path is None:
+            writer = newlayer.dataProvider()
+        else:
+            options = QgsVectorFileWriter.SaveVectorOptions()
+            options.driverName = "FlatGeobuf"
+            writer = QgsVectorFileWriter.create(
+                path, newlayer.fields(), wkbType, crs, transformContext,
+                options)
+            if writer.hasError() != QgsVectorFileWriter.NoError:
+                raise Exception(writer.errorMessage())
+        outFeat = QgsFeature()
+        for count, feature in enumerate(source.getFeatures(request), 1):
+            if count % CANCEL_CHECK_INTERVAL == 0:
+                checkCancelled()
+            if feature.geometry() is not None:
+                outFeat.setGeometry(feature.geometry())
+            attrs = [feature[f[0]] for f in exportFields]
+            if evaluateRules:
+                attrs.append(rules(feature))
+            if dataDefined:
+                attrs.extend(dataDefinedValues(feature))
+            if attrs:
+                outFeat.setAttributes(attrs)
+            writer.addFeatures([outFeat])
+        if path is None:
+            return newlayer
+        # closes the file
+        del writer
+        return QgsVectorLayer(path, name, 'ogr')
+    return copy
+
+
+class ExportJob(object):
+
+    """
+    A single layer export which can be run on a worker thread. Anything
+    which touches the layer itself is done when the job is created or in
+    finish(), which is always called from the thread running the export.
+    Jobs which are not threaded run on that thread too. size estimates the
+    work in features written, see PIXELS_PER_FEATURE
+    """
+
+    def __init__(self, layer, name, size, run, finish=None, outputs=(),
+                 settings=(), threaded=True):
+        self.layer = layer
+        self.name = name
+        self.size = size
+        self.run = run
+        self.finish = finish
+        self.threaded = threaded
+        # files written by run(), and the export settings they depend on
+        self.outputs = outputs
+        self.settings = settings
+        # optional report returned by run(), shown once the job is done
+        self.summary = None
+
+
+def runExportJob(job, cancelled=None):
+    # cancelled is checked by the job as it runs, so must be safe to call
+    # from the thread running it
+    try:
+        with cancellable(cancelled):
+            job.summary = job.run()
+    except ExportCancelled:
+        return False
+    except Exception as e:
+        QgsMessageLog.logMessage(
+            "Could not export {}: {}".format(job.name, e),
+            "qgis2web",
+            level=Qgis.Critical)
+        raise
+    return True
+
+
+def runExportJobs(jobs, feedback, useCache=False):
+    rebuilt = []
+    fingerprints = {}
+    if useCache:
+        pending = []
+        for job in jobs:
+            if feedback.cancelled():
+                raise ExportCancelled()
+            fingerprint = None
+            if job.outputs:
+                fingerprint = layerFingerprint(job.layer, job.settings)
+            if (fingerprint is not None and
+                    restoreFromCache(job.layer, fingerprint, job.outputs)):
+                feedback.showFeedback('Reusing unchanged %s...' %
+                                      job.layer.name())
+                if job.finish is not None:
+                    job.finish()
+                feedback.completeStep()
+            else:
+                fingerprints[job] = fingerprint
+                pending.append(job)
+        jobs = pending
+
+    def completed(job, success):
+        if success:
+            if job.finish is not None:
+                job.finish()
+            if fingerprints.get(job) is not None:
+                storeInCache(job.layer, fingerprints[job], job.outputs)
+            if job.layer.name() not in rebuilt:
+                rebuilt.append(job.layer.name())
+
+    # Largest layers first, so a big layer queued last doesn't leave every
+    # other worker idle while it finishes on its own
+    jobs = sorted(jobs, key=lambda job: job.size, reverse=True)
+    pooled = [job for job in jobs if job.threaded]
+    workers = min(len(pooled), QThread.idealThreadCount())
+    if workers < 2:
+        for job in jobs:
+            if feedback.cancelled():
+                raise ExportCancelled()
+            feedback.showFeedback('%s...' % job.name)
+            success = runExportJob(job, feedback.cancelled)
+            if feedback.cancelled():
+                raise ExportCancelled()
+            completed(job, success)
+            feedback.completeStep()
+            if job.summary:
+                feedback.showFeedback(job.summary)
+        return rebuilt
+
+    # the workers can't ask the feedback themselves, so they are told here
+    stop = threading.Event()
+    count = 0
+    # a job which fails stops the rest, and fails the export once the
+    # workers have finished
+    failures = []
+
+    def report(job, success):
+        nonlocal count
+        completed(job, success)
+        count += 1
+        feedback.showFeedback('%s...' % job.name)
+        feedback.completeStep()
+        if job.summary:
+            feedback.showFeedback(job.summary)
+        feedback.setProgress(int(count * 100 / len(jobs)))
+
+    def checkStop(pending):
+        if not stop.is_set() and (failures or feedback.cancelled()):
+            stop.set()
+            for future in pending:
+                future.cancel()
+        return stop.is_set()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(runExportJob, job, stop.is_set): job
+                   for job in pooled}
+        pending = set(futures)
+        # the rest run here while the workers get on with theirs
+        for job in jobs:
+            if job.threaded:
+                continue
+            if checkStop(pending):
+                break
+            try:
+                success = runExportJob(job, feedback.cancelled)
+            except Exception as e:
+                failures.append(e)
+            if checkStop(pending):
+                break
+            report(job, success)
+        while pending:
+            done, pending = wait(pending, timeout=0.1,
+                                 return_when=FIRST_COMPLETED)
+            if checkStop(pending):
+                continue
+            for future in done:
+                if future.exception() is not None:
+                    failures.append(future.exception())
+                else:
+                    report(futures[future], future.result())
+            QCoreApplication.processEvents()
+    if failures:
+        raise failures[0]
+    if stop.is_set():
+        raise ExportCancelled()
+    return rebuilt
+
+
+def compressFile(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    sidecars = []
+    buffer = BytesIO()
+    # no timestamp, so unchanged files give byte-identical sidecars
+    with gzip.GzipFile(filename="", mode="wb", compresslevel=9,
+                       fileobj=buffer, mtime=0) as gz:
+        gz.write(data)
+    compressed = [(path + ".gz", buffer.getvalue())]
+    if brotli_enabled:
+        compressed.append((path + ".br",
+                           brotli.compress(data, mode=brotli.MODE_TEXT)))
+    for sidecar, content in compressed:
+        if len(content) < len(data):
+            with open(sidecar, "wb") as f:
+                f.write(content)
+            sidecars.append(sidecar)
+    return sidecars
+
+
+def compressAssets(folder, feedback):
+    feedback.showFeedback("Compressing files...")
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if (filename.lower().endswith(COMPRESSIBLE_EXTENSIONS) and
+                    os.path.getsize(path) >= COMPRESS_MIN_SIZE):
+                paths.append(path)
+    sidecars = []
+    # zlib and brotli release the GIL while compressing, so threads keep
+    # every core busy without spawning processes from inside QGIS
+    workers = max(1, min(len(paths), QThread.idealThreadCount()))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(compressFile, path) for path in paths}
+        while pending:
+            done, pending = wait(pending, timeout=0.1,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    sidecars.extend(future.result())
+                except (IOError, OSError) as e:
+                    QgsMessageLog.logMessage(
+                        "Could not compress file: {}".format(e),
+                        "qgis2web", level=Qgis.Critical)
+            QCoreApplication.processEvents()
+    feedback.completeStep()
+    return sidecars
 
 
 def exportLayers(iface, layers, folder, precision, optimize, popupField, json,
-                 restrictToExtent, extent, feedback, matchCRS):
+                 restrictToExtent, extent, feedback, matchCRS,
+                 useCache=False, formats=None, tileZooms=None,
+                 simplify=None, usedAttributes=None, zoomRange=None,
+                 resampling="Cubic", encoding="PNG", quality=85,
+                 evaluateRules=False, dataDefined=None):
     feedback.showFeedback('Exporting layers...')
     layersFolder = os.path.join(folder, "layers")
     QDir().mkpath(layersFolder)
+    jobs = []
     for count, (layer, encode2json, popup) in enumerate(zip(layers, json,
                                                             popupField)):
+        if feedback.cancelled():
+            raise ExportCancelled()
         sln = safeName(layer.name()) + "_" + str(count)
         vts = layer.customProperty("VectorTilesReader/vector_tile_source")
-        if (layer.type() == layer.VectorLayer and vts is None and
+        layerFormat = formats[count] if formats is not None else GEOJSON
+        layerFields = (usedAttributes[count]
+                       if usedAttributes is not None else None)
+        layerRules = rulesEvaluatedOnExport(layer, layerFormat, evaluateRules)
+        layerProperties = (dataDefined[count]
+                           if dataDefined is not None else None)
+        if layerFormat == VECTOR_TILES:
+            jobs.extend(vectorTileExportJobs(layer, sln, layersFolder,
+                                             restrictToExtent, iface, extent,
+                                             tileZooms, layerFields,
+                                             layerRules, layerProperties))
+        elif (layer.type() == layer.VectorLayer and vts is None and
                 (layer.providerType() != "WFS" or encode2json)):
-            feedback.showFeedback('Exporting %s to JSON...' % layer.name())
             crs = QgsCoordinateReferenceSystem("EPSG:4326")
-            exportVector(layer, sln, layersFolder, restrictToExtent,
-                         iface, extent, precision, crs, optimize)
-            feedback.completeStep()
+            jobs.append(vectorExportJob(layer, sln, layersFolder,
+                                        restrictToExtent, iface, extent,
+                                        precision, crs, optimize, simplify,
+                                        layerFormat, layerFields, layerRules,
+                                        layerProperties))
+        elif layerFormat in RASTER_TILE_FORMATS:
+            jobs.extend(rasterTileExportJobs(
+                layer, sln, layersFolder,
+                rasterTileZooms(layer, *zoomRange), layerFormat, quality))
         elif (layer.type() == layer.RasterLayer and
                 layer.providerType() != "wms"):
-            feedback.showFeedback('Exporting %s as raster...' % layer.name())
-            exportRaster(layer, count, layersFolder, feedback, iface, matchCRS)
-            feedback.completeStep()
+            jobs.append(rasterExportJob(layer, count, layersFolder, iface,
+                                        matchCRS,
+                                        zoomRange[1] if zoomRange else None,
+                                        resampling,
+                                        rasterEncoding(layer, encoding),
+                                        quality))
+    rebuilt = runExportJobs(jobs, feedback, useCache)
     feedback.completeStep()
+    return rebuilt
 
 
 def exportVector(layer, sln, layersFolder, restrictToExtent, iface,
-                 extent, precision, crs, minify):
+                 extent, precision, crs, minify, vectorFormat=GEOJSON):
+    job = vectorExportJob(layer, sln, layersFolder, restrictToExtent, iface,
+                          extent, precision, crs, minify,
+                          vectorFormat=vectorFormat)
+    if runExportJob(job):
+        job.finish()
+
+
+def vectorExportJob(layer, sln, layersFolder, restrictToExtent, iface,
+                    extent, precision, crs, minify, simplify=None,
+                    vectorFormat=GEOJSON, usedAttributes=None,
+                    evaluateRules=False, dataDefined=None):
     canvas = iface.mapCanvas()
-    cleanLayer = writeTmpLayer(layer, restrictToExtent, iface, extent)
-    if is25d(layer, canvas, restrictToExtent, extent):
-        add25dAttributes(cleanLayer, layer, canvas)
-    tmpPath = os.path.join(layersFolder, sln + ".json")
     path = os.path.join(layersFolder, sln + ".js")
-    options = []
-    if precision != "maintain":
-        options.append("COORDINATE_PRECISION=" + str(precision))
-    e, err = QgsVectorFileWriter.writeAsVectorFormat(cleanLayer, tmpPath,
-                                                     "utf-8", crs, 'GeoJson',
-                                                     0, layerOptions=options)
-    if e == QgsVectorFileWriter.NoError:
-        with open(path, mode="w", encoding="utf8") as f:
-            f.write("var %s = " % ("json_" + sln))
-            with open(tmpPath, encoding="utf8") as tmpFile:
-                for line in tmpFile:
-                    if minify:
-                        line = line.strip("\n\t ")
-                        line = removeSpaces(line)
-                    f.write(line)
-        os.remove(tmpPath)
-    else:
+    use25d = is25d(layer, canvas, restrictToExtent, extent)
+    simplifier = None
+    if (simplify is not None and
+            layer.geometryType() != QgsWkbTypes.PointGeometry):
+        simplifier = geometrySimplifier(simplify[0], simplify[1], crs)
+    write = geoJSONWriter(layer, "json_" + sln, path, restrictToExtent, iface,
+                          extent, precision, crs, minify, use25d, simplifier,
+                          vectorFormat, usedAttributes, evaluateRules,
+                          dataDefined)
+
+    def finish():
+        fields = layer.fields()
+        for field in fields:
+            exportImages(layer, field.name(), layersFolder + "/tmp.tmp")
+
+    # the chunk files are only known once written, so they aren't cached
+    outputs = [path] if vectorFormat != CHUNKED else []
+    settings = (sln, restrictToExtent, extent, precision, crs.authid(),
+                minify, simplify, vectorFormat,
+                sorted(usedAttributes) if usedAttributes is not None
+                else None, evaluateRules,
+                sorted(dataDefined.items()) if dataDefined else None)
+    if restrictToExtent and extent == "Canvas extent":
+        settings += (canvas.extent().toString(),
+                     canvas.mapSettings().destinationCrs().authid())
+    return ExportJob(layer, 'Exporting %s to JSON' % layer.name(),
+                     analyseLayer(layer).featureCount(), write, finish,
+                     outputs, settings)
+
+
+def vectorTileZooms(minZoom, maxZoom):
+    maxZoom = min(int(maxZoom), VECTOR_TILE_MAX_ZOOM)
+    return (min(int(minZoom), maxZoom), maxZoom)
+
+
+def vectorExportFormat(layer, vectorFormat, encode2json, canvas,
+                       restrictToExtent, extent):
+    # The format a layer's data is actually exported in, or None for
+    # layers which are not exported as vector data
+    if layer.type() != layer.VectorLayer:
+        return None
+    if layer.customProperty("VectorTilesReader/vector_tile_url") is not None:
+        return None
+    if layer.providerType() == "WFS" and not encode2json:
+        return None
+    if vectorFormat == GEOJSON or layer.wkbType() == QgsWkbTypes.NoGeometry:
+        return GEOJSON
+    # decoded as soon as it is loaded, so it works for every kind of layer
+    if vectorFormat == COMPACT:
+        return COMPACT
+    # heatmaps and 2.5D buildings are drawn from the GeoJSON features
+    if (isinstance(layer.renderer(), QgsHeatmapRenderer) or
+            is25d(layer, canvas, restrictToExtent, extent)):
+        return GEOJSON
+    if vectorFormat == VECTOR_TILES and mvt_enabled:
+        return VECTOR_TILES
+    if vectorFormat == CHUNKED:
+        return CHUNKED
+    # points have no shared borders, topology would only add overhead
+    if (vectorFormat == TOPOJSON and
+            layer.geometryType() != QgsWkbTypes.PointGeometry):
+        return TOPOJSON
+    return GEOJSON
+
+
+def vectorTileExportJobs(layer, sln, layersFolder, restrictToExtent, iface,
+                         extent, tileZooms, usedAttributes=None,
+                         evaluateRules=False, dataDefined=None):
+    # The tiles are cut from a copy of the layer with the same fields as the
+    # GeoJSON export, so the style functions work on both. The copy is made
+    # by the job, in a temporary file rather than in memory, and each job
+    # reads its own, so the zoom levels are cut one after another.
+    if layer.wkbType() == QgsWkbTypes.NoGeometry:
+        return []
+    copy = tmpLayerCopier(layer, restrictToExtent, iface, extent,
+                          usedAttributes, evaluateRules, dataDefined)
+    tileFolder = os.path.join(layersFolder, sln)
+    QDir().mkpath(tileFolder)
+    uri = QgsDataSourceUri()
+    uri.setParam("type", "xyz")
+    uri.setParam("url", QUrl.fromLocalFile(tileFolder).toString() +
+                 "/{z}/{x}/{y}.pbf")
+    transformContext = QgsProject.instance().transformContext()
+    minZoom, maxZoom = tileZooms
+
+    def writeTiles(path):
+        tileLayer = QgsVectorTileWriter.Layer(copy(path))
+        tileLayer.setLayerName(sln)
+        checkCancelled()
+        writer = QgsVectorTileWriter()
+        writer.setDestinationUri(uri.encodedUri().data().decode("utf8"))
+        writer.setTransformContext(transformContext)
+        writer.setLayers([tileLayer])
+        writer.setMinZoom(minZoom)
+        writer.setMaxZoom(maxZoom)
+        if not writer.writeTiles():
+            raise Exception(writer.errorMessage())
+
+    def run():
+        checkCancelled()
+        copyFolder = tempfile.mkdtemp(dir=tempFolder())
+        try:
+            writeTiles(os.path.join(copyFolder, sln + ".fgb"))
+        finally:
+            shutil.rmtree(copyFolder, ignore_errors=True)
+
+    def finish():
+        fields = layer.fields()
+        for field in fields:
+            exportImages(layer, field.name(), layersFolder + "/tmp.tmp")
+
+    return [ExportJob(layer, 'Cutting %s tiles' % layer.name(),
+                      layer.featureCount() * (maxZoom - minZoom + 1),
+                      run, finish)]
+
+
+def rasterExportFormat(layer, rasterFormat):
+    # The format a raster layer is exported in, or None for layers which
+    # are not exported as raster data
+    if (layer.type() != layer.RasterLayer or
+            layer.providerType().lower() == "wms"):
+        return None
+    if (rasterFormat in RASTER_TILE_FORMATS and
+            RASTER_TILE_FORMATS[rasterFormat][1].lower().encode() not in
+            [bytes(f) for f in QImageWriter.supportedImageFormats()]):
         QgsMessageLog.logMessage(
-            "Could not write json file {}: {}".format(tmpPath, err),
-            "qgis2web",
-            level=Qgis.Critical)
-        return
+            "%s are not supported by this Qt build, exporting %s as PNG "
+            "tiles" % (rasterFormat, layer.name()), "qgis2web",
+            level=Qgis.Warning)
+        return "PNG tiles"
+    return rasterFormat
 
-    fields = layer.fields()
-    for field in fields:
-        exportImages(layer, field.name(), layersFolder + "/tmp.tmp")
+
+def rasterTileExtent(layer):
+    crsDest = QgsCoordinateReferenceSystem("EPSG:3857")
+    try:
+        xform = QgsCoordinateTransform(layer.crs(), crsDest,
+                                       QgsProject.instance())
+    except Exception:
+        xform = QgsCoordinateTransform(layer.crs(), crsDest)
+    world = QgsRectangle(-WEB_MERCATOR_EXTENT, -WEB_MERCATOR_EXTENT,
+                         WEB_MERCATOR_EXTENT, WEB_MERCATOR_EXTENT)
+    return xform.transformBoundingBox(layer.extent()).intersect(world)
+
+
+def rasterTileZooms(layer, minZoom, maxZoom):
+    # Tiles stop at the zoom level matching the raster's own resolution,
+    # deeper levels just scale up the last tiles in the browser
+    extent = rasterTileExtent(layer)
+    maxZoom = int(maxZoom)
+    if not extent.isEmpty() and layer.width() > 0:
+        resolution = extent.width() / layer.width()
+        nativeZoom = int(math.ceil(math.log(WEB_MERCATOR_RESOLUTION /
+                                            resolution, 2)))
+        maxZoom = max(0, min(maxZoom, nativeZoom))
+    return (min(int(minZoom), maxZoom), maxZoom)
+
+
+def rasterTileRange(extent, zoom):
+    # The columns and rows of the tiles covering extent at zoom
+    tiles = 2 ** zoom
+    size = 2 * WEB_MERCATOR_EXTENT / tiles
+
+    def clamp(tile):
+        return max(0, min(tiles - 1, tile))
+
+    columns = range(
+        clamp(int((extent.xMinimum() + WEB_MERCATOR_EXTENT) // size)),
+        clamp(int((extent.xMaximum() + WEB_MERCATOR_EXTENT) // size)) + 1)
+    rows = range(
+        clamp(int((WEB_MERCATOR_EXTENT - extent.yMaximum()) // size)),
+        clamp(int((WEB_MERCATOR_EXTENT - extent.yMinimum()) // size)) + 1)
+    return columns, rows
+
+
+def rasterTileExportJobs(layer, sln, layersFolder, tileZooms, rasterFormat,
+                         quality=85):
+    # Renders the layer into a z/x/y tile pyramid. Every job renders a band
+    # of rows at one zoom level from its own copy of the layer, so the jobs
+    # share nothing and can run side by side.
+    extension, imageFormat = RASTER_TILE_FORMATS[rasterFormat]
+    # quality only means something to the lossy formats
+    if extension == "png":
+        quality = -1
+    tileFolder = os.path.join(layersFolder, sln)
+    extent = rasterTileExtent(layer)
+    source = layer.source()
+    providerType = layer.providerType()
+    crs = QgsCoordinateReferenceSystem("EPSG:3857")
+    transformContext = QgsProject.instance().transformContext()
+    # JPEG has no transparency, so the edges of the layer are white there
+    if extension == "jpg":
+        background = QColor(255, 255, 255)
+    else:
+        background = QColor(0, 0, 0, 0)
+
+    def tileRenderer(zoom, columns, rows, renderer):
+        def run():
+            tileLayer = QgsRasterLayer(source, sln, providerType)
+            if not tileLayer.isValid():
+                raise Exception("could not open %s" % source)
+            tileLayer.setRenderer(renderer)
+            settings = QgsMapSettings()
+            settings.setLayers([tileLayer])
+            settings.setDestinationCrs(crs)
+            settings.setTransformContext(transformContext)
+            settings.setOutputSize(QSize(RASTER_TILE_SIZE, RASTER_TILE_SIZE))
+            settings.setBackgroundColor(background)
+            size = 2 * WEB_MERCATOR_EXTENT / 2 ** zoom
+            for x in columns:
+                columnFolder = os.path.join(tileFolder, str(zoom), str(x))
+                QDir().mkpath(columnFolder)
+                for y in rows:
+                    checkCancelled()
+                    settings.setExtent(QgsRectangle(
+                        x * size - WEB_MERCATOR_EXTENT,
+                        WEB_MERCATOR_EXTENT - (y + 1) * size,
+                        (x + 1) * size - WEB_MERCATOR_EXTENT,
+                        WEB_MERCATOR_EXTENT - y * size))
+                    image = QImage(RASTER_TILE_SIZE, RASTER_TILE_SIZE,
+                                   QImage.Format_ARGB32_Premultiplied)
+                    image.fill(background)
+                    painter = QPainter(image)
+                    job = QgsMapRendererCustomPainterJob(settings, painter)
+                    job.renderSynchronously()
+                    painter.end()
+                    image.save(os.path.join(columnFolder,
+                                            "%d.%s" % (y, extension)),
+                               imageFormat, quality)
+        return run
+
+    jobs = []
+    minZoom, maxZoom = tileZooms
+    for zoom in range(minZoom, maxZoom + 1):
+        columns, rows = rasterTileRange(extent, zoom)
+        band = max(1, RASTER_TILES_PER_JOB // len(columns))
+        for first in range(rows.start, rows.stop, band):
+            bandRows = range(first, min(first + band, rows.stop))
+            jobs.append(ExportJob(layer, 'Rendering %s tiles for zoom %d' %
+                                  (layer.name(), zoom),
+                                  len(columns) * len(bandRows) *
+                                  RASTER_TILE_SIZE ** 2 // PIXELS_PER_FEATURE,
+                                  tileRenderer(zoom, columns, bandRows,
+                                               layer.renderer().clone())))
+    return jobs
+
+
+def simplifyOptions(method, maxZoom):
+    if method == "None":
+        return None
+    return (method, int(maxZoom))
+
+
+def geometrySimplifier(method, maxZoom, crs):
+    # Anything below half a pixel at the deepest zoom level the map allows
+    # can't be seen, so that is the tolerance
+    tolerance = 0.5 * WEB_MERCATOR_RESOLUTION / 2 ** maxZoom
+    if crs.isGeographic():
+        tolerance /= 111319.49079327357
+    if method == "Douglas-Peucker":
+        def simplifier(geom):
+            return geom.simplify(tolerance)
+    else:
+        if method == "Visvalingam":
+            algorithm = QgsMapToPixelSimplifier.Visvalingam
+        else:
+            # Every vertex snaps to the same grid position whichever
+            # feature it belongs to, so shared borders stay shared
+            algorithm = QgsMapToPixelSimplifier.SnapToGrid
+        mapToPixel = QgsMapToPixelSimplifier(
+            QgsMapToPixelSimplifier.SimplifyGeometry, tolerance, algorithm)
+
+        def simplifier(geom):
+            return mapToPixel.simplify(geom)
+    return simplifier
+
+
+def geoJSONWriter(layer, varName, path, restrictToExtent, iface, extent,
+                  precision, crs, minify, use25d=False, simplifier=None,
+                  vectorFormat=GEOJSON, usedAttributes=None,
+                  evaluateRules=False, dataDefined=None):
+    # Features are serialized one at a time straight into the output file,
+    # so the layer is never copied into memory or written to disk twice.
+    # Everything tied to the layer is captured here; the returned function
+    # only reads from a feature source and is safe to call from a worker.
+    if minify:
+        separators = (",", ":")
+        header = 'var %s = {"type":"FeatureCollection","crs":%s,"features":['
+        record = '{"type":"Feature","properties":%s,"geometry":%s}'
+        recordSeparator = ","
+        footer = "]}"
+        compactHeader = ('var %s = {"type":"CompactFeatureCollection",'
+                         '"transform":%s,"properties":[')
+        compactFooter = '],"geometries":"%s"}'
+        chunkHeader = ('var %s = {"type":"FeatureCollection","crs":%s,'
+                       '"chunks":%s,"features":[')
+    else:
+        separators = (", ", ": ")
+        header = ('var %s = {\n"type": "FeatureCollection",\n"crs": %s,\n'
+                  '"features": [\n')
+        record = '{ "type": "Feature", "properties": %s, "geometry": %s }'
+        recordSeparator = ",\n"
+        footer = "\n]\n}\n"
+        compactHeader = ('var %s = {\n"type": "CompactFeatureCollection",\n'
+                         '"transform": %s,\n"properties": [\n')
+        compactFooter = '\n],\n"geometries": "%s"\n}\n'
+        chunkHeader = ('var %s = {\n"type": "FeatureCollection",\n"crs": %s,'
+                       '\n"chunks": %s,\n"features": [\n')
+    if crs.authid() == "EPSG:4326":
+        crsName = "urn:ogc:def:crs:OGC:1.3:CRS84"
+    else:
+        crsName = "urn:ogc:def:crs:" + crs.authid().replace(":", "::")
+    crsJSON = json.dumps({"type": "name", "properties": {"name": crsName}},
+                         separators=separators)
+    if precision == "maintain":
+        geomPrecision = 17
+    else:
+        geomPrecision = int(precision)
+
+    layerCRS = layer.crs()
+    needsTransform = layerCRS.isValid() and layerCRS != crs
+    if needsTransform:
+        try:
+            transform = QgsCoordinateTransform(layerCRS, crs,
+                                               QgsProject.instance())
+        except Exception:
+            transform = QgsCoordinateTransform(layerCRS, crs)
+
+    exportFields = getExportFields(layer, usedAttributes)
+    request = getExportRequest(layer, restrictToExtent, iface, extent)
+    # the fields read by what is evaluated on export, None for all of them
+    evaluatedAttributes = set()
+    rules = None
+    if evaluateRules:
+        rules, ruleAttributes = ruleMatcher(layer)
+        if ruleAttributes is None:
+            evaluatedAttributes = None
+        else:
+            evaluatedAttributes.update(ruleAttributes)
+    dataDefinedValues = None
+    if dataDefined:
+        (dataDefinedValues, propertyNames,
+         propertyAttributes) = dataDefinedEvaluator(layer, dataDefined)
+        if propertyAttributes is None:
+            evaluatedAttributes = None
+        elif evaluatedAttributes is not None:
+            evaluatedAttributes.update(propertyAttributes)
+    if use25d:
+        fields = layer.fields()
+        renderer = layer.renderer().clone()
+        renderContext = QgsRenderContext.fromMapSettings(
+            iface.mapCanvas().mapSettings())
+        context = QgsExpressionContext()
+        context.appendScope(QgsExpressionContextUtils.layerScope(layer))
+        expression = QgsExpression('eval(@qgis_25d_height)')
+    elif evaluatedAttributes is not None:
+        request.setSubsetOfAttributes(sorted(
+            set(f[0] for f in exportFields) | evaluatedAttributes))
+    topology = vectorFormat == TOPOJSON
+    compact = vectorFormat == COMPACT
+    chunked = vectorFormat == CHUNKED
+    if topology or compact or chunked:
+        layerExtent = analyseLayer(layer).extent()
+        if needsTransform:
+            try:
+                layerExtent = transform.transformBoundingBox(layerExtent)
+            except Exception:
+                layerExtent = QgsRectangle()
+        if not layerExtent.isFinite() or layerExtent.isEmpty():
+            layerExtent = QgsRectangle()
+    if topology or compact:
+        # Quantized to the requested precision, on a grid anchored at the
+        # corner of the layer so the absolute coordinates stay short
+        if precision == "maintain":
+            digits = 7 if crs.isGeographic() else 2
+        else:
+            digits = int(precision)
+        origin = (layerExtent.xMinimum(), layerExtent.yMinimum())
+    if chunked:
+        # The index keeps the layer's own script name, and the chunks are
+        # written to a folder of the same name next to it
+        chunkFolder = os.path.splitext(path)[0]
+        chunkURL = "%s/%s/" % (os.path.basename(os.path.dirname(path)),
+                               os.path.basename(chunkFolder))
+        chunkGrid = gridSize(analyseLayer(layer).featureCount())
+    source = featureSource(layer)
+
+    def write():
+        verticesBefore = 0
+        verticesAfter = 0
+        geomBytes = 0
+        if topology:
+            topo = Topology(10 ** -digits, origin)
+        elif compact:
+            encoder = GeometryEncoder(10 ** -digits, origin)
+        elif chunked:
+            QDir().mkpath(chunkFolder)
+            chunks = ChunkWriter(chunkFolder, varName,
+                                 (layerExtent.xMinimum(),
+                                  layerExtent.yMinimum(),
+                                  layerExtent.xMaximum(),
+                                  layerExtent.yMaximum()),
+                                 chunkGrid, recordSeparator)
+            # features without a geometry can't be placed in a chunk, so
+            # they go in the index and are always loaded
+            unplaced = []
+        if use25d:
+            renderer.startRender(renderContext, fields)
+        try:
+            with open(path, mode="w", encoding="utf8") as f:
+                if compact:
+                    f.write(compactHeader % (varName, json.dumps(
+                        encoder.transform(), separators=separators)))
+                elif not (topology or chunked):
+                    f.write(header % (varName, crsJSON))
+                first = True
+                for count, feature in enumerate(source.getFeatures(request),
+                                                1):
+                    if count % CANCEL_CHECK_INTERVAL == 0:
+                        checkCancelled()
+                    geom = feature.geometry()
+                    if geom is None or geom.isNull():
+                        geomJSON = "null"
+                        geom = None
+                    else:
+                        if needsTransform:
+                            geom.transform(transform)
+                        if simplifier is not None:
+                            vertices = geom.constGet().nCoordinates()
+                            simplified = simplifier(geom)
+                            if simplified.isNull() or simplified.isEmpty():
+                                simplified = geom
+                            verticesBefore += vertices
+                            geom = simplified
+                            verticesAfter += geom.constGet().nCoordinates()
+                        if not (topology or compact):
+                            geomJSON = geom.asJson(geomPrecision)
+                            geomBytes += len(geomJSON)
+                            if minify:
+                                geomJSON = geomJSON.replace(" ", "")
+                    properties = {}
+                    for fieldIndex, fieldName, jsonType in exportFields:
+                        properties[fieldName] = getJSONValue(
+                            feature[fieldIndex], jsonType)
+                    if use25d:
+                        height, wallColor, roofColor = get25dAttributes(
+                            feature, renderer, renderContext, context,
+                            expression)
+                        properties["height"] = getJSONValue(height, float)
+                        properties["wallColor"] = wallColor
+                        properties["roofColor"] = roofColor
+                    if rules is not None:
+                        properties[RULE_ATTRIBUTE] = rules(feature)
+                    if dataDefinedValues is not None:
+                        properties.update(zip(propertyNames,
+                                              dataDefinedValues(feature)))
+                    if topology:
+                        if geom is None:
+                            topo.addGeometry(None, None, properties)
+                        else:
+                            topo.addGeometry(*getGeometryParts(geom),
+                                             properties)
+                        continue
+                    if not (first or chunked):
+                        f.write(recordSeparator)
+                    first = False
+                    propertiesJSON = json.dumps(properties,
+                                                separators=separators,
+                                                ensure_ascii=False)
+                    if compact:
+                        if geom is None:
+                            encoder.addGeometry(None, None)
+                        else:
+                            encoder.addGeometry(*getGeometryParts(geom))
+                        f.write(propertiesJSON)
+                    elif chunked:
+                        if geom is None:
+                            unplaced.append(record % (propertiesJSON,
+                                                      geomJSON))
+                        else:
+                            bbox = geom.boundingBox()
+                            chunks.addFeature(
+                                record % (propertiesJSON, geomJSON),
+                                (bbox.xMinimum(), bbox.yMinimum(),
+                                 bbox.xMaximum(), bbox.yMaximum()))
+                    else:
+                        f.write(record % (propertiesJSON, geomJSON))
+                if topology:
+                    encoded = topo.encode(varName)
+                    geomBytes = len(json.dumps(encoded["arcs"],
+                                               separators=(",", ":")))
+                    f.write("var %s = " % varName)
+                    json.dump(encoded, f, separators=separators,
+                              ensure_ascii=False)
+                elif compact:
+                    geometries = encoder.encode()
+                    geomBytes = len(geometries)
+                    f.write(compactFooter % geometries)
+                elif chunked:
+                    index = {"url": chunkURL, "bboxes": chunks.close()}
+                    f.write(chunkHeader % (varName, crsJSON, json.dumps(
+                        index, separators=separators)))
+                    f.write(recordSeparator.join(unplaced))
+                    f.write(footer)
+                else:
+                    f.write(footer)
+        finally:
+            if use25d:
+                renderer.stopRender(renderContext)
+        if simplifier is not None and verticesBefore:
+            removed = verticesBefore - verticesAfter
+            # estimated from the average size of a vertex in the output
+            saved = removed * geomBytes / max(verticesAfter, 1)
+            return ("Simplified %s: %d of %d vertices removed (%d%%), "
+                    "about %d KB smaller" % (layer.name(), removed,
+                                             verticesBefore,
+                                             100 * removed / verticesBefore,
+                                             saved / 1024))
+
+    return write
+
+
+def getGeometryParts(geom):
+    if QgsWkbTypes.isCurvedType(geom.wkbType()):
+        geom.convertToStraightSegment()
+
+    def points(line):
+        return [(point.x(), point.y()) for point in line]
+
+    if geom.type() == QgsWkbTypes.PolygonGeometry:
+        if geom.isMultipart():
+            return ("MultiPolygon", [[points(ring) for ring in polygon]
+                                     for polygon in geom.asMultiPolygon()])
+        return "Polygon", [points(ring) for ring in geom.asPolygon()]
+    if geom.type() == QgsWkbTypes.LineGeometry:
+        if geom.isMultipart():
+            return ("MultiLineString",
+                    [points(line) for line in geom.asMultiPolyline()])
+        return "LineString", points(geom.asPolyline())
+    if geom.type() == QgsWkbTypes.PointGeometry:
+        if geom.isMultipart():
+            return "MultiPoint", points(geom.asMultiPoint())
+        point = geom.asPoint()
+        return "Point", (point.x(), point.y())
+    return None, None
+
+
+def getJSONValue(value, jsonType=str):
+    if value is None or isinstance(value, QVariant):
+        return None
+    if jsonType is float:
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            return None
+        return value
+    if jsonType in (int, bool):
+        return jsonType(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (QDate, QTime, QDateTime)):
+        return value.toString(Qt.ISODate)
+    return str(value)
 
 
 def add25dAttributes(cleanLayer, layer, canvas):
@@ -294,28 +1435,8 @@ def add25dAttributes(cleanLayer, layer, canvas):
     renderer.startRender(renderContext, fields)
     cleanLayer.startEditing()
     for feat in feats:
-        context.setFeature(feat)
-        height = expression.evaluate(context)
-        if isinstance(renderer, QgsCategorizedSymbolRenderer):
-            classAttribute = renderer.classAttribute()
-            attrValue = feat.attribute(classAttribute)
-            catIndex = renderer.categoryIndexForValue(attrValue)
-            categories = renderer.categories()
-            symbol = categories[catIndex].symbol()
-        elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-            classAttribute = renderer.classAttribute()
-            attrValue = feat.attribute(classAttribute)
-            ranges = renderer.ranges()
-            for range in ranges:
-                if (attrValue >= range.lowerValue() and
-                        attrValue <= range.upperValue()):
-                    symbol = range.symbol().clone()
-        else:
-            symbol = renderer.symbolForFeature(feat, renderContext)
-        sl1 = symbol.symbolLayer(1)
-        sl2 = symbol.symbolLayer(2)
-        wallColor = sl1.subSymbol().color().name()
-        roofColor = sl2.subSymbol().color().name()
+        height, wallColor, roofColor = get25dAttributes(
+            feat, renderer, renderContext, context, expression)
         provider.changeAttributeValues({feat.id() + 1: {heightField: height,
                                                         wallField: wallColor,
                                                         roofField: roofColor}})
@@ -323,201 +1444,277 @@ def add25dAttributes(cleanLayer, layer, canvas):
     renderer.stopRender(renderContext)
 
 
+def get25dAttributes(feat, renderer, renderContext, context, expression):
+    context.setFeature(feat)
+    height = expression.evaluate(context)
+    if isinstance(renderer, QgsCategorizedSymbolRenderer):
+        classAttribute = renderer.classAttribute()
+        attrValue = feat.attribute(classAttribute)
+        catIndex = renderer.categoryIndexForValue(attrValue)
+        categories = renderer.categories()
+        symbol = categories[catIndex].symbol()
+    elif isinstance(renderer, QgsGraduatedSymbolRenderer):
+        classAttribute = renderer.classAttribute()
+        attrValue = feat.attribute(classAttribute)
+        ranges = renderer.ranges()
+        for range in ranges:
+            if (attrValue >= range.lowerValue() and
+                    attrValue <= range.upperValue()):
+                symbol = range.symbol().clone()
+    else:
+        symbol = renderer.symbolForFeature(feat, renderContext)
+    sl1 = symbol.symbolLayer(1)
+    sl2 = symbol.symbolLayer(2)
+    wallColor = sl1.subSymbol().color().name()
+    roofColor = sl2.subSymbol().color().name()
+    return height, wallColor, roofColor
+
+
 def exportRaster(layer, count, layersFolder, feedback, iface, matchCRS):
     feedback.showFeedback("Exporting %s to PNG..." % layer.name())
-    name_ts = safeName(layer.name()) + str(count) + str(int(time.time()))
+    rasterExportJob(layer, count, layersFolder, iface, matchCRS).run()
 
-    # We need to create a new file to export style
-    piped_file = os.path.join(tempfile.gettempdir(), name_ts + '_piped.tif')
+
+def rasterScaleFactor(layer, maxZoom):
+    # How many times coarser than the layer the pixels of the deepest zoom
+    # level are, or 1 if the layer is not finer than that
+    extent = rasterTileExtent(layer)
+    if maxZoom is None or extent.isEmpty() or layer.width() <= 0:
+        return 1
+    resolution = extent.width() / layer.width()
+    return max(1, WEB_MERCATOR_RESOLUTION / 2 ** int(maxZoom) / resolution)
+
+
+def rasterEncoding(layer, encoding):
+    # A layer's own choice of image format in the layer tree takes
+    # precedence over the export-wide one. GDAL builds without WebP
+    # support get PNG instead.
+    override = layer.customProperty("qgis2web/Image format", "Default")
+    if override == AUTOMATIC or override in RASTER_ENCODINGS:
+        encoding = override
+    if encoding == "WebP" and gdal.GetDriverByName("WEBP") is None:
+        QgsMessageLog.logMessage(
+            "WebP is not supported by this GDAL build, exporting %s as PNG" %
+            layer.name(), "qgis2web", level=Qgis.Warning)
+        return "PNG"
+    return encoding
+
+
+def rasterImageExtension(folder, sln):
+    # The extension of the image written for a single-image raster layer,
+    # which is only known once its export has chosen an encoding
+    for extension in ("png", "jpg", "webp"):
+        if os.path.isfile(os.path.join(folder, sln + "." + extension)):
+            return extension
+    return "png"
+
+
+def rasterSamplePixels(sample):
+    # The bands of a sample image, with an opaque alpha band added when it
+    # has none
+    bands = [sample.GetRasterBand(b + 1).ReadRaster()
+             for b in range(min(4, sample.RasterCount))]
+    if len(bands) < 4:
+        bands.append(b"\xff" * len(bands[0]))
+    return bands
+
+
+def chooseRasterEncoding(pixels, webp):
+    # The smallest encoding which keeps what the image shows: a palette
+    # PNG for up to 256 colours, JPEG for opaque images, and WebP (or PNG
+    # where GDAL can't write it) for images with transparency
+    colours = set()
+    for start in range(0, len(pixels[0]), 65536):
+        colours.update(zip(*[band[start:start + 65536] for band in pixels]))
+        if len(colours) > 256:
+            break
+    if len(colours) <= 256:
+        return "Palette PNG"
+    if min(pixels[3]) == 255:
+        return "JPEG"
+    return "WebP" if webp else "PNG"
+
+
+def writePalettePNG(source, path, pixels):
+    # Qt maps every pixel to the nearest of the sample's 256 most common
+    # colours and writes an 8-bit PNG, with per-entry alpha
+    palette = Counter(zip(*pixels)).most_common(256)
+    width, height = source.RasterXSize, source.RasterYSize
+    bands = min(4, source.RasterCount)
+    data = source.ReadRaster(0, 0, width, height,
+                             band_list=list(range(1, bands + 1)),
+                             buf_pixel_space=bands,
+                             buf_line_space=bands * width,
+                             buf_band_space=1)
+    if bands == 4:
+        imageFormat = QImage.Format_RGBA8888
+    else:
+        imageFormat = QImage.Format_RGB888
+    image = QImage(data, width, height, bands * width, imageFormat)
+    image = image.convertToFormat(QImage.Format_Indexed8,
+                                  [qRgba(*colour) for colour, _ in palette],
+                                  Qt.AvoidDither)
+    if not image.save(path, "PNG"):
+        raise Exception("could not write %s" % path)
+
+
+def gdalCancelCallback(complete, message, data):
+    # A GDAL progress callback stopping the operation once the export
+    # running it on this thread is cancelled
+    cancelled = getattr(running, "cancelled", None)
+    return 0 if cancelled is not None and cancelled() else 1
+
+
+def rasterExportJob(layer, count, layersFolder, iface, matchCRS,
+                    maxZoom=None, resampling="Cubic", encoding="PNG",
+                    quality=85):
+    # The layer is rendered with its style into an in-memory GeoTIFF, warped
+    # to EPSG:3857 through a virtual dataset and encoded straight to the
+    # output image, so the pixels are only written to disk once. Detail the
+    # map can't show at its max zoom level is left out of the render, bar a
+    # little the resampling kernel works from, and resampled away before
+    # encoding. Automatic encoding looks at a small nearest-neighbour copy
+    # of the result to pick the image format.
+    name_ts = safeName(layer.name()) + str(count) + str(int(time.time()))
+    piped_file = "/vsimem/qgis2web/%s_piped.tif" % name_ts
 
     piped_extent = layer.extent()
-    # piped_width = layer.height()
-    piped_height = layer.width()
     piped_crs = layer.crs()
-    piped_renderer = layer.renderer()
-    piped_provider = layer.dataProvider()
+    layerName = layer.name()
+    nativePixels = layer.width() * layer.height()
 
     pipe = QgsRasterPipe()
-    pipe.set(piped_provider.clone())
-    pipe.set(piped_renderer.clone())
-
-    file_writer = QgsRasterFileWriter(piped_file)
+    pipe.set(layer.dataProvider().clone())
+    pipe.set(layer.renderer().clone())
 
-    file_writer.writeRaster(pipe, piped_height, -1, piped_extent, piped_crs)
-
-    # Export layer as PNG
-    out_raster = os.path.join(layersFolder,
-                              safeName(layer.name()) + "_" +
-                              str(count) + ".png")
+    # the extension is filled in once the encoding is chosen, and the
+    # cache restores whichever image it holds
+    out_base = os.path.join(layersFolder,
+                            safeName(layer.name()) + "_" + str(count))
+    outputs = [out_base + ".*"]
+    webp = gdal.GetDriverByName("WEBP") is not None
 
     projectCRS = iface.mapCanvas().mapSettings().destinationCrs()
-    if not (matchCRS and layer.crs() == projectCRS):
+    reproject = not (matchCRS and layer.crs() == projectCRS)
+    kernel = RESAMPLING_METHODS[resampling]
+    factor = rasterScaleFactor(layer, maxZoom)
+    renderScale = max(1, factor / RASTER_RENDER_OVERSAMPLING)
+    piped_width = max(1, int(round(layer.width() / renderScale)))
+    piped_height = max(1, int(round(layer.height() / renderScale)))
+    if factor > 1:
+        resolution = WEB_MERCATOR_RESOLUTION / 2 ** int(maxZoom)
+    if reproject:
         # Extent of the layer in EPSG:3857
-        crsSrc = layer.crs()
         crsDest = QgsCoordinateReferenceSystem(3857)
         try:
-            xform = QgsCoordinateTransform(crsSrc, crsDest,
+            xform = QgsCoordinateTransform(piped_crs, crsDest,
                                            QgsProject.instance())
         except Exception:
-            xform = QgsCoordinateTransform(crsSrc, crsDest)
-        extentRep = xform.transformBoundingBox(layer.extent())
-
-        extentRepNew = ','.join([str(extentRep.xMinimum()),
-                                 str(extentRep.xMaximum()),
-                                 str(extentRep.yMinimum()),
-                                 str(extentRep.yMaximum())])
-
-        # Reproject in 3857
-        piped_3857 = os.path.join(tempfile.gettempdir(),
-                                  name_ts + '_piped_3857.tif')
-        # qgis_version = Qgis.QGIS_VERSION
-
-        old_stdout = sys.stdout
-        sys.stdout = mystdout = StringIO()
-        try:
-            processing.algorithmHelp("gdal:warpreproject")
-        except Exception:
-            pass
-        sys.stdout = old_stdout
-
-        params = {
-            "INPUT": piped_file,
-            "SOURCE_CRS": layer.crs().authid(),
-            "TARGET_CRS": "EPSG:3857",
-            "NODATA": 0,
-            "TARGET_RESOLUTION": 0,
-            "RESAMPLING": 2,
-            "TARGET_EXTENT": extentRepNew,
-            "EXT_CRS": "EPSG:3857",
-            "TARGET_EXTENT_CRS": "EPSG:3857",
-            "DATA_TYPE": 0,
-            "COMPRESS": 4,
-            "JPEGCOMPRESSION": 75,
-            "ZLEVEL": 6,
-            "PREDICTOR": 1,
-            "TILED": False,
-            "BIGTIFF": 0,
-            "TFW": False,
-            "MULTITHREADING": False,
-            "COPY_SUBDATASETS": False,
-            "EXTRA": "",
-            "OUTPUT": piped_3857
-        }
-
-        warpArgs = {}
-
-        lines = mystdout.getvalue()
-        for count, line in enumerate(lines.split("\n")):
-            if count != 0 and ":" in line:
-                try:
-                    k = line.split(":")[0]
-                    warpArgs[k] = params[k]
-                except Exception:
-                    pass
-
+            xform = QgsCoordinateTransform(piped_crs, crsDest)
+        extentRep = xform.transformBoundingBox(piped_extent)
+        # as ever, pixels the layer doesn't cover are 0 and left out
+        warpArgs = {"srcSRS": piped_crs.toWkt(),
+                    "dstSRS": "EPSG:3857",
+                    "dstNodata": 0,
+                    "outputBounds": (extentRep.xMinimum(),
+                                     extentRep.yMinimum(),
+                                     extentRep.xMaximum(),
+                                     extentRep.yMaximum())}
+        warpOptions = gdal.WarpOptions(
+            format="VRT",
+            xRes=resolution if factor > 1 else None,
+            yRes=resolution if factor > 1 else None,
+            resampleAlg=kernel,
+            multithread=True,
+            warpOptions=["NUM_THREADS=ALL_CPUS"],
+            **warpArgs)
+    elif factor > 1:
+        resampleOptions = gdal.TranslateOptions(
+            format="VRT",
+            width=max(1, int(round(layer.width() / factor))),
+            height=max(1, int(round(layer.height() / factor))),
+            resampleAlg=kernel)
+
+    def sample(piped, width, height):
+        # Warping a small copy on its own is far cheaper than reading the
+        # full-size virtual warp at a lower resolution
+        scale = min(1.0, float(RASTER_SAMPLE_SIZE) / max(width, height))
+        size = {"width": max(1, int(round(width * scale))),
+                "height": max(1, int(round(height * scale))),
+                "resampleAlg": "near"}
+        if reproject:
+            return gdal.Warp("", piped, format="MEM", **dict(size, **warpArgs))
+        return gdal.Translate("", piped, format="MEM", **size)
+
+    def run():
+        file_writer = QgsRasterFileWriter(piped_file)
         try:
-            processing.run("gdal:warpreproject", warpArgs)
-        except Exception:
-            shutil.copyfile(piped_file, piped_3857)
-
-        try:
-            processing.run("gdal:translate", {"INPUT": piped_3857,
-                                              "OUTSIZE": 100,
-                                              "OUTSIZE_PERC": True,
-                                              "NODATA": 0,
-                                              "EXPAND": 0,
-                                              "TARGET_CRS": "",
-                                              "PROJWIN": extentRepNew,
-                                              "SDS": False,
-                                              "DATA_TYPE": 0,
-                                              "COMPRESS": 4,
-                                              "JPEGCOMPRESSION": 75,
-                                              "ZLEVEL": 6,
-                                              "PREDICTOR": 1,
-                                              "TILED": False,
-                                              "BIGTIFF": 0,
-                                              "TFW": False,
-                                              "COPY_SUBDATASETS": False,
-                                              "OPTIONS": "",
-                                              "OUTPUT": out_raster})
-        except Exception:
-            shutil.copyfile(piped_3857, out_raster)
-    else:
-        srcExtent = ','.join([str(piped_extent.xMinimum()),
-                              str(piped_extent.xMaximum()),
-                              str(piped_extent.yMinimum()),
-                              str(piped_extent.yMaximum())])
-        processing.run("gdal:translate", {"INPUT": piped_file,
-                                          "OUTSIZE": 100,
-                                          "OUTSIZE_PERC": True,
-                                          "NODATA": 0,
-                                          "EXPAND": 0,
-                                          "TARGET_CRS": "",
-                                          "PROJWIN": srcExtent,
-                                          "SDS": False,
-                                          "DATA_TYPE": 0,
-                                          "COMPRESS": 4,
-                                          "JPEGCOMPRESSION": 75,
-                                          "ZLEVEL": 6,
-                                          "PREDICTOR": 1,
-                                          "TILED": False,
-                                          "BIGTIFF": 0,
-                                          "TFW": False,
-                                          "COPY_SUBDATASETS": False,
-                                          "OPTIONS": "",
-                                          "OUTPUT": out_raster})
+            error = file_writer.writeRaster(pipe, piped_width, piped_height,
+                                            piped_extent, piped_crs)
+            if error != QgsRasterFileWriter.NoError:
+                raise Exception("could not render %s" % layerName)
+            checkCancelled()
+            piped = gdal.Open(piped_file)
+            source = piped
+            if reproject:
+                # the warp only runs as the image driver reads the VRT
+                source = gdal.Warp("", piped, options=warpOptions)
+            elif factor > 1:
+                source = gdal.Translate("", piped, options=resampleOptions)
+            width, height = source.RasterXSize, source.RasterYSize
+            chosen = encoding
+            if encoding in (AUTOMATIC, "Palette PNG"):
+                pixels = rasterSamplePixels(sample(piped, width, height))
+                if encoding == AUTOMATIC:
+                    chosen = chooseRasterEncoding(pixels, webp)
+            extension, driver = RASTER_ENCODINGS[chosen]
+            out_raster = out_base + "." + extension
+            if chosen == "Palette PNG":
+                writePalettePNG(source, out_raster, pixels)
+            else:
+                options = {"format": driver, "callback": gdalCancelCallback}
+                if driver == "PNG":
+                    # so the PNG shows nodata as transparent
+                    options["noData"] = 0
+                else:
+                    options["creationOptions"] = ["QUALITY=%d" % quality]
+                if driver == "JPEG":
+                    options["bandList"] = [1, 2, 3]
+                if gdal.Translate(out_raster, source, **options) is None:
+                    checkCancelled()
+                    raise Exception(gdal.GetLastErrorMsg())
+            outputs[0] = out_raster
+            source = piped = None
+        finally:
+            gdal.Unlink(piped_file)
+        summary = "Encoded %s as %s" % (layerName, chosen)
+        if factor > 1:
+            saved = max(0, nativePixels - width * height)
+            summary += (", resampled to %d x %d for zoom %d: %d of %d pixels "
+                        "saved (%d%%)" % (width, height, int(maxZoom), saved,
+                                          nativePixels,
+                                          100 * saved / nativePixels))
+        return summary
+
+    settings = (os.path.basename(out_base), reproject, projectCRS.authid(),
+                factor, kernel, encoding, quality)
+    label = "image" if encoding == AUTOMATIC else encoding
+    # Rendering through the layer's pipe and GDAL's own threads aren't
+    # safe to share with other jobs, so it runs on the exporting thread
+    size = int(nativePixels / factor ** 2) // PIXELS_PER_FEATURE
+    return ExportJob(layer, 'Exporting %s to %s' % (layer.name(), label),
+                     size, run, outputs=outputs, settings=settings,
+                     threaded=False)
 
 
 def is25d(layer, canvas, restrictToExtent, extent):
-    if layer.type() != layer.VectorLayer:
-        return False
-    if layer.geometryType() != QgsWkbTypes.PolygonGeometry:
-        return False
-    vts = layer.customProperty("VectorTilesReader/vector_tile_source")
-    if vts is not None:
-        return False
-    renderer = layer.renderer()
-    if isinstance(renderer, QgsNullSymbolRenderer):
-        return False
-    if isinstance(renderer, Qgs25DRenderer):
-        return True
-    symbols = []
-    if isinstance(renderer, QgsCategorizedSymbolRenderer):
-        categories = renderer.categories()
-        for category in categories:
-            symbols.append(category.symbol())
-    elif isinstance(renderer, QgsGraduatedSymbolRenderer):
-        ranges = renderer.ranges()
-        for range in ranges:
-            symbols.append(range.symbol())
-    elif isinstance(renderer, QgsRuleBasedRenderer):
-        rules = renderer.rootRule().children()
-        for rule in rules:
-            symbols.append(rule.symbol())
-    else:
-        renderContext = QgsRenderContext.fromMapSettings(canvas.mapSettings())
-        fields = layer.fields()
-        if restrictToExtent and extent == "Canvas extent":
-            request = QgsFeatureRequest(canvas.extent())
-            request.setFlags(QgsFeatureRequest.ExactIntersect)
-            features = layer.getFeatures(request)
-        else:
-            features = layer.getFeatures()
-        renderer.startRender(renderContext, fields)
-        for feature in features:
-            symbol = renderer.symbolForFeature(feature, renderContext)
-            symbols.append(symbol)
-        renderer.stopRender(renderContext)
-    for sym in symbols:
-        try:
-            sl1 = sym.symbolLayer(1)
-            sl2 = sym.symbolLayer(2)
-        except IndexError:
-            return False
-        if (isinstance(sl1, QgsGeometryGeneratorSymbolLayer) and
-                isinstance(sl2, QgsGeometryGeneratorSymbolLayer)):
-            return True
-    return False
+    # Only layers drawn with a default renderer need their features read,
+    # which is done once per export by the layer's analysis
+    quick = quick25d(layer)
+    if quick is not None:
+        return quick
+    return analyseLayer(layer, canvas).is25d(
+        restrictToExtent and extent == "Canvas extent")
 
 
 def safeName(name):
@@ -589,20 +1786,9 @@ def replaceInTemplate(template, values):
 
 
 def exportImages(layer, field, layerFileName):
-    field_index = layer.fields().indexFromName(field)
-
-    widget = layer.editorWidgetSetup(field_index).type()
-    if widget != 'ExternalResource':
-        return
-
-    fr = QgsFeatureRequest()
-    fr.setSubsetOfAttributes([field_index])
-
-    for feature in layer.getFeatures(fr):
-        photo_file_name = feature.attribute(field)
-        if type(photo_file_name) is not str:
-            continue
-
+    # the file names come from the layer's analysis, so every
+    # ExternalResource field is read in the same pass
+    for photo_file_name in analyseLayer(layer).images(field):
         source_file_name = photo_file_name
         if not os.path.isabs(source_file_name):
             prj_fname = QgsProject.instance().fileName()
@@ -635,6 +1821,18 @@ def getRGBAColor(color, alpha):
     return "'rgba(%s)'" % ",".join([r, g, b, str(a)])
 
 
+# Distinct values of a str filter field, or the minimum and maximum of a
+# range filter field, asked of the provider's aggregates rather than read
+# from every feature. Nulls are left out
+def filterAggregates(layer, index, fieldType):
+    if fieldType == "str":
+        values = layer.uniqueValues(index)
+    else:
+        values = [layer.minimumValue(index), layer.maximumValue(index)]
+    return [value for value in values
+            if value is not None and not isinstance(value, QVariant)]
+
+
 def boilType(fieldType):
     fType = None
     if fieldType.lower() in ["boolean", "bool"]:
@@ -665,18 +1863,15 @@ def returnFilterValues(layer_list, fieldName, fieldType):
     for layer in layer_list:
         if layer.type() == layer.VectorLayer:
             fields = layer.fields()
-            for f in fields:
-                if boilType(f.typeName()) == fieldType:
-                    if f.name() == fieldName:
-                        iterator = layer.getFeatures()
-                        for feature in iterator:
-                            if feature[fieldName] is not None:
-                                filterValues.append(feature[fieldName])
+            index = fields.indexFromName(fieldName)
+            if (index >= 0 and
+                    boilType(fields.at(index).typeName()) == fieldType):
+                filterValues.extend(filterAggregates(layer, index,
+                                                     fieldType))
     if filterValues == []:
         return
     if fieldType == "str":
-        cleanFilterValues = list(dict.fromkeys(filterValues))
-        cleanFilterValues.sort()
+        cleanFilterValues = sorted(set(filterValues))
     if fieldType == "int":
         cleanFilterValues = [min(filterValues) if min(filterValues) >= 0
                              else 0,
@@ -685,8 +1880,7 @@ def returnFilterValues(layer_list, fieldName, fieldType):
         if cleanFilterValues[0] == cleanFilterValues[1]:
             cleanFilterValues[1] = cleanFilterValues[0] + 1
     if fieldType in ["date", "time", "real", "datetime"]:
-        cleanFilterValues = [min(filter(None, filterValues)),
-                             max(filterValues)]
+        cleanFilterValues = [min(filterValues), max(filterValues)]
         if cleanFilterValues[0] == cleanFilterValues[1]:
             if fieldType == "real":
                 add = 1 / 10 * (cleanFilterValues[1] - cleanFilterValues[0])
@@ -30,6 +30,9 @@ class WriterResult(object):
         self.index_file = None
         self.folder = None
         self.files = []
+        # names of the layers whose data was exported rather than
+        # reused from the export cache
+        self.rebuilt_layers = []
 
 
 class Writer(object):
@@ -21,6 +21,7 @@ from qgis.PyQt.QtCore import QObject
 
 from qgis2web.olwriter import OpenLayersWriter
 from qgis2web.leafletWriter import LeafletWriter
+from qgis2web.mapboxWriter import MapboxWriter
 from qgis2web.configparams import getDefaultParams
 
 translator = QObject()
@@ -34,7 +35,7 @@ class WriterRegistry(object):
 
     def __init__(self):
         self.writers = {e.type(): e for e in
-                        [OpenLayersWriter, LeafletWriter]}
+                        [OpenLayersWriter, LeafletWriter, MapboxWriter]}
 
     def getWriters(self):
         """